@@ -23,11 +23,38 @@ bl_info = {
 }
 
 
-import bpy, bmesh, time
+import bpy, bmesh, time, json
 from bpy.utils import register_class, unregister_class
 from bpy.types import Menu
 from bpy.types import Operator
-from bpy.props import IntProperty, FloatProperty, BoolProperty, PointerProperty, EnumProperty
+from bpy.props import IntProperty, FloatProperty, BoolProperty, PointerProperty, EnumProperty, StringProperty
+from bpy_extras.io_utils import ExportHelper
+
+def tag_preview_redraw(self, context):
+    """
+    Redraws every 3D viewport when a setting the replacement preview shows is changed.
+    """
+
+    for window in context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+
+# The replace methods and their names, in the order they're listed in gardener_frond_replace_type.
+REPLACE_TYPE_NAMES = (
+    ('Hierarchy', 'Hierarchy'),
+    ('Thickness', 'Thickness'),
+    ('Length', 'Length'),
+    ('HierarchyThickness', 'Hierarchy + Thickness'),
+    ('HierarchyLength', 'Hierarchy + Length'),
+    ('SubtreeLength', 'Subtree Length'),
+    ('HierarchySubtreeLength', 'Hierarchy + Subtree Length'),
+)
+
+# The smallest gardener_length_cutoff can be set to, Fit to Budget stays at or above it too.
+MIN_LENGTH_CUTOFF = 0.01
+
 
 class GARDENER_PT_MainPanel(bpy.types.Panel):
     """Creates a Panel in the Object properties window"""
@@ -48,6 +75,8 @@ class GARDENER_PT_MainPanel(bpy.types.Panel):
         #row.use_property_split = True
         #row.use_property_decorate = False
         row.prop(scene, "gardener_use_fronds")
+        row.prop(scene, "gardener_verbose")
+        row.prop(scene, "gardener_cache_branches")
 
 
 class GARDENER_PT_FrondSettings(bpy.types.Panel):
@@ -64,6 +93,8 @@ class GARDENER_PT_FrondSettings(bpy.types.Panel):
         row.use_property_split = True
         row.use_property_decorate = False
         row.prop(scene, "gardener_frond_collection")
+        row.prop(scene, "gardener_frond_match_weight")
+        row.prop(scene, "gardener_preview")
         row.separator()
         row.prop(scene, "gardener_frond_replace_type")
         row.separator()
@@ -73,13 +104,16 @@ class GARDENER_PT_FrondSettings(bpy.types.Panel):
             row.prop(scene, "gardener_thickness_cutoff")
         elif replace_type == 'Hierarchy':
             row.prop(scene, "gardener_hierarchy_cutoff")
-        elif replace_type == 'Length':
+            row.prop(scene, "gardener_hierarchy_reverse")
+        elif replace_type in ('Length', 'SubtreeLength'):
             row.prop(scene, "gardener_length_cutoff")
         elif replace_type == 'HierarchyThickness':
             row.prop(scene, "gardener_hierarchy_cutoff")
+            row.prop(scene, "gardener_hierarchy_reverse")
             row.prop(scene, "gardener_thickness_cutoff")
-        elif replace_type == 'HierarchyLength':
+        elif replace_type in ('HierarchyLength', 'HierarchySubtreeLength'):
             row.prop(scene, "gardener_hierarchy_cutoff")
+            row.prop(scene, "gardener_hierarchy_reverse")
             row.prop(scene, "gardener_length_cutoff")
 
         
@@ -88,6 +122,10 @@ class GARDENER_PT_FrondSettings(bpy.types.Panel):
         row.prop(scene, "gardener_stretch_factor_x")
         row.prop(scene, "gardener_stretch_factor_yz")
         row.separator()
+        row.prop(scene, "gardener_frond_output")
+        if scene.gardener_frond_output == 'Instances':
+            row.prop(scene, "gardener_realize_fronds")
+        row.separator()
 
 class GARDENER_PT_LoopSettings(bpy.types.Panel):
     bl_space_type = "VIEW_3D"
@@ -105,7 +143,11 @@ class GARDENER_PT_LoopSettings(bpy.types.Panel):
 
         
         row.prop(scene, "gardener_reduce_edgeloops")
-        row.prop(scene, "gardener_edgeloop_reduce_factor")
+        row.prop(scene, "gardener_edgeloop_reduce_mode")
+        if scene.gardener_edgeloop_reduce_mode == 'Tolerance':
+            row.prop(scene, "gardener_edgeloop_tolerance")
+        else:
+            row.prop(scene, "gardener_edgeloop_reduce_factor")
 
 class GARDENER_PT_Normals(bpy.types.Panel):
     bl_space_type = "VIEW_3D"
@@ -122,6 +164,7 @@ class GARDENER_PT_Normals(bpy.types.Panel):
         row.use_property_decorate = False
 
         row.prop(scene, "gardener_normal_use_reproject")
+        row.prop(scene, "gardener_normal_reproject_mode")
         row.prop(scene, "gardener_normal_hull_res")
         row.prop(scene, "gardener_normal_hull_size")
     
@@ -143,9 +186,187 @@ class GARDENER_PT_DataLayers(bpy.types.Panel):
         row.prop(scene, "gardener_datalayer_trunktobranch")
         row.prop(scene, "gardener_datalayer_branchtofrond")
         row.prop(scene, "gardener_datalayer_branchgroup")
+        row.prop(scene, "gardener_branch_group_seed")
         row.separator()
         row.prop(scene, "gardener_merge_layers")
 
+class GARDENER_PT_Polycount(bpy.types.Panel):
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_label = "Polycount"
+    bl_parent_id = "GARDENER_PT_MainPanel"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = bpy.context.scene
+
+        row = layout.column(align=False)
+        row.use_property_split = True
+        row.use_property_decorate = False
+        row.prop(scene, "gardener_count_polygons")
+
+        # The count of the last tree built with Count Polygons on is left in the driver namespace by The Grove.
+        poly_count = bpy.app.driver_namespace.get('gardener_poly_count')
+        if poly_count is None:
+            row.label(text="Build a tree with Count Polygons on to get counts without building.")
+            return
+
+        table = poly_count['table']
+        length_cutoff = scene.gardener_length_cutoff / poly_count['scale_to_twig']
+
+        grid = layout.grid_flow(row_major=True, columns=4, even_columns=False, align=True)
+        for heading in ("Replace Method", "Vertices", "Faces", "Triangles"):
+            grid.label(text=heading)
+        for replace_type, name in REPLACE_TYPE_NAMES:
+            totals = table.totals(scene.gardener_use_fronds, replace_type, scene.gardener_thickness_cutoff,
+                                  scene.gardener_hierarchy_cutoff, length_cutoff, scene.gardener_hierarchy_reverse,
+                                  scene.gardener_frond_output)
+            icon = 'RIGHTARROW' if replace_type == scene.gardener_frond_replace_type else 'BLANK1'
+            grid.label(text=name, icon=icon)
+            for total in totals:
+                grid.label(text=str(total))
+
+        row = layout.column(align=False)
+        row.use_property_split = True
+        row.use_property_decorate = False
+        row.separator()
+        row.prop(scene, "gardener_triangle_budget")
+        row.operator("gardener.fit_triangle_budget", icon='MOD_DECIM')
+
+
+class GARDENER_OT_FitTriangleBudget(Operator):
+    """Sets the cutoff the current Replace Method uses to get as close to the triangle budget as possible"""
+
+    bl_idname = "gardener.fit_triangle_budget"
+    bl_label = "Fit to Budget"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.gardener_use_fronds and 'gardener_poly_count' in bpy.app.driver_namespace
+
+    def execute(self, context):
+        scene = context.scene
+        poly_count = bpy.app.driver_namespace['gardener_poly_count']
+        scale_to_twig = poly_count['scale_to_twig']
+
+        cutoff, value, triangles = poly_count['table'].solve(scene.gardener_triangle_budget, 
+                                                             scene.gardener_frond_replace_type,
+                                                             scene.gardener_thickness_cutoff,
+                                                             scene.gardener_hierarchy_cutoff,
+                                                             scene.gardener_length_cutoff / scale_to_twig,
+                                                             scene.gardener_hierarchy_reverse,
+                                                             scene.gardener_frond_output,
+                                                             MIN_LENGTH_CUTOFF / scale_to_twig)
+
+        if cutoff == 'thickness':
+            scene.gardener_thickness_cutoff = value
+        elif cutoff == 'hierarchy':
+            scene.gardener_hierarchy_cutoff = int(value)
+        else:
+            scene.gardener_length_cutoff = value * scale_to_twig
+
+        self.report({'INFO'}, "{} cutoff set to {:.3f}, {} triangles with {} fronds".format(
+            cutoff.title(), value, triangles, 'instanced' if scene.gardener_frond_output == 'Instances' else 'mesh'))
+        return {'FINISHED'}
+
+
+class GARDENER_PT_LevelsOfDetail(bpy.types.Panel):
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_label = "Levels of Detail"
+    bl_parent_id = "GARDENER_PT_MainPanel"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = bpy.context.scene
+
+        row = layout.column(align=False)
+        row.use_property_split = True
+        row.use_property_decorate = False
+        row.prop(scene, "gardener_lod_levels")
+
+        row = layout.column(align=False)
+        row.use_property_split = True
+        row.use_property_decorate = False
+        row.enabled = scene.gardener_lod_levels > 1
+        row.prop(scene, "gardener_lod_cutoff_scale")
+        row.prop(scene, "gardener_lod_resolution_scale")
+        row.prop(scene, "gardener_lod_edgeloop_step")
+
+
+class GARDENER_PT_BuildProfile(bpy.types.Panel):
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_label = "Build Profile"
+    bl_parent_id = "GARDENER_PT_MainPanel"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = bpy.context.scene
+
+        row = layout.column(align=False)
+        row.use_property_split = True
+        row.use_property_decorate = False
+        row.prop(scene, "gardener_profile_build")
+
+        if scene.gardener_profile_report == "":
+            row.label(text="Build a tree with Profile Builds on to see where the time goes.")
+            return
+
+        report = json.loads(scene.gardener_profile_report)
+
+        row.prop(scene, "gardener_profile_sort")
+        row.separator()
+
+        sort_key = {'Order': 'order', 'Time': 'seconds', 'NetBlocks': 'net_blocks', 'Calls': 'calls'}
+        stages = sorted(report['stages'], key=lambda stage: stage[sort_key[scene.gardener_profile_sort]],
+                        reverse=scene.gardener_profile_sort != 'Order')
+
+        grid = layout.grid_flow(row_major=True, columns=4, even_columns=False, align=True)
+        for heading in ("Stage", "Time", "Net Blocks", "Calls"):
+            grid.label(text=heading)
+        for stage in stages:
+            grid.label(text=stage['stage'])
+            grid.label(text="{:.3f}s".format(stage['seconds']))
+            grid.label(text=str(stage['net_blocks']))
+            grid.label(text=str(stage['calls']))
+
+        row = layout.column(align=False)
+        row.separator()
+        row.label(text="{} - {:.3f}s total, {} vertices".format(report.get('preset', ''), 
+                                                                 report['total_seconds'], report.get('vertices', 0)))
+        row.operator("gardener.export_build_profile", icon='EXPORT')
+
+
+class GARDENER_OT_ExportBuildProfile(Operator, ExportHelper):
+    """Saves the last build profile as a JSON file"""
+
+    bl_idname = "gardener.export_build_profile"
+    bl_label = "Export Build Profile"
+
+    filename_ext = ".json"
+    filter_glob: StringProperty(default="*.json", options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.gardener_profile_report != ""
+
+    def invoke(self, context, event):
+        # Stamp the file name so profiles from different builds don't overwrite each other.
+        self.filepath = "gardener_profile_" + time.strftime("%Y%m%d_%H%M%S") + self.filename_ext
+        return ExportHelper.invoke(self, context, event)
+
+    def execute(self, context):
+        with open(self.filepath, 'w') as f:
+            f.write(context.scene.gardener_profile_report)
+
+        self.report({'INFO'}, "Build profile saved to " + self.filepath)
+        return {'FINISHED'}
+
 
 
 classes = (
@@ -154,6 +375,11 @@ classes = (
     GARDENER_PT_LoopSettings,
     GARDENER_PT_Normals,
     GARDENER_PT_DataLayers,
+    GARDENER_PT_Polycount,
+    GARDENER_OT_FitTriangleBudget,
+    GARDENER_PT_LevelsOfDetail,
+    GARDENER_PT_BuildProfile,
+    GARDENER_OT_ExportBuildProfile,
     
 )
 
@@ -165,6 +391,19 @@ def register():
         name="Build with Grove Gardener",
         description="If true, Grove Gardener will be used during the build process to replace branches and perform other tasks",
         default=False,
+        update=tag_preview_redraw,
+    )
+
+    bpy.types.Scene.gardener_verbose = BoolProperty(
+        name="Debug Output",
+        description="If true, Grove Gardener will print diagnostic messages to the console while building.  This slows down builds on large trees, so only turn it on when something looks wrong",
+        default=False,
+    )
+
+    bpy.types.Scene.gardener_cache_branches = BoolProperty(
+        name="Reuse Branches",
+        description="If true, Grove Gardener keeps every branch it builds and reuses it on the next build if nothing that affects it has changed, so tweaking settings on a finished tree only rebuilds the branches they touch.  Uses extra memory while on",
+        default=True,
     )
 
     bpy.types.Scene.gardener_frond_replace_type = EnumProperty(
@@ -176,7 +415,10 @@ def register():
         ('Length', 'Length', "This replaces a branch with a frond if the length of the branch is lower than the amount set"),
         ('HierarchyThickness', 'Hierarchy + Thickness', "This replaces branches based on hierarchy parameters first, then if that check succeeds the replacement will occur if the thickness of the tree is lower than the amount set"),
         ('HierarchyLength', 'Hierarchy + Length', "This replaces branches based on hierarchy parameters first, then if that check succeeds the replacement will occur if the length parameter is lower than the amount set"),
+        ('SubtreeLength', 'Subtree Length', "This replaces a branch with a frond if the branch and everything growing from it add up to a length lower than the amount set"),
+        ('HierarchySubtreeLength', 'Hierarchy + Subtree Length', "This replaces branches based on hierarchy parameters first, then if that check succeeds the replacement will occur if the branch and everything growing from it add up to a length lower than the amount set"),
         ),
+        update=tag_preview_redraw,
     )
 
     bpy.types.Scene.gardener_thickness_cutoff = FloatProperty(
@@ -188,6 +430,7 @@ def register():
         step=100, 
         precision=2, 
         subtype='FACTOR',
+        update=tag_preview_redraw,
     )
 
     bpy.types.Scene.gardener_hierarchy_cutoff = IntProperty(
@@ -197,22 +440,32 @@ def register():
         min=1, 
         soft_max=6, 
         subtype='FACTOR',
+        update=tag_preview_redraw,
     )
 
     bpy.types.Scene.gardener_length_cutoff = FloatProperty(
         name="Length Cutoff",
         description="Decides the length that branches have to be smaller than in order to be replaced by a frond",
         default=0.2, 
-        min=0.01, 
+        min=MIN_LENGTH_CUTOFF, 
         soft_max=1, 
         precision=2, 
         subtype='DISTANCE',
+        update=tag_preview_redraw,
     )
 
     bpy.types.Scene.gardener_hierarchy_reverse = BoolProperty(
         name="Reverse Hierarchy",
-        description="If true, the hierarchy cutoff is calculated from the ends of each branch rather than from the trunk.  For certain kinds of trees that feature a lot of asymmetry this is extremely useful",
+        description="If true, the hierarchy cutoff is calculated from the ends of each branch rather than from the trunk, replacing branches with no more than that many levels of branches out to their furthest tip (counting themselves).  For certain kinds of trees that feature a lot of asymmetry this is extremely useful",
         default=False, 
+        update=tag_preview_redraw,
+    )
+
+    bpy.types.Scene.gardener_preview = BoolProperty(
+        name="Preview Replacement",
+        description="If true, the last tree built with this on is drawn in the viewport as a skeleton, with a box for every branch that would be replaced by a frond.  The preview follows the replacement settings as they change, without having to build the tree again",
+        default=False,
+        update=tag_preview_redraw,
     )
 
     bpy.types.Scene.gardener_frond_collection = PointerProperty(
@@ -221,6 +474,18 @@ def register():
         description="The collection of objects that will be used as Fronds. Grove Gardener will match the length of branches you provide with the length of the twig to be replaced as closely as possible.",
     )
 
+    bpy.types.Scene.gardener_frond_match_weight = FloatProperty(
+        name="Width Matching",
+        description="Fronds are always picked by how closely their length matches the branch.  Above zero, fronds of a similar length will also be compared by how well their width and tip spread fit the thickness and shape of the branch",
+        default=0.0, 
+        min=0.0, 
+        soft_max=1.0, 
+        step=10, 
+        precision=2, 
+        subtype='FACTOR',
+        update=tag_preview_redraw,
+    )
+
     bpy.types.Scene.gardener_smooth_factor = FloatProperty(
         name="Smoothing",
         description="Determines the tightness of a bend that Gardener will select to automatically smooth.  WARNING - Work in progress, high values may yield weird results.  When pruning this value will make the frond move away from the actual location of the branch data so beeeee careful!",
@@ -241,6 +506,7 @@ def register():
         step=10, 
         precision=2, 
         subtype='FACTOR',
+        update=tag_preview_redraw,
     )
 
     bpy.types.Scene.gardener_stretch_factor_yz = FloatProperty(
@@ -252,6 +518,23 @@ def register():
         step=10, 
         precision=2, 
         subtype='FACTOR',
+        update=tag_preview_redraw,
+    )
+
+    bpy.types.Scene.gardener_frond_output = EnumProperty(
+        name="Frond Output",
+        description="Determines how fronds are added to the tree",
+        items=(
+        ('Mesh', 'Mesh', "Every frond is copied into the tree mesh, bent along the branch it replaces"),
+        ('Instances', 'Instances', "Every frond is a Geometry Nodes instance of its object in the Frond Collection, placed on a point of a child object of the tree.  Fronds don't bend along their branch, but huge trees build and draw far faster and take far less memory"),
+        ),
+        default='Mesh',
+    )
+
+    bpy.types.Scene.gardener_realize_fronds = BoolProperty(
+        name="Realize Instances",
+        description="If true, the frond instances are turned into real geometry after the build, for exporting",
+        default=False,
     )
 
     bpy.types.Scene.gardener_reduce_edgeloops = BoolProperty(
@@ -260,6 +543,27 @@ def register():
         default=False,
     )
 
+    bpy.types.Scene.gardener_edgeloop_reduce_mode = EnumProperty(
+        name="Reduce Method",
+        description="Determines how edge loops are picked for removal",
+        items=(
+        ('Angle', 'Angle', "Removes loops where the branch barely bends, going along the branch one loop at a time"),
+        ('Tolerance', 'Tolerance', "Keeps the fewest loops that hold the shape, thickness and texture of every branch within the tolerance set.  Removes more loops than Angle for the same look, and doesn't depend on how many nodes the tree grew"),
+        ),
+        default='Angle',
+    )
+
+    bpy.types.Scene.gardener_edgeloop_tolerance = FloatProperty(
+        name="Tolerance",
+        description="How far the bark may move, or its texture slide, where an edge loop is removed",
+        default=0.005, 
+        min=0.0, 
+        soft_max=0.05, 
+        step=0.1, 
+        precision=4, 
+        subtype='DISTANCE',
+    )
+
     bpy.types.Scene.gardener_edgeloop_reduce_factor = FloatProperty(
         name="Edge Loop Angle Limit",
         description="Controls the aggressiveness of the edge loop removal code.  A lower number will remove more loops.  WARNING - Work in progress, results will often look a lil jagged",
@@ -277,6 +581,16 @@ def register():
         default=True,
     )
 
+    bpy.types.Scene.gardener_normal_reproject_mode = EnumProperty(
+        name="Hull Method",
+        description="Determines how the hull used to reproject normals is built",
+        items=(
+        ('Field', 'Field', "Builds a smoothed volume from the tree's vertices and points frond normals out of it.  Much faster, doesn't duplicate the tree or use operators"),
+        ('Remesh', 'Remesh', "Duplicates the tree and remeshes it into a hull using modifiers and edit mode operators.  Slow on detailed hulls"),
+        ),
+        default='Field',
+    )
+
     bpy.types.Scene.gardener_normal_hull_res = FloatProperty(
         name="Hull Resolution",
         description="Affects the voxel size of the normal hull used to create smoother tree normals",
@@ -311,7 +625,7 @@ def register():
 
     bpy.types.Scene.gardener_datalayer_branchtofrond = BoolProperty(
         name="Branch to Frond",
-        description="Adds an additional vertex group to bake the relative distance between the branch mesh and the tips of every frond mesh",
+        description="Adds an additional vertex group to bake the distance along the branches from every vertex to the closest frond tip, 0 at the tips and 1 furthest from any",
         default=False,
     )
 
@@ -321,18 +635,106 @@ def register():
         default=False,
     )
     
+    bpy.types.Scene.gardener_branch_group_seed = IntProperty(
+        name="Branch Group Seed",
+        description="The seed used to shuffle Branch Group values.  The same tree and seed will always give every branch group the same value",
+        default=0, 
+        min=0, 
+    )
+    
     bpy.types.Scene.gardener_merge_layers = BoolProperty(
         name="Build Vertex Colors",
         description="This will create a Vertex Color layer called 'Combined Layers' that will contain color channels for Height, Trunk to Branch, Branch to Frond and Branch Group in the RGBA slots respectively.  IF YOU WANT TO USE THESE LAYERS IN A GAME ENGINE YOU MUST TICK THIS! \o/",
         default=False,
     )
+
+    bpy.types.Scene.gardener_count_polygons = BoolProperty(
+        name="Count Polygons",
+        description="If true, every build also counts what each branch would add to the mesh both as bark and as a frond, so the Polycount panel can show the count for any cutoff and fit the cutoffs to a triangle budget without building again.  Makes builds a little slower",
+        default=False,
+    )
+
+    bpy.types.Scene.gardener_triangle_budget = IntProperty(
+        name="Triangle Budget",
+        description="The number of triangles Fit to Budget aims for, twigs included",
+        default=20000,
+        min=0,
+        soft_max=200000,
+    )
+
+    bpy.types.Scene.gardener_lod_levels = IntProperty(
+        name="Levels",
+        description="The number of meshes built for every tree, from the full tree down.  Every level past the first is added as a child of the tree named after the preset with _LOD and the level on the end, with the screen size it should take over at stored as gardener_lod_screen_size.  1 builds just the tree",
+        default=1,
+        min=1,
+        max=4,
+    )
+
+    bpy.types.Scene.gardener_lod_cutoff_scale = FloatProperty(
+        name="Cutoff Scale",
+        description="Every level multiplies the thickness and length cutoffs by this and lowers the hierarchy cutoff by one, so more of the tree is replaced by fronds",
+        default=2.0,
+        min=1.0,
+        soft_max=4.0,
+    )
+
+    bpy.types.Scene.gardener_lod_resolution_scale = FloatProperty(
+        name="Resolution Scale",
+        description="Every level multiplies the profile resolution of the branches by this, down to 3",
+        default=0.6,
+        min=0.1,
+        max=1.0,
+    )
+
+    bpy.types.Scene.gardener_lod_edgeloop_step = FloatProperty(
+        name="Edge Loop Step",
+        description="Every level past the first reduces edge loops, with the Edge Loop Angle Limit lowered by this much per level.  In Tolerance mode the tolerance is scaled by Cutoff Scale instead",
+        default=0.05,
+        min=0.0,
+        max=0.5,
+    )
+
+    bpy.types.Scene.gardener_profile_build = BoolProperty(
+        name="Profile Builds",
+        description="If true, Grove Gardener will time every stage of a build and count the memory blocks it leaves allocated (net, so memory a stage frees again doesn't show), so you can see which settings make builds slow",
+        default=False,
+    )
+
+    bpy.types.Scene.gardener_profile_report = StringProperty(
+        name="Build Profile",
+        description="The timings of the last profiled build as JSON",
+        default="",
+        options={'HIDDEN'},
+    )
+
+    bpy.types.Scene.gardener_profile_sort = EnumProperty(
+        name="Sort By",
+        description="How the stages of the build profile are ordered",
+        items=(
+        ('Order', 'Build Order', "Lists stages in the order they happen during a build"),
+        ('Time', 'Time', "Lists the slowest stages first"),
+        ('NetBlocks', 'Net Blocks', "Lists the stages that leave the most memory blocks allocated first"),
+        ('Calls', 'Calls', "Lists the stages that ran the most times first"),
+        ),
+        default='Time',
+    )
     
 
 def unregister():
 
+    # The Grove starts listening for edits to frond objects the first time it loads them, stop that here.
+    handlers = bpy.app.handlers.depsgraph_update_post
+    for handler in list(handlers):
+        if getattr(handler, '__name__', None) == 'frond_cache_update':
+            handlers.remove(handler)
+
     del bpy.types.Scene.gardener_use_fronds
+    del bpy.types.Scene.gardener_verbose
+    del bpy.types.Scene.gardener_cache_branches
     del bpy.types.Scene.gardener_frond_collection
     del bpy.types.Scene.gardener_frond_replace_type
+    del bpy.types.Scene.gardener_frond_match_weight
+    del bpy.types.Scene.gardener_preview
 
     del bpy.types.Scene.gardener_thickness_cutoff
     del bpy.types.Scene.gardener_hierarchy_cutoff
@@ -342,17 +744,37 @@ def unregister():
     del bpy.types.Scene.gardener_smooth_factor
     del bpy.types.Scene.gardener_stretch_factor_x
     del bpy.types.Scene.gardener_stretch_factor_yz
+    del bpy.types.Scene.gardener_frond_output
+    del bpy.types.Scene.gardener_realize_fronds
     
     del bpy.types.Scene.gardener_reduce_edgeloops
+    del bpy.types.Scene.gardener_edgeloop_reduce_mode
+    del bpy.types.Scene.gardener_edgeloop_tolerance
     del bpy.types.Scene.gardener_edgeloop_reduce_factor
 
     del bpy.types.Scene.gardener_normal_use_reproject
+    del bpy.types.Scene.gardener_normal_reproject_mode
     del bpy.types.Scene.gardener_normal_hull_res
     del bpy.types.Scene.gardener_normal_hull_size
 
-    del bpy.types.Scene.gardener_datalayer_x
-    del bpy.types.Scene.gardener_datalayer_y
-    del bpy.types.Scene.gardener_datalayer_z
+    del bpy.types.Scene.gardener_datalayer_height
+    del bpy.types.Scene.gardener_datalayer_trunktobranch
+    del bpy.types.Scene.gardener_datalayer_branchtofrond
+    del bpy.types.Scene.gardener_datalayer_branchgroup
+    del bpy.types.Scene.gardener_branch_group_seed
+    del bpy.types.Scene.gardener_merge_layers
+
+    del bpy.types.Scene.gardener_count_polygons
+    del bpy.types.Scene.gardener_triangle_budget
+
+    del bpy.types.Scene.gardener_lod_levels
+    del bpy.types.Scene.gardener_lod_cutoff_scale
+    del bpy.types.Scene.gardener_lod_resolution_scale
+    del bpy.types.Scene.gardener_lod_edgeloop_step
+
+    del bpy.types.Scene.gardener_profile_build
+    del bpy.types.Scene.gardener_profile_report
+    del bpy.types.Scene.gardener_profile_sort
 
     for cls in classes:
         unregister_class(cls)
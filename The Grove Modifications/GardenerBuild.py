@@ -2,82 +2,294 @@
 # This adds additional functions involved in replicating and transforming frond meshes.
 
 import bpy
+from bpy.app.handlers import persistent
 from mathutils import Matrix, Vector, Quaternion
-from numpy import array, take, empty, vstack
+from numpy import array, asarray, take, empty, zeros, ones, full, nonzero, isin, vstack, cumsum, repeat, arange, unique, int32, float32, float64
 from bisect import bisect_left
+from collections import namedtuple
+from itertools import count
+from .GardenerMesh import FrondIndex, BranchCache, PolyCountTable, TreeSkeleton, frond_descriptor, hull_normals
+from .GardenerProfile import BuildProfiler, null_profiler
+from math import pi
+
+# GARDENER - Every Gardener setting a build needs, read from the scene once per build.
+GardenerSettings = namedtuple('GardenerSettings', 
+    'use_fronds replace_type thickness_cutoff hierarchy_cutoff length_cutoff hierarchy_reverse '
+    'frond_match_weight smooth_factor stretch_x stretch_yz frond_output realize_fronds '
+    'reduce_edgeloops edgeloop_reduce_mode edgeloop_reduce_factor edgeloop_tolerance '
+    'reproject_normals reproject_mode hull_res hull_size '
+    'datalayer_height datalayer_trunktobranch datalayer_branchtofrond datalayer_branchgroup merge_layers '
+    'branch_group_seed verbose profiler branch_cache skeleton '
+    'lod_levels lod_cutoff_scale lod_resolution_scale lod_edgeloop_step')
+
+
+def get_gardener_settings(scene, scale_to_twig):
+    """
+    Takes a snapshot of the Gardener scene properties for a build.
+
+    Branch.build_branches_mesh runs once per branch, reading RNA properties there adds up fast on
+    big trees, so the snapshot is made once in OperatorBuild and passed down the recursion.
+
+    The profiler is a fresh BuildProfiler when Profile Builds is on, otherwise a profiler that does nothing.
+    The branch cache is None when Reuse Branches is off, in which case anything it held is let go.
+    The tree's TreeSkeleton is filled in once OperatorBuild has exported it.
+    """
+
+    if not scene.gardener_cache_branches:
+        branch_cache.clear()
+
+    return GardenerSettings(
+        use_fronds=scene.gardener_use_fronds,
+        replace_type=scene.gardener_frond_replace_type,
+        thickness_cutoff=scene.gardener_thickness_cutoff,
+        hierarchy_cutoff=scene.gardener_hierarchy_cutoff,
+        length_cutoff=scene.gardener_length_cutoff / scale_to_twig,
+        hierarchy_reverse=scene.gardener_hierarchy_reverse,
+        frond_match_weight=scene.gardener_frond_match_weight,
+        smooth_factor=scene.gardener_smooth_factor,
+        stretch_x=scene.gardener_stretch_factor_x,
+        stretch_yz=scene.gardener_stretch_factor_yz,
+        frond_output=scene.gardener_frond_output,
+        realize_fronds=scene.gardener_realize_fronds,
+        reduce_edgeloops=scene.gardener_reduce_edgeloops,
+        edgeloop_reduce_mode=scene.gardener_edgeloop_reduce_mode,
+        edgeloop_reduce_factor=scene.gardener_edgeloop_reduce_factor,
+        edgeloop_tolerance=scene.gardener_edgeloop_tolerance / scale_to_twig,
+        reproject_normals=scene.gardener_normal_use_reproject,
+        reproject_mode=scene.gardener_normal_reproject_mode,
+        hull_res=scene.gardener_normal_hull_res,
+        hull_size=scene.gardener_normal_hull_size,
+        datalayer_height=scene.gardener_datalayer_height,
+        datalayer_trunktobranch=scene.gardener_datalayer_trunktobranch,
+        datalayer_branchtofrond=scene.gardener_datalayer_branchtofrond,
+        datalayer_branchgroup=scene.gardener_datalayer_branchgroup,
+        merge_layers=scene.gardener_merge_layers,
+        branch_group_seed=scene.gardener_branch_group_seed,
+        verbose=scene.gardener_verbose,
+        profiler=BuildProfiler() if scene.gardener_profile_build else null_profiler,
+        branch_cache=branch_cache if scene.gardener_cache_branches else None,
+        skeleton=None,
+        lod_levels=scene.gardener_lod_levels,
+        lod_cutoff_scale=scene.gardener_lod_cutoff_scale,
+        lod_resolution_scale=scene.gardener_lod_resolution_scale,
+        lod_edgeloop_step=scene.gardener_lod_edgeloop_step,
+    )
+
+
+def lod_settings(gardener, level, profile_resolution):
+    """
+    Returns the Gardener settings and profile resolution a level of detail is built with.
+
+    Every level multiplies the thickness and length cutoffs by LOD Cutoff Scale and drops the
+    hierarchy cutoff by one (raises it with Reverse Hierarchy), so more of the tree turns into
+    fronds, scales the profile resolution by LOD Resolution Scale and removes edge loops more
+    aggressively, lowering the angle limit by LOD Edge Loop Step or scaling the tolerance along with
+    the cutoffs.  Level 0 is the tree as set up.
+    """
+
+    if level == 0:
+        return gardener, profile_resolution
+
+    cutoff_scale = gardener.lod_cutoff_scale ** level
+    level_gardener = gardener._replace(
+        thickness_cutoff=gardener.thickness_cutoff * cutoff_scale,
+        hierarchy_cutoff=(gardener.hierarchy_cutoff + level if gardener.hierarchy_reverse 
+                          else max(gardener.hierarchy_cutoff - level, 1)),
+        length_cutoff=gardener.length_cutoff * cutoff_scale,
+        reduce_edgeloops=True,
+        edgeloop_reduce_factor=max(gardener.edgeloop_reduce_factor - gardener.lod_edgeloop_step * level, 0.0),
+        edgeloop_tolerance=gardener.edgeloop_tolerance * cutoff_scale,
+    )
+
+    return level_gardener, max(int(round(profile_resolution * gardener.lod_resolution_scale ** level)), 3)
+
+
+def lod_screen_sizes(triangle_counts):
+    """
+    Estimates the screen size every level of detail takes over at, as a fraction of the screen
+    height the tree fills when level 0 is shown.  A level is used once the tree is small enough that
+    its triangles cover as many pixels each as level 0's do at full size.
+    """
+
+    full = max(triangle_counts[0], 1)
+
+    return [1.0] + [min((count / full) ** 0.5, 1.0) for count in triangle_counts[1:]]
+
+
+def gardener_profile_settings(gardener):
+    """
+    Returns the settings of a build as a plain dictionary for the profile report, so slow builds
+    can be traced back to the settings that caused them.
+    """
+
+    return {name: value for name, value in gardener._asdict().items() if name not in ('profiler', 'branch_cache')}
+
+
+# GARDENER - Branch skeletons and mesh fragments from the last build, see GardenerMesh.BranchCache.
+branch_cache = BranchCache()
+
+# GARDENER - The smoothed hull field from the last normal reprojection, see GardenerMesh.hull_normals.
+hull_field_cache = {}
+
+
+# GARDENER - Frond meshes are kept between builds so an unchanged Frond Collection costs nothing to reuse.
+# Entries are stored by object name and dropped by frond_cache_update when the object is edited, or by
+# load_frond_set once the object is no longer in the collection it loads.
+# Every entry gets a new serial number when it's read, so the branch cache can tell a frond was edited.
+frond_cache = {}
+frond_serials = count()
+
+FrondMesh = namedtuple('FrondMesh', 'coords loops uvs mat_ids bounds loop_totals')
+
 
 def load_frond_set(collection, scale_to_twig):
 
     """
-    Loads a mesh-based object and returns it's individual components (minus normals).
-    TODO: Add width data so frond substitions can be smarter.
-    TODO: Make this a dictionary/tuple thing, otherwise data access will get bad fast.
+    Loads every mesh object in a collection and returns it's individual components (minus normals)
+    as FrondMesh tuples of packed arrays, an indexed list of every material they use, a FrondIndex
+    for picking the best fit for a branch and a signature of the set for the branch cache.
+
+    Each object is read once and cached on its name, mesh data, materials and scale_to_twig.  Cached
+    objects that aren't in the collection anymore are dropped.
     """
 
+    register_frond_cache()
+
     frond_data = []
     material_layers = []
-    id_index = 0
+    descriptors = []
+    signature = []
 
     for obj in collection.all_objects:
         if obj.type == 'MESH':
 
-            # Obtain the flat mesh data.
             obj = bpy.data.objects[obj.name]
-            me = obj.to_mesh(preserve_all_data_layers=False, depsgraph=None)
-            uv_layer = me.uv_layers.active.data
-
-            # Turn it into from_pydata-compatible datasets.
-            vertices = []
-            faces = []
-            uvs = []
-            mat_ids = []
-            mat_names = []
-
-            # Get bounds for the object
-            bounds = get_bounds(obj)
-            bound_dist = Vector((bounds.x.distance, bounds.y.distance, bounds.z.distance))
-            bound_dist = bound_dist / scale_to_twig
-
-            mat_scl = Matrix.Scale((1/ scale_to_twig), 4)
-
-            for vertex in me.vertices:
-                co_scale = vertex.co.copy() @ mat_scl
-                vertices.append(co_scale)
-
-            for poly in me.polygons:
-                f = []
-                u = []
-
-                for loop_index in poly.loop_indices:
-                    f.append(me.loops[loop_index].vertex_index)
-                    u.append(uv_layer[loop_index].uv.copy())
-                
-                faces.append(f)
-                uvs.append(u)
-                mat_ids.append(poly.material_index + id_index)
-
-            for i, mat in enumerate(me.materials):
-
-                if mat.name in material_layers:
-                    new_id = material_layers.index(mat.name)
-
-                    # Collapse all indexes higher than it, replace matches
-                    for idx, item in enumerate(mat_ids):
-                        if item == i:
-                            mat_ids[idx] = new_id
-                        elif item > i:
-                            mat_ids[idx] = item - 1
-
-                else:
-                    mat_names.append(mat.name)
-                    material_layers.append(mat.name)
-
-            frond_data.append([vertices, faces, uvs, mat_ids, bound_dist])
-
-            id_index += len(mat_names)
-    
+            entry = get_frond_entry(obj, scale_to_twig)
+            coords, loops, uvs, local_mat_ids, bounds, loop_totals, mat_names, descriptor = entry
+
+            # Materials are indexed by name across the whole set, so fronds sharing
+            # a material also share an index.
+            lookup = []
+            for mat_name in mat_names:
+                if mat_name is None:
+                    lookup.append(-1)
+                    continue
+                if mat_name not in material_layers:
+                    material_layers.append(mat_name)
+                lookup.append(material_layers.index(mat_name))
+
+            if len(lookup) == 0:
+                mat_ids = full(len(local_mat_ids), -1, dtype=int32)
+            else:
+                mat_ids = take(array(lookup, dtype=int32), local_mat_ids, mode='clip')
+
+            frond_data.append(FrondMesh(coords, loops, uvs, mat_ids, bounds, loop_totals))
+            descriptors.append(descriptor)
+            signature.append((obj.name, frond_cache[obj.name][2]))
+
+    loaded = {name for name, serial in signature}
+    for name in set(frond_cache) - loaded:
+        del frond_cache[name]
+
+    return [frond_data, material_layers, FrondIndex(descriptors), tuple(signature)]
+
+
+def get_frond_entry(obj, scale_to_twig):
+    """
+    Returns the cached mesh arrays for a frond object, reading them from the object if
+    there's no valid entry.
+    """
+
+    mat_names = tuple(mat.name if mat else None for mat in obj.data.materials)
+    key = (obj.name, obj.data.name, mat_names, scale_to_twig)
+
+    cached = frond_cache.get(obj.name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    # Obtain the flat mesh data.
+    me = obj.to_mesh(preserve_all_data_layers=False, depsgraph=None)
+
+    vertex_count = len(me.vertices)
+    loop_count = len(me.loops)
+    face_count = len(me.polygons)
+
+    coords = empty(vertex_count * 3, dtype=float32)
+    me.vertices.foreach_get("co", coords)
+    coords = coords.reshape(-1, 3).astype(float64) / scale_to_twig
+
+    loop_starts = empty(face_count, dtype=int32)
+    loop_totals = empty(face_count, dtype=int32)
+    me.polygons.foreach_get("loop_start", loop_starts)
+    me.polygons.foreach_get("loop_total", loop_totals)
+
+    # Loops are read in polygon order, which is normally the order they're stored in.
+    face_splits = cumsum(loop_totals)
+    loop_order = repeat(loop_starts - (face_splits - loop_totals), loop_totals) + arange(loop_count)
+
+    loops = empty(loop_count, dtype=int32)
+    me.loops.foreach_get("vertex_index", loops)
+    loops = loops[loop_order]
+
+    uvs = zeros(loop_count * 2, dtype=float32)
+    if me.uv_layers.active is not None:
+        me.uv_layers.active.data.foreach_get("uv", uvs)
+    uvs = uvs.reshape(-1, 2)[loop_order]
+
+    local_mat_ids = empty(face_count, dtype=int32)
+    me.polygons.foreach_get("material_index", local_mat_ids)
+
+    obj.to_mesh_clear()
+
+    # Get bounds for the object
+    bounds = get_bounds(obj)
+    bound_dist = array((bounds.x.distance, bounds.y.distance, bounds.z.distance)) / scale_to_twig
+
+    # Length, width, height and tip spread, used by FrondIndex to match fronds to branches.
+    descriptor = frond_descriptor(coords, bound_dist)
+
+    entry = (coords, loops, uvs, local_mat_ids, bound_dist, loop_totals, mat_names, descriptor)
+    frond_cache[obj.name] = (key, entry, next(frond_serials))
+
+    return entry
+
+
+@persistent
+def frond_cache_update(scene, depsgraph):
+    """
+    Drops cached fronds whose object or mesh data was edited.
+    """
+
+    if not frond_cache:
+        return
+
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry:
+            continue
+
+        id_data = update.id.original
+        if isinstance(id_data, bpy.types.Object):
+            frond_cache.pop(id_data.name, None)
+        elif isinstance(id_data, bpy.types.Mesh):
+            for name, (key, entry, serial) in list(frond_cache.items()):
+                if key[1] == id_data.name:
+                    del frond_cache[name]
+
+
+def register_frond_cache():
+    """
+    Makes sure frond_cache_update is listening for depsgraph updates.  The handler is compared by
+    name so reloading The Grove doesn't stack up stale copies of it.
+    """
+
+    handlers = bpy.app.handlers.depsgraph_update_post
+    for handler in list(handlers):
+        if getattr(handler, '__name__', None) == 'frond_cache_update' and handler is not frond_cache_update:
+            handlers.remove(handler)
+
+    if frond_cache_update not in handlers:
+        handlers.append(frond_cache_update)
 
-    return [frond_data, material_layers]
 
 def get_bounds(obj):
     """
@@ -257,6 +469,208 @@ def build_normal_reprojection(ob, scale_to_twig, hull_res, hull_expand):
 
     bpy.ops.object.select_all(action='DESELECT') 
 
+def count_tree_polygons(tree, properties, gardener, fronds):
+    """
+    Counts what every branch of the tree adds to the mesh without building it, see
+    Branch.count_branches_mesh.  Smoothing changes node radii as it goes, they're put back
+    afterwards from the tree's TreeSkeleton (exported here if the settings don't hold one yet) so
+    the build that follows smooths the tree exactly as the count did.  The smoothed length of every
+    branch is kept on the skeleton for the replacement preview.
+
+    The table is kept in the driver namespace for the Polycount panel, along with scale_to_twig
+    as Length Cutoff is set in scene units.
+    """
+
+    skeleton = gardener.skeleton
+    if skeleton is None:
+        skeleton = TreeSkeleton.from_tree(tree)
+
+    table = PolyCountTable(skeleton.subtree_depth, skeleton.subtree_lengths, gardener.frond_output)
+    tree.count_branches_mesh(properties.profile_resolution, properties.profile_resolution_reduction,
+                             None, None, None, fronds, gardener, -1, 0, table,
+                             properties.lateral_on_apical, properties.lateral_twig_age_limit,
+                             properties.dead_twig_wither, int(properties.branching), properties.root_distribution)
+
+    skeleton.restore_radii()
+
+    # The count smooths every branch, even ones a build would leave out under a replaced branch.
+    skeleton.record_lengths(arange(len(table)), table.columns()[3])
+
+    bpy.app.driver_namespace['gardener_poly_count'] = {'table': table, 'scale_to_twig': properties.scale_to_twig}
+
+    return table
+
+
+def write_mesh(me, verts, faces, uvs):
+    """
+    Fills an empty mesh from Gardener's vertex, face and UV buffers.
+
+    Everything is added in bulk with foreach_set from contiguous typed arrays, which is far faster
+    and lighter than from_pydata with lists of vectors and tuples.
+    """
+
+    me.vertices.add(len(verts))
+    me.vertices.foreach_set("co", verts.view())
+
+    me.loops.add(len(faces.loops))
+    me.loops.foreach_set("vertex_index", faces.loops.view())
+
+    me.polygons.add(len(faces))
+    me.polygons.foreach_set("loop_start", faces.loop_starts())
+    me.polygons.foreach_set("loop_total", faces.totals.view())
+
+    me.update(calc_edges=True)
+
+    uv_layer = me.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set("uv", uvs.view())
+
+    me.polygons.foreach_set("use_smooth", ones(len(faces), dtype=bool))
+
+    return me
+
+
+def build_frond_instances(ob, frond_placements, frond_data, scale_to_twig, realize):
+    """
+    Adds the fronds a build placed as instances to the tree as a child object with one point per
+    replaced branch.  Every point carries rotation, scale and frond_index attributes, and a Geometry
+    Nodes modifier instances the matching object from the Frond Collection on it.
+
+    With realize on the modifier is applied, leaving the fronds as real geometry for exporting.
+    Returns the new object, or None if the build didn't place any instances.
+    """
+
+    locations, rotations, scales, frond_ids = frond_placements.instance_arrays()
+    if len(frond_ids) == 0:
+        return None
+
+    # Frond meshes are read at 1 / scale_to_twig to match the tree, the objects being instanced aren't.
+    scales /= scale_to_twig
+
+    name = ob.name + '_Fronds'
+    me = bpy.data.meshes.new(name)
+    me.vertices.add(len(frond_ids))
+    me.vertices.foreach_set("co", locations.ravel())
+
+    me.attributes.new('rotation', 'FLOAT_VECTOR', 'POINT').data.foreach_set("vector", rotations.ravel())
+    me.attributes.new('scale', 'FLOAT_VECTOR', 'POINT').data.foreach_set("vector", scales.ravel())
+    me.attributes.new('frond_index', 'INT', 'POINT').data.foreach_set("value", frond_ids)
+
+    # Point Instance can only place one object (or a whole collection), so every frond used gets
+    # a mask to separate its points by.
+    used = unique(frond_ids)
+    for frond_id in used:
+        mask = (frond_ids == frond_id).astype(float32)
+        me.attributes.new('gardener_frond_' + str(frond_id), 'FLOAT', 'POINT').data.foreach_set("value", mask)
+
+    me.update()
+
+    instances_ob = bpy.data.objects.new(name, me)
+    instances_ob.parent = ob
+    bpy.context.collection.objects.link(instances_ob)
+
+    frond_objects = [bpy.data.objects[frond_name] for frond_name, serial in frond_data[3]]
+    node_group = frond_instance_nodes(name, [(frond_id, frond_objects[frond_id]) for frond_id in used])
+
+    modifier = instances_ob.modifiers.new("Gardener Fronds", 'NODES')
+    modifier.node_group = node_group
+
+    if realize:
+        bpy.ops.object.modifier_apply({'object': instances_ob, 'active_object': instances_ob}, modifier=modifier.name)
+        bpy.data.node_groups.remove(node_group)
+
+    return instances_ob
+
+
+def frond_instance_nodes(name, frond_objects):
+    """
+    Builds a Geometry Nodes group that instances each frond object on the points its mask attribute
+    is set on, from a list of (frond id, object) pairs, and joins the lot.
+    """
+
+    node_group = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    node_group.inputs.new('NodeSocketGeometry', "Geometry")
+    node_group.outputs.new('NodeSocketGeometry', "Geometry")
+
+    nodes = node_group.nodes
+    links = node_group.links
+
+    group_input = nodes.new('NodeGroupInput')
+    group_output = nodes.new('NodeGroupOutput')
+    group_output.location = (900.0, 0.0)
+
+    geometry = None
+    for row, (frond_id, frond_object) in enumerate(frond_objects):
+        separate = nodes.new('GeometryNodePointSeparate')
+        separate.location = (200.0, row * -200.0)
+        separate.inputs["Mask"].default_value = 'gardener_frond_' + str(frond_id)
+        links.new(group_input.outputs[0], separate.inputs["Geometry"])
+
+        # The second output holds the points the mask is set on.
+        instance = nodes.new('GeometryNodePointInstance')
+        instance.location = (450.0, row * -200.0)
+        instance.instance_type = 'OBJECT'
+        instance.inputs["Object"].default_value = frond_object
+        links.new(separate.outputs[1], instance.inputs["Geometry"])
+
+        if geometry is None:
+            geometry = instance.outputs[0]
+            continue
+
+        # 2.92 joins two inputs, later versions have a single input that takes any number of links.
+        join = nodes.new('GeometryNodeJoinGeometry')
+        join.location = (700.0, row * -200.0)
+        links.new(geometry, join.inputs[0])
+        links.new(instance.outputs[0], join.inputs[-1])
+        geometry = join.outputs[0]
+
+    links.new(geometry, group_output.inputs[0])
+
+    return node_group
+
+
+def build_normal_field_reprojection(ob, frond_mask, scale_to_twig, hull_res, hull_expand):
+    """
+    Reprojects frond normals without operators, modifiers or duplicate objects.
+
+    The hull is replaced by a smoothed occupancy field of the tree (see GardenerMesh.hull_normals),
+    frond loops take their normal from its gradient and every other loop keeps its smooth normal.
+    Everything is written in one go with normals_split_custom_set, so nothing depends on the
+    UI context or the current mode.
+    """
+
+    me = ob.data
+
+    coords = empty(len(me.vertices) * 3, dtype=float32)
+    me.vertices.foreach_get("co", coords)
+    coords = coords.reshape(-1, 3)
+
+    loop_vertices = empty(len(me.loops), dtype=int32)
+    me.loops.foreach_get("vertex_index", loop_vertices)
+
+    # Keep the bark fully smooth, a lower angle would split its normals like the old
+    # Data Transfer pass did.
+    me.use_auto_smooth = True
+    me.auto_smooth_angle = pi
+    me.calc_normals_split()
+
+    normals = empty(len(me.loops) * 3, dtype=float32)
+    me.loops.foreach_get("normal", normals)
+    normals = normals.reshape(-1, 3)
+
+    frond_vertices = nonzero(asarray(frond_mask) > 0.5)[0]
+    if len(frond_vertices):
+        vertex_normals = zeros((len(coords), 3), dtype=float32)
+        vertex_normals[frond_vertices] = hull_normals(coords, coords[frond_vertices],
+                                                      hull_res / scale_to_twig, hull_expand / scale_to_twig,
+                                                      cache=hull_field_cache)
+
+        frond_loops = isin(loop_vertices, frond_vertices)
+        normals[frond_loops] = vertex_normals[loop_vertices[frond_loops]]
+
+    me.normals_split_custom_set(normals)
+    me.free_normals_split()
+
+
 def vertex_colors_layer_from_colors(ob, name, red, green, blue, alpha):
     """
     GARDENER - This adapts the Vertex Color code from The Grove to create a color layer where every color
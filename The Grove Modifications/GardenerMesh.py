@@ -0,0 +1,2010 @@
+
+# This holds the NumPy kernels Gardener uses while meshing branches.
+# Nothing in here touches bpy or mathutils, so it can be imported without Blender.
+
+from numpy import asarray, empty, zeros, full, arange, cumsum, concatenate, unique, append, diff, repeat, maximum, argsort, searchsorted, where, clip, cross, einsum, arccos, sqrt, errstate, pi
+from numpy import moveaxis, floor, ceil, stack, bincount, ravel_multi_index, isfinite, minimum, argmax, flatnonzero
+from numpy import sin, cos, arctan2, hypot, add, ones, inf, zeros_like
+from numpy import gradient as gradient_of
+from numpy import float32, float64, int32, int64, random
+from collections import namedtuple
+import math
+
+
+def node_frames(tan, axi):
+    """
+    Builds the transform of every node in a branch as a stack of 3x3 matrices.
+    The rows are the tangent, the axis and their cross product, the same layout the
+    old per-node Matrix objects used.
+    """
+
+    tan = asarray(tan, dtype=float64)
+    axi = asarray(axi, dtype=float64)
+
+    frames = zeros((len(tan), 3, 3), dtype=float64)
+    frames[:, 0] = tan
+    frames[:, 1] = axi
+    frames[:, 2] = cross(tan, axi)
+
+    return frames
+
+
+def frame_eulers(frames):
+    """
+    Converts a stack of node frames (see node_frames) to the XYZ Euler rotations that place an object
+    along them, the same as Matrix.to_euler('XYZ') on every frame transposed.  The frames have to be
+    orthonormal.
+    """
+
+    rotations = asarray(frames, dtype=float64).transpose(0, 2, 1)
+
+    cy = hypot(rotations[:, 0, 0], rotations[:, 1, 0])
+    regular = cy > 16.0 * 1.1920929e-07
+
+    eulers = empty((len(rotations), 3), dtype=float64)
+    eulers[:, 0] = where(regular, arctan2(rotations[:, 2, 1], rotations[:, 2, 2]), 
+                         arctan2(-rotations[:, 1, 2], rotations[:, 1, 1]))
+    eulers[:, 1] = arctan2(-rotations[:, 2, 0], cy)
+    eulers[:, 2] = where(regular, arctan2(rotations[:, 1, 0], rotations[:, 0, 0]), 0.0)
+
+    return eulers
+
+
+def place_frond(coords, stretch, dist, frames, pos, origin):
+    """
+    Places every vertex of a frond along a branch in one go.
+
+    Each vertex is matched to the branch segment it sits on using its X coordinate and the
+    distance of every node from the start of the branch, then moved into the frame of the node
+    that starts that segment.
+
+    Returns the placed coordinates, the node indices either side of every vertex and
+    the (clamped) interpolation value between them, which layer data uses.
+    """
+
+    coords = asarray(coords, dtype=float64)
+    dist = asarray(dist, dtype=float64)
+    pos = asarray(pos, dtype=float64)
+    last = len(dist)
+
+    # Find the two nodes each vertex falls between, matching take_boundaries.
+    x = coords[:, 0]
+    found = searchsorted(dist, x, side='left')
+    k_0 = where(found == 0, 0, where(found == last, last - 2, found - 1))
+    border_0 = dist[k_0]
+    border_1 = dist[k_0 + 1]
+
+    # Repeated distances resolve to their first node, like list.index() did.
+    i_0 = searchsorted(dist, border_0, side='left')
+    i_1 = searchsorted(dist, border_1, side='left')
+
+    lerp_range = border_1 - border_0
+    with errstate(divide='ignore', invalid='ignore'):
+        lerp_val = where(lerp_range != 0.0, (x - border_0) / lerp_range, 0.0)
+    lerp_val = clip(lerp_val, 0.0, 1.0)
+
+    co_tr = coords * asarray(stretch, dtype=float64)
+    co_tr[:, 0] -= border_0
+
+    placed = einsum('ij,ijk->ik', co_tr, frames[i_0])
+    placed += pos[i_0] - asarray(origin, dtype=float64)
+
+    return placed, i_0, i_1, lerp_val, lerp_range
+
+
+def node_lerp(values, i_0, i_1, lerp_val):
+    """
+    Interpolates per-node values for a set of vertices placed between two nodes.
+    """
+
+    values = asarray(values, dtype=float64)
+    value_0 = values[i_0]
+    return value_0 + (values[i_1] - value_0) * lerp_val
+
+
+def unit_rows(vectors):
+    """
+    Normalizes every row of an array of vectors, leaving zero-length rows as zero like mathutils does.
+    """
+
+    vectors = asarray(vectors, dtype=float64)
+    length = sqrt(einsum('ij,ij->i', vectors, vectors))
+    with errstate(divide='ignore', invalid='ignore'):
+        units = where(length[:, None] != 0.0, vectors / length[:, None], 0.0)
+    return units
+
+
+def straight_skeleton(points):
+    """
+    Returns the direction and (unnormalized) tangent of every node of a branch built without smoothing.
+    Each direction points at the next node, the last node reuses the one before it, and the tangent
+    at a node is the average of the directions either side of it.
+
+    The first direction is unit length, it always doubled as the first tangent and got normalized
+    along with it, so the second tangent leans a little towards it.
+    """
+
+    points = asarray(points, dtype=float64)
+    steps = points[1:] - points[:-1]
+    steps[:1] = unit_rows(steps[:1])
+    directions = concatenate([steps, steps[-1:]])
+
+    tangents = directions.copy()
+    tangents[1:] = (directions[1:] + directions[:-1]) / 2.0
+
+    return directions, tangents
+
+
+def smoothed_skeleton(points, smooth_value, smooth_range=3):
+    """
+    Gardener's corner smoothing.  Returns the smoothed position, direction and tangent of every node
+    of a branch.
+
+    Each direction is pulled from the next node towards the node smooth_range along, more so the
+    sharper the corner.  Every position follows on from the one before it, so this walks the branch
+    one node at a time in plain floats rather than a Matrix and a handful of Vectors per node.
+
+    The angle is the one the old code measured after its Vector @ Matrix step (which multiplies by
+    the transpose of the projection it meant to make), kept as it is so trees don't change shape.
+    """
+
+    points = asarray(points, dtype=float64).tolist()
+    count = len(points)
+    last = count - 1
+
+    if count < 3:
+        directions, tangents = straight_skeleton(points)
+        return asarray(points), directions, tangents
+
+    def sub(a, b):
+        return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+    def dot(a, b):
+        return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+    def cross(a, b):
+        return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+    def unit(a):
+        length = math.sqrt(dot(a, a))
+        if length == 0.0:
+            return (0.0, 0.0, 0.0), 0.0
+        return (a[0] / length, a[1] / length, a[2] / length), length
+
+    pos = [tuple(points[0])]
+    directions = []
+    tangents = []
+    smooth_range = min(smooth_range, count)
+
+    for j in range(count):
+        if j >= last - smooth_range:
+            smooth_range -= 1
+
+        if j == last:
+            direction = directions[-1]
+
+        elif j == last - 1:
+            pos.append(tuple(points[j + 1]))
+            direction = sub(points[j + 1], pos[j])
+
+        else:
+            p_0 = pos[j]
+            p_1 = points[j + 1]
+            p_2 = points[j + smooth_range]
+            v_0 = sub(p_1, p_0)
+            v_1 = sub(p_2, p_0)
+
+            unit_0, length_0 = unit(v_0)
+            unit_1, _ = unit(sub(p_2, p_1))
+            sharpness = (1.0 - dot(unit_0, unit_1)) / 2.0
+            lerp = min(sharpness * smooth_value, 1.0)
+
+            z_axis = cross(v_0, v_1)
+            rows = (unit_0, unit(cross(v_0, z_axis))[0], unit(z_axis)[0])
+            v_a = [v_0[0] * rows[0][k] + v_0[1] * rows[1][k] + v_0[2] * rows[2][k] for k in (0, 1)]
+            v_b = [v_1[0] * rows[0][k] + v_1[1] * rows[1][k] + v_1[2] * rows[2][k] for k in (0, 1)]
+
+            length_a = math.hypot(*v_a)
+            length_b = math.hypot(*v_b)
+
+            # Nodes in line (the last stretch, where the far node is the next one) have nothing to
+            # smooth.  The old code only caught this when rounding happened to give an angle of
+            # exactly 0, and otherwise shortened the segment.
+            angle = 0.0
+            if z_axis != (0.0, 0.0, 0.0) and length_a > 0.0 and length_b > 0.0:
+                angle = math.acos(max(-1.0, min(1.0, (v_a[0] * v_b[0] + v_a[1] * v_b[1]) / (length_a * length_b))))
+
+            if angle == 0.0:
+                direction = v_0
+            else:
+                length_b = length_a * math.cos(angle)
+                d_unit = unit(v_1)[0]
+                direction = tuple(v_0[k] + (d_unit[k] * length_b - v_0[k]) * lerp for k in range(3))
+            pos.append((p_0[0] + direction[0], p_0[1] + direction[1], p_0[2] + direction[2]))
+
+        directions.append(direction)
+
+    # Every direction doubled as its tangent, so both come out unit length.
+    directions = unit_rows(directions)
+
+    return asarray(pos), directions, directions.copy()
+
+
+def transported_axes(pos, tan, first_axis):
+    """
+    Carries the axis of the first node along a branch with as little twist around the tangent as
+    possible (double reflection rotation-minimizing frames).
+
+    Every step is a pair of reflections that only depends on the positions and tangents, so all of
+    them are made up front and chained together in log2(n) batched matrix products.  A zero-length
+    segment or a tangent that needs no turning leaves that reflection out instead of dividing by zero.
+
+    Returns the axis of every node and the indices of nodes that sit on top of the node before them.
+    """
+
+    pos = asarray(pos, dtype=float64)
+    tan = asarray(tan, dtype=float64)
+    count = len(pos)
+
+    axi = empty((count, 3), dtype=float64)
+    axi[0] = first_axis
+    if count < 2:
+        return axi, arange(0)
+
+    identity = zeros((3, 3), dtype=float64)
+    identity[0, 0] = identity[1, 1] = identity[2, 2] = 1.0
+
+    def reflections(normals):
+        length_squared = einsum('ij,ij->i', normals, normals)
+        with errstate(divide='ignore', invalid='ignore'):
+            scale = where(length_squared > 0.0, 2.0 / length_squared, 0.0)
+        return identity - scale[:, None, None] * einsum('ij,ik->ijk', normals, normals)
+
+    # Reflect the previous node's frame through the plane halfway along the segment, then over a plane
+    # at the current node to line its tangent back up with the curve.
+    segments = pos[1:] - pos[:-1]
+    first = reflections(segments)
+    tan_flipped = einsum('ijk,ik->ij', first, tan[:-1])
+    steps = einsum('ijk,ikl->ijl', reflections(tan[1:] - tan_flipped), first)
+
+    # Prefix products, so chain[j] takes the first axis all the way to node j + 1.
+    chain = steps
+    span = 1
+    while span < len(chain):
+        chain = concatenate([chain[:span], einsum('ijk,ikl->ijl', chain[span:], chain[:-span])])
+        span *= 2
+
+    axi[1:] = einsum('ijk,k->ij', chain, axi[0])
+
+    return axi, flatnonzero(einsum('ij,ij->i', segments, segments) == 0.0) + 1
+
+
+def pitch_from_tangents(tangents):
+    """
+    Returns the pitch data layer value for a set of tangents, 1.0 pointing up and 0.0 pointing down.
+    Zero-length tangents get an angle of 0, matching Vector.angle's fallback.
+    """
+
+    tangents = asarray(tangents, dtype=float64)
+    length = sqrt(einsum('ij,ij->i', tangents, tangents))
+    with errstate(divide='ignore', invalid='ignore'):
+        cos_angle = where(length != 0.0, tangents[:, 2] / length, 1.0)
+    angle = arccos(clip(cos_angle, -1.0, 1.0))
+    return 1.0 - (angle / pi)
+
+
+def frond_descriptor(coords, bounds, tip_fraction=0.2):
+    """
+    Returns the values a frond is matched against a branch with: length, width, height and
+    the width of its tip (measured over the last tip_fraction of its length).
+    """
+
+    coords = asarray(coords, dtype=float64)
+    if len(coords) == 0:
+        return [bounds[0], bounds[1], bounds[2], 0.0]
+
+    x = coords[:, 0]
+    x_min = x.min()
+    tip = coords[x >= x_min + (x.max() - x_min) * (1.0 - tip_fraction)]
+    tip_spread = tip[:, 1].max() - tip[:, 1].min()
+
+    return [bounds[0], bounds[1], bounds[2], tip_spread]
+
+
+def lateral_spread(start, direction, points):
+    """
+    Returns the furthest distance any of the points sit from a line.
+    """
+
+    length = sqrt(direction.dot(direction))
+    if length == 0.0:
+        return 0.0
+
+    unit = direction / length
+    offsets = points - start
+    lateral = offsets - offsets.dot(unit)[:, None] * unit
+    return sqrt(einsum('ij,ij->i', lateral, lateral)).max()
+
+
+def branch_descriptor(pos, radius):
+    """
+    Returns the width and tip spread of a branch for matching it against frond descriptors.
+    Width covers the thickness of the branch plus how far its nodes wander from the line between
+    its ends, tip spread is how far the end drifts away from the starting direction.
+    """
+
+    pos = asarray(pos, dtype=float64)
+    if len(pos) < 2:
+        return radius * 2.0, 0.0
+
+    width = radius * 2.0 + lateral_spread(pos[0], pos[-1] - pos[0], pos) * 2.0
+    tip_spread = lateral_spread(pos[0], pos[1] - pos[0], pos[-1:]) * 2.0
+
+    return width, tip_spread
+
+
+class FrondIndex:
+    """
+    A length-sorted table of frond descriptors, built once when the frond library loads.
+
+    lookup() finds the nearest lengths with a binary search, so picking a frond costs O(log n)
+    per branch.  With a width weight the few fronds either side of the nearest length are
+    also compared by width and tip spread, otherwise the result matches the old linear scan
+    (nearest length, earliest frond on a tie).
+    """
+
+    def __init__(self, descriptors, window=4):
+        descriptors = asarray(descriptors, dtype=float64).reshape(-1, 4)
+        self.order = argsort(descriptors[:, 0], kind='stable')
+        self.lengths = descriptors[self.order, 0]
+        self.widths = descriptors[self.order, 1]
+        self.heights = descriptors[self.order, 2]
+        self.tip_spreads = descriptors[self.order, 3]
+        self.window = window
+
+    def __len__(self):
+        return len(self.order)
+
+    def lookup(self, length, width=0.0, tip_spread=0.0, weight=0.0):
+        """
+        Returns the index of the best-fitting frond in the library, or None if it's empty.
+        """
+
+        count = len(self.order)
+        if count == 0:
+            return None
+
+        found = int(searchsorted(self.lengths, length))
+        reach = self.window if weight > 0.0 else 1
+        low = max(0, found - reach)
+        high = min(count, found + reach)
+
+        # Equal lengths sit next to each other, widen the range so ties can be settled
+        # by collection order.
+        while low > 0 and self.lengths[low - 1] == self.lengths[low]:
+            low -= 1
+        while high < count and self.lengths[high] == self.lengths[high - 1]:
+            high += 1
+
+        cost = abs(self.lengths[low:high] - length)
+        if weight > 0.0:
+            cost = cost + weight * (abs(self.widths[low:high] - width)
+                                    + abs(self.tip_spreads[low:high] - tip_spread))
+
+        best = None
+        for i, c in enumerate(cost.tolist()):
+            frond = int(self.order[low + i])
+            if best is None or (c, frond) < best:
+                best = (c, frond)
+
+        return best[1]
+
+    def lookup_lengths(self, lengths):
+        """
+        Returns what lookup() would pick for every length in an array with no width weight,
+        all at once.  The library must not be empty.
+        """
+
+        # Fronds of equal length collapse into one entry holding the earliest of them.
+        values, firsts = unique(self.lengths, return_index=True)
+        earliest = minimum.reduceat(self.order, firsts)
+
+        lengths = asarray(lengths, dtype=float64)
+        above = clip(searchsorted(values, lengths), 0, len(values) - 1)
+        below = clip(above - 1, 0, len(values) - 1)
+
+        cost_above = abs(values[above] - lengths)
+        cost_below = abs(values[below] - lengths)
+        pick_below = (cost_below < cost_above) | ((cost_below == cost_above) & (earliest[below] < earliest[above]))
+
+        return where(pick_below, earliest[below], earliest[above])
+
+    def lookup_weighted(self, lengths, widths, tip_spreads, weight):
+        """
+        Returns what lookup() would pick for every branch in an array, given their lengths, widths and
+        tip spreads, all at once.  Without a width weight this is lookup_lengths.  The library must
+        not be empty.
+
+        Every branch gets the same window of fronds around its nearest length lookup() compares,
+        widened over equal lengths, as a row of a padded (branches, window) array.
+        """
+
+        if weight <= 0.0:
+            return self.lookup_lengths(lengths)
+
+        lengths = asarray(lengths, dtype=float64)
+        count = len(self.order)
+
+        # Where the run of equal lengths every frond sits in starts and ends.
+        new_run = concatenate(([True], self.lengths[1:] != self.lengths[:-1]))
+        run_starts = flatnonzero(new_run)
+        run_of = cumsum(new_run) - 1
+        run_ends = append(run_starts[1:], count)
+
+        found = searchsorted(self.lengths, lengths)
+        low = run_starts[run_of[clip(found - self.window, 0, count - 1)]]
+        high = run_ends[run_of[clip(found + self.window, 1, count) - 1]]
+
+        candidates = low[:, None] + arange(int((high - low).max()))[None, :]
+        inside = candidates < high[:, None]
+        candidates = where(inside, candidates, low[:, None])
+
+        cost = abs(self.lengths[candidates] - lengths[:, None])
+        cost = cost + weight * (abs(self.widths[candidates] - asarray(widths, dtype=float64)[:, None])
+                                + abs(self.tip_spreads[candidates] - asarray(tip_spreads, dtype=float64)[:, None]))
+        cost = where(inside, cost, inf)
+
+        # Ties go to the earliest frond in the collection, like lookup().
+        fronds = where(cost == cost.min(axis=1)[:, None], self.order[candidates], count)
+
+        return fronds.min(axis=1)
+
+
+class LayerBuffer:
+    """
+    A growable typed array holding one data layer.
+
+    Capacity doubles whenever it runs out, so adding values costs amortized O(1) each and
+    nothing is ever stored as a list of Python floats.  view() returns the filled part
+    without copying.
+    """
+
+    def __init__(self, dtype=float32, capacity=1024):
+        self.data = empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.view()
+        return self.view().astype(dtype)
+
+    def view(self):
+        return self.data[:self.size]
+
+    def reserve(self, count):
+        """
+        Makes sure count more values fit without another resize.
+        """
+
+        needed = self.size + count
+        capacity = len(self.data)
+        if needed <= capacity:
+            return
+
+        capacity = max(capacity, 1)
+        while capacity < needed:
+            capacity *= 2
+        grown = empty(capacity, dtype=self.data.dtype)
+        grown[:self.size] = self.data[:self.size]
+        self.data = grown
+
+    def fill(self, value, count):
+        """
+        Adds the same value count times.
+        """
+
+        self.reserve(count)
+        self.data[self.size:self.size + count] = value
+        self.size += count
+
+    def extend(self, values):
+        """
+        Adds every value from an array or sequence.  Nested values (like a list of coordinates)
+        are flattened.
+        """
+
+        if not hasattr(values, '__len__'):
+            values = list(values)
+        values = asarray(values).reshape(-1)
+        count = len(values)
+        self.reserve(count)
+        self.data[self.size:self.size + count] = values
+        self.size += count
+
+
+class VertexBuffer(LayerBuffer):
+    """
+    Vertex coordinates for the tree mesh, stored flat as float32 so they can be handed straight to
+    foreach_set.  Its length is the number of vertices.
+    """
+
+    def __init__(self, capacity=3072):
+        super().__init__(float32, capacity)
+
+    def __len__(self):
+        return self.size // 3
+
+    def append(self, co):
+        self.reserve(3)
+        self.data[self.size:self.size + 3] = co
+        self.size += 3
+
+    def coords(self):
+        return self.view().reshape(-1, 3)
+
+
+class FaceBuffer:
+    """
+    Faces for the tree mesh as a flat list of loop vertex indices plus the number of loops in
+    every face, the layout Blender's polygons and loops use.  Its length is the number of faces.
+    """
+
+    def __init__(self, capacity=4096):
+        self.loops = LayerBuffer(int32, capacity)
+        self.totals = LayerBuffer(int32, capacity // 4)
+
+    def __len__(self):
+        return len(self.totals)
+
+    def append(self, face):
+        self.loops.extend(face)
+        self.totals.fill(len(face), 1)
+
+    def extend(self, faces):
+        for face in faces:
+            self.append(face)
+
+    def extend_flat(self, loops, totals):
+        """
+        Adds a batch of faces already laid out as loop vertex indices and loop totals.
+        """
+
+        self.loops.extend(loops)
+        self.totals.extend(totals)
+
+    def triangle_count(self):
+        """
+        Returns the number of triangles the faces make once triangulated.
+        """
+
+        return int((self.totals.view() - 2).sum())
+
+    def loop_starts(self):
+        totals = self.totals.view()
+        return (cumsum(totals) - totals).astype(int32)
+
+    def first_vertices(self):
+        """
+        Returns the first vertex of every face.
+        """
+
+        return self.loops.view()[self.loop_starts()]
+
+
+class LayerStore(dict):
+    """
+    The simulation_data layers as LayerBuffers, one per layer name.  Layers named in int_names
+    are stored as 32-bit integers so they can be handed to integer attributes as they are.
+    group_starts records where every trunk branch group begins, see normalize_ranges.
+    """
+
+    def __init__(self, names, int_names=()):
+        super().__init__()
+        for name in names:
+            self[name] = LayerBuffer(int32 if name in int_names else float32)
+
+        # Vertex offsets where each branch group coming off the trunk starts.
+        self.group_starts = []
+
+        # The last skeleton node of every replaced branch, for the Branch to Frond layer.
+        self.frond_tips = []
+
+        # The TreeSkeleton row and smoothed length of every branch the build smoothed, see
+        # TreeSkeleton.record_lengths.
+        self.branch_rows = []
+        self.branch_lengths = []
+
+    def views(self):
+        """
+        Returns a plain dictionary of every layer as a NumPy array, without copying.
+        """
+
+        return {name: layer.view() for name, layer in self.items()}
+
+
+def normalize_ranges(values, starts):
+    """
+    Divides every range of values, from one start to the next (the last one runs to the end),
+    by the highest value in that range.  This happens in place and in a single pass.
+
+    Values before the first start are left alone, as are ranges whose highest value is zero.
+    """
+
+    count = len(values)
+    starts = unique(asarray(starts, dtype=int64))
+    starts = starts[starts < count]
+    if len(starts) == 0:
+        return values
+
+    first = starts[0]
+    grouped = values[first:]
+    offsets = starts - first
+
+    highest = maximum.reduceat(grouped, offsets)
+    highest = where(highest != 0.0, highest, 1.0)
+    lengths = diff(append(offsets, len(grouped)))
+    grouped /= repeat(highest, lengths).astype(grouped.dtype)
+
+    return values
+
+
+def shuffle_branch_groups(groups, seed):
+    """
+    Gives every branch group a random, unique value between 0 and 1.
+
+    The shuffle is a single fancy-index lookup into a seeded permutation, so the same tree and seed
+    always produce the same values.
+    """
+
+    groups = asarray(groups).astype(int64)
+    if len(groups) == 0:
+        return groups.astype(float32)
+
+    group_count = int(groups.max())
+    randomizer = random.default_rng(seed).permutation(group_count + 1)
+
+    return (randomizer[groups] / max(group_count, 1)).astype(float32)
+
+
+def frond_tip_distances(values, frond, nodes, skeleton, tips):
+    """
+    Fills in the Branch to Frond layer: how far every vertex is from the closest frond tip along the
+    tree, divided by the furthest so it runs from 0 at the tips to 1.  This happens in place.
+
+    nodes holds the skeleton node every vertex was built at, the first node of its branch for frond
+    vertices, which come in holding how far along the frond they are from 0 to 1.  tips are the last
+    nodes of every replaced branch, without any the layer is left as it is.
+    """
+
+    if len(tips) == 0 or len(values) == 0:
+        return values
+
+    distances = skeleton.tip_distances(tips)
+    nodes = asarray(nodes, dtype=int64)
+    on_frond = frond > 0.5
+    result = distances[nodes]
+
+    # A frond vertex is as far as the tip of its own frond, unless going back down to the frond's base
+    # and out to another one is shorter.
+    along = clip(values[on_frond], 0.0, 1.0)
+    frond_nodes = nodes[on_frond]
+    lengths = skeleton.lengths[skeleton.node_branch[frond_nodes]]
+    result[on_frond] = minimum((1.0 - along) * lengths, along * lengths + distances[frond_nodes])
+
+    furthest = result.max()
+    values[:] = result / furthest if furthest > 0.0 else 0.0
+
+    return values
+
+
+class FrondPlacements:
+    """
+    Records every frond placed in the tree mesh as the face it starts at and which frond in the
+    library it is.  This replaces a dense 0.0/1.0 list per frond material that covered every face
+    in the tree.
+
+    Fronds drawn as instances never make it into the mesh, they're recorded as which frond it is
+    along with the location, frame and stretch it's placed with (see add_instance).
+    """
+
+    def __init__(self):
+        self.face_starts = []
+        self.frond_ids = []
+        self.instances = []
+
+    def __len__(self):
+        return len(self.frond_ids)
+
+    def add(self, face_start, frond_id):
+        self.face_starts.append(face_start)
+        self.frond_ids.append(frond_id)
+
+    def add_instance(self, frond_id, location, frame, stretch):
+        """
+        Records a frond placed as an instance.  The frame is the 3x3 frame of the node it starts at
+        (see node_frames) and the stretch is the scale along the frond's own axes.
+        """
+
+        self.instances.append((frond_id, tuple(location), asarray(frame, dtype=float64), tuple(stretch)))
+
+    def instance_arrays(self):
+        """
+        Returns the location, XYZ Euler rotation and scale of every instance as (n, 3) float32 arrays,
+        along with the frond id of each.
+        """
+
+        count = len(self.instances)
+        if count == 0:
+            return (zeros((0, 3), dtype=float32), zeros((0, 3), dtype=float32), zeros((0, 3), dtype=float32), 
+                    zeros(0, dtype=int32))
+
+        frond_ids, locations, frames, stretches = zip(*self.instances)
+
+        return (asarray(locations, dtype=float32), frame_eulers(stack(frames)).astype(float32),
+                asarray(stretches, dtype=float32), asarray(frond_ids, dtype=int32))
+
+    def face_material_ids(self, fronds, face_count):
+        """
+        Returns the frond material id of every face in the mesh, -1 for faces that aren't part
+        of a frond.  Ids index the material list returned by load_frond_set.
+        """
+
+        material_ids = full(face_count, -1, dtype=int32)
+        if len(self.frond_ids) == 0 or len(fronds) == 0:
+            return material_ids
+
+        # Every frond's material ids laid end to end, with where each frond starts in it.
+        library_ids = concatenate([asarray(frond.mat_ids, dtype=int32) for frond in fronds])
+        library_counts = asarray([len(frond.mat_ids) for frond in fronds], dtype=int64)
+        library_starts = cumsum(library_counts) - library_counts
+
+        frond_ids = asarray(self.frond_ids, dtype=int64)
+        face_starts = asarray(self.face_starts, dtype=int64)
+        counts = library_counts[frond_ids]
+
+        # Local face index inside each placed frond.
+        total = int(counts.sum())
+        local = arange(total) - repeat(cumsum(counts) - counts, counts)
+
+        target = repeat(face_starts, counts) + local
+        source = repeat(library_starts[frond_ids], counts) + local
+        material_ids[target] = library_ids[source]
+
+        return material_ids
+
+
+def box_blur(field, radius, axis):
+    """
+    Averages every cell of a grid with the radius cells either side of it along one axis.
+    Cells outside the grid count as empty.
+    """
+
+    size = radius * 2 + 1
+    field = moveaxis(field, axis, 0)
+    summed = cumsum(concatenate((zeros((radius + 1,) + field.shape[1:], dtype=field.dtype), field, 
+                                 zeros((radius,) + field.shape[1:], dtype=field.dtype))), axis=0)
+    blurred = (summed[size:] - summed[:-size]) / size
+
+    return moveaxis(blurred, 0, axis)
+
+
+def sample_grid(grid, points):
+    """
+    Trilinearly samples a grid at points given in cell coordinates.
+    """
+
+    limit = asarray(grid.shape) - 2
+    base = clip(floor(points).astype(int64), 0, limit)
+    t = clip(points - base, 0.0, 1.0)
+    x, y, z = base[:, 0], base[:, 1], base[:, 2]
+    tx, ty, tz = t[:, 0], t[:, 1], t[:, 2]
+
+    c00 = grid[x, y, z] * (1 - tx) + grid[x + 1, y, z] * tx
+    c10 = grid[x, y + 1, z] * (1 - tx) + grid[x + 1, y + 1, z] * tx
+    c01 = grid[x, y, z + 1] * (1 - tx) + grid[x + 1, y, z + 1] * tx
+    c11 = grid[x, y + 1, z + 1] * (1 - tx) + grid[x + 1, y + 1, z + 1] * tx
+
+    c0 = c00 * (1 - ty) + c10 * ty
+    c1 = c01 * (1 - ty) + c11 * ty
+
+    return c0 * (1 - tz) + c1 * tz
+
+
+def hull_normals(tree_points, targets, cell_size, expand, max_cells=256, cache=None):
+    """
+    Finds normals that point out of the overall volume of a tree, used to give fronds smooth,
+    hull-like shading.
+
+    The tree's vertices are splatted into an occupancy grid, blurred by the expand distance
+    (which stands in for the old remesh and shrink/fatten hull) and the normals are the negated
+    gradient of that field at each target.  Targets in flat parts of the field point away from the
+    middle of the tree instead.  cell_size is raised if the grid, padding for the blur included,
+    would be more than max_cells wide.
+
+    If a dictionary is given as cache, the blurred field's gradient is kept in it and reused for as
+    long as the tree occupies the same cells, which most small setting changes don't alter.
+    """
+
+    tree_points = asarray(tree_points, dtype=float64)
+    targets = asarray(targets, dtype=float64)
+    if len(tree_points) == 0 or len(targets) == 0:
+        return zeros((len(targets), 3))
+
+    low = tree_points.min(axis=0)
+    high = tree_points.max(axis=0)
+
+    def grid(cell_size):
+        radius = max(1, int(ceil(expand / cell_size)))
+        padding = radius * 2 + 2
+        return radius, padding, floor((high - low) / cell_size).astype(int64) + padding * 2 + 1
+
+    # The padding grows with the blur radius, so keep raising the cell size until the whole grid fits.
+    cell_size = max(cell_size, (high - low).max() / max_cells, 1e-6)
+    radius, padding, shape = grid(cell_size)
+    while shape.max() > max_cells:
+        cell_size *= shape.max() / max_cells
+        radius, padding, shape = grid(cell_size)
+
+    origin = low - padding * cell_size
+    shape = tuple(shape.tolist())
+
+    cells = floor((tree_points - origin) / cell_size).astype(int64)
+    occupied = unique(ravel_multi_index(cells.T, shape))
+
+    field_key = (shape, tuple(origin.tolist()), cell_size, radius, hash(occupied.tobytes()))
+    if cache is not None and cache.get('key') == field_key:
+        gradients = cache['gradients']
+    else:
+        field = zeros(shape[0] * shape[1] * shape[2], dtype=float32)
+        field[occupied] = 1.0
+        field = field.reshape(shape)
+
+        # Two box passes per axis make a rough gaussian that fills the gaps between branches.
+        for axis in range(3):
+            field = box_blur(box_blur(field, radius, axis), radius, axis)
+
+        gradients = gradient_of(field)
+        if cache is not None:
+            cache['key'] = field_key
+            cache['gradients'] = gradients
+
+    target_cells = (targets - origin) / cell_size
+    gradient = stack([sample_grid(g, target_cells) for g in gradients], axis=1).astype(float64)
+    normals = unit_rows(-gradient)
+
+    # Flat parts of the field have no direction, point them away from the middle of the tree.
+    flat = ~normals.any(axis=1)
+    if flat.any():
+        normals[flat] = unit_rows(targets[flat] - tree_points.mean(axis=0))
+
+    return normals
+
+
+# Layers that are the same value over a whole branch and depend on where the branch sits in the build
+# order, the branch cache fills these in again when it reuses a branch rather than storing them.
+REBASED_LAYERS = ('layer_branch_index', 'layer_branch_index_parent', 'layer_branch_group')
+
+BranchFragment = namedtuple('BranchFragment', 'coords loops totals uvs layers vertex_count placements instances')
+
+
+def node_signature(node):
+    """
+    Everything about a node that the mesh of a branch is built from, as a hashable tuple.
+    """
+
+    if node is None:
+        return None
+
+    return (tuple(node.pos), tuple(node.direction), node.radius, node.thickness, node.age, node.weight,
+            node.photosynthesis, node.dead, tuple(len(sub.nodes) for sub in node.sub_branches))
+
+
+class BranchCache:
+    """
+    Keeps the skeleton and the mesh fragment (vertices, faces, uvs, layers and placed fronds) of every
+    branch between builds, so a rebuild only redraws branches that changed.
+
+    Skeletons are keyed on the branch's nodes as they are before smoothing, the nodes of the parent it
+    grows from and the smoothing settings.  Smoothing evens out node radii in place, so the radii it
+    left are stored alongside and put back on the nodes when the skeleton is reused, leaving the tree
+    as an uncached build would.  Fragments are keyed on the skeleton plus whether the branch is replaced and only the
+    settings that matter for that, so moving a cutoff only redraws the branches that flip over it and
+    frond settings never touch branches that are built as rings.
+
+    Fragments are stored relative to their first vertex and face and are spliced back in with their
+    indices moved to wherever the branch lands this build.  Anything not used by a build is dropped
+    at the end of it.
+    """
+
+    def __init__(self):
+        self.skeletons = {}
+        self.fragments = {}
+        self.begin_build()
+
+    def clear(self):
+        self.skeletons.clear()
+        self.fragments.clear()
+        self.begin_build()
+
+    def begin_build(self):
+        self.used_skeletons = set()
+        self.used_fragments = set()
+        self.hits = 0
+        self.misses = 0
+
+    def end_build(self):
+        """
+        Drops every skeleton and fragment the build that just finished didn't use.
+        """
+
+        for key in set(self.skeletons) - self.used_skeletons:
+            del self.skeletons[key]
+        for key in set(self.fragments) - self.used_fragments:
+            del self.fragments[key]
+
+    def level_cache(self):
+        """
+        Returns a cache for the lower levels of detail of the build in progress.  It shares this one's
+        skeletons but keeps fragments of its own, which go with it once the LOD chain is built rather
+        than being kept around for the next build.
+        """
+
+        cache = BranchCache()
+        cache.skeletons = self.skeletons
+        cache.used_skeletons = self.used_skeletons
+        return cache
+
+    def skeleton_key(self, branch, parent_previous_node, parent_node, parent_next_node, gardener):
+        branch_values = (branch.is_trunk, branch.dead, branch.power, branch.shade, branch.uv_offset_x, 
+                         branch.uv_offset_y, branch.initial_phyllotaxic_angle)
+
+        return (branch_values, tuple(node_signature(node) for node in branch.nodes),
+                node_signature(parent_previous_node), node_signature(parent_node), node_signature(parent_next_node),
+                gardener.use_fronds, gardener.smooth_factor)
+
+    def fragment_key(self, skeleton_key, replaced, gardener, fronds, build_values):
+        if replaced:
+            drawing = (gardener.frond_match_weight, gardener.stretch_x, gardener.stretch_yz, gardener.frond_output, 
+                       fronds[3])
+        elif gardener.reduce_edgeloops:
+            drawing = (True, gardener.edgeloop_reduce_mode, gardener.edgeloop_reduce_factor, gardener.edgeloop_tolerance)
+        else:
+            drawing = (False,)
+
+        return (skeleton_key, replaced, drawing, build_values)
+
+    def get_skeleton(self, key, branch):
+        stored = self.skeletons.get(key)
+        if stored is None:
+            return None
+
+        self.used_skeletons.add(key)
+        skeleton, radii = stored
+        for node, radius in zip(branch.nodes, radii):
+            node.radius = radius
+        return skeleton
+
+    def store_skeleton(self, key, skeleton, branch):
+        self.skeletons[key] = (skeleton, tuple(node.radius for node in branch.nodes))
+        self.used_skeletons.add(key)
+
+    def get_fragment(self, key):
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used_fragments.add(key)
+        return fragment
+
+    def store_fragment(self, key, fragment):
+        self.fragments[key] = fragment
+        self.used_fragments.add(key)
+
+    def mark(self, v, verts, faces, uvs, layers, frond_placements):
+        """
+        Returns where every buffer is before a branch is drawn, for cut().
+        """
+
+        return (v, verts.size, faces.loops.size, faces.totals.size, uvs.size,
+                {name: layer.size for name, layer in layers.items()}, len(frond_placements), 
+                len(frond_placements.instances))
+
+    def cut(self, start, v, verts, faces, uvs, layers, frond_placements):
+        """
+        Copies out everything drawn since mark() as a BranchFragment.
+        """
+
+        v_start, vert_size, loop_size, face_count, uv_size, layer_sizes, placement_count, instance_count = start
+
+        placements = [(face_start - face_count, frond_id) for face_start, frond_id in 
+                      zip(frond_placements.face_starts[placement_count:], frond_placements.frond_ids[placement_count:])]
+
+        return BranchFragment(
+            coords=verts.data[vert_size:verts.size].copy(),
+            loops=(faces.loops.data[loop_size:faces.loops.size] - v_start).astype(int32),
+            totals=faces.totals.data[face_count:faces.totals.size].copy(),
+            uvs=uvs.data[uv_size:uvs.size].copy(),
+            layers={name: layer.data[layer_sizes[name]:layer.size].copy() 
+                    for name, layer in layers.items() if name not in REBASED_LAYERS},
+            vertex_count=v - v_start,
+            placements=placements,
+            instances=frond_placements.instances[instance_count:],
+        )
+
+    def splice(self, fragment, v, verts, faces, uvs, layers, frond_placements, 
+               branch_index, branch_index_parent, branch_group):
+        """
+        Adds a stored fragment to the buffers as if the branch had just been drawn at vertex v, and
+        returns the new vertex count.
+        """
+
+        face_count = len(faces)
+        count = fragment.vertex_count
+
+        verts.extend(fragment.coords)
+        faces.extend_flat(fragment.loops + v, fragment.totals)
+        uvs.extend(fragment.uvs)
+
+        for name, values in fragment.layers.items():
+            layers[name].extend(values)
+        for name, value in zip(REBASED_LAYERS, (branch_index, branch_index_parent, branch_group)):
+            if name in layers:
+                layers[name].fill(value, count)
+
+        for face_start, frond_id in fragment.placements:
+            frond_placements.add(face_count + face_start, frond_id)
+        frond_placements.instances.extend(fragment.instances)
+
+        return v + count
+
+
+# Replace methods that judge a branch by everything growing from it, see subtree_index.
+SUBTREE_REPLACE_TYPES = ('SubtreeLength', 'HierarchySubtreeLength')
+
+
+def tracks_frond_tips(gardener):
+    """
+    Whether a build needs to record the skeleton node of every vertex for the Branch to Frond layer.
+    """
+
+    return gardener.use_fronds and (gardener.datalayer_branchtofrond or gardener.merge_layers)
+
+
+def uses_subtrees(replace_type, hierarchy_reverse):
+    """
+    Whether replacing branches the given way needs the subtree index of the tree.
+    """
+
+    return replace_type in SUBTREE_REPLACE_TYPES or (hierarchy_reverse and 'Hierarchy' in replace_type)
+
+
+def replaces_branch(replace_type, thickness, hierarchy, length, thickness_cutoff, hierarchy_cutoff, length_cutoff,
+                    hierarchy_reverse=False, subtree_depth=0, subtree_length=0.0):
+    """
+    Decides whether a branch is replaced with a frond, from the thickness of its first node, its
+    hierarchy and its length.  With hierarchy_reverse, hierarchy is counted from the tips instead by
+    the depth of the branch's subtree, and the subtree modes go by the length of the branch and everything
+    growing from it (both from subtree_index).
+    """
+
+    if hierarchy_reverse:
+        by_hierarchy = subtree_depth <= hierarchy_cutoff
+    else:
+        by_hierarchy = hierarchy >= hierarchy_cutoff
+
+    if replace_type == 'Thickness':
+        return thickness < thickness_cutoff
+    elif replace_type == 'Hierarchy':
+        return by_hierarchy
+    elif replace_type == 'Length':
+        return length < length_cutoff
+    elif replace_type == 'HierarchyThickness':
+        return by_hierarchy and thickness < thickness_cutoff
+    elif replace_type == 'HierarchyLength':
+        return by_hierarchy and length < length_cutoff
+    elif replace_type == 'SubtreeLength':
+        return subtree_length < length_cutoff
+    elif replace_type == 'HierarchySubtreeLength':
+        return by_hierarchy and subtree_length < length_cutoff
+
+    return False
+
+
+def replaced_branches(parents, thickness, hierarchy, lengths, 
+                      replace_type, thickness_cutoff, hierarchy_cutoff, length_cutoff,
+                      hierarchy_reverse=False, subtree_depth=None, subtree_lengths=None):
+    """
+    replaces_branch for a whole tree at once.  Branches are given parent first, parents holds the
+    index of every branch's parent (-1 for the trunk).  subtree_depth and subtree_lengths are only
+    needed when uses_subtrees says so.
+
+    Returns which branches are replaced and which are left out because a branch they grow from was
+    replaced, as build_branches_mesh never visits those.
+    """
+
+    by_thickness = thickness < thickness_cutoff
+    by_length = lengths < length_cutoff
+
+    if hierarchy_reverse and 'Hierarchy' in replace_type:
+        by_hierarchy = subtree_depth <= hierarchy_cutoff
+    else:
+        by_hierarchy = hierarchy >= hierarchy_cutoff
+
+    if replace_type == 'Thickness':
+        replaced = by_thickness
+    elif replace_type == 'Hierarchy':
+        replaced = by_hierarchy
+    elif replace_type == 'Length':
+        replaced = by_length
+    elif replace_type == 'HierarchyThickness':
+        replaced = by_hierarchy & by_thickness
+    elif replace_type == 'HierarchyLength':
+        replaced = by_hierarchy & by_length
+    elif replace_type == 'SubtreeLength':
+        replaced = subtree_lengths < length_cutoff
+    elif replace_type == 'HierarchySubtreeLength':
+        replaced = by_hierarchy & (subtree_lengths < length_cutoff)
+    else:
+        replaced = zeros(len(parents), dtype=bool)
+
+    # Walk up every branch's ancestors at once, one generation per pass.
+    hidden = zeros(len(parents), dtype=bool)
+    ancestor = parents.copy()
+    while True:
+        living = ancestor >= 0
+        if not living.any():
+            break
+        hidden[living] |= replaced[ancestor[living]]
+        ancestor[living] = parents[ancestor[living]]
+
+    return replaced & ~hidden, hidden
+
+
+def branch_depths(parents):
+    """
+    Returns how many branches every branch grows from, given parent first with -1 for the trunk.
+    """
+
+    depth = zeros(len(parents), dtype=int64)
+    ancestor = parents.copy()
+    while True:
+        living = ancestor >= 0
+        if not living.any():
+            break
+        depth[living] += 1
+        ancestor[living] = parents[ancestor[living]]
+
+    return depth
+
+
+def subtree_index(parents, lengths):
+    """
+    Sums up what grows from every branch in one pass from the tips down, branches given parent first
+    with -1 for the trunk.  Doing this once keeps the build from looking down the tree at every branch.
+
+    Returns the depth of every branch's subtree (1 for a branch with nothing growing from it, counting
+    levels of branches towards the tips), the length of the branch plus everything growing from it and
+    how many tips it ends in, which is how many fronds it would carry if only its tips were replaced.
+    """
+
+    depth = branch_depths(parents)
+    subtree_depth = ones(len(parents), dtype=int64)
+    subtree_lengths = asarray(lengths, dtype=float64).copy()
+    tips = (bincount(parents[parents >= 0], minlength=len(parents)) == 0).astype(int64)
+
+    # Every generation adds itself into its parents before they add themselves into theirs.
+    for level in range(int(depth.max(initial=0)), 0, -1):
+        branches = flatnonzero(depth == level)
+        maximum.at(subtree_depth, parents[branches], subtree_depth[branches] + 1)
+        add.at(subtree_lengths, parents[branches], subtree_lengths[branches])
+        add.at(tips, parents[branches], tips[branches])
+
+    return subtree_depth, subtree_lengths, tips
+
+
+def segment_minimum(values, segments, reverse=False):
+    """
+    The running minimum of values towards the end of the array (or the start with reverse), starting
+    over at every segment.  segments gives the segment of every value and only ever goes up.
+
+    Every segment is pushed below the ones scanned before it, so a single minimum.accumulate can't
+    carry a value across into the next.  Infinite values stay infinite.
+    """
+
+    finite = isfinite(values)
+    if not finite.any():
+        return values.copy()
+
+    top = float(abs(values[finite]).max()) + 1.0
+    step = 2.0 * top + 1.0
+    clipped = where(finite, values, top)
+    rank = concatenate(([0], cumsum(diff(segments) != 0))) * step
+
+    if reverse:
+        running = minimum.accumulate((clipped + rank)[::-1])[::-1] - rank
+    else:
+        running = minimum.accumulate(clipped - rank) + rank
+
+    return where(running > top - 0.5, inf, running)
+
+
+def ring_resolution(profile_resolution, profile_resolution_reduction, thickness, prev_res=None):
+    """
+    Returns how many vertices go around a branch at a node of the given thickness, following on
+    from the ring before it (None for the first ring of a branch).
+    """
+
+    # Reduce profile resolution on thinner branches, limited to one vertex per node. Minimum of 3 vertices.
+    cur_res = profile_resolution * thickness
+    cur_res = profile_resolution_reduction * cur_res + (1.0 - profile_resolution_reduction) * profile_resolution
+    cur_res = int(cur_res)
+    if cur_res < 3:
+        cur_res = 3
+
+    if prev_res is not None:
+        if cur_res < prev_res - 1:
+            cur_res = prev_res - 1
+        elif cur_res == 3 and prev_res == 4:
+            pass
+        elif cur_res > prev_res:
+            # The first ring uses the original first node's thickness, the smoothed nodes after it can be thicker.
+            cur_res = prev_res
+
+    if cur_res > profile_resolution:
+        cur_res = profile_resolution * 1
+
+    return cur_res
+
+
+def branch_rings(centers, tan, axi, radii, flare, resolutions, twists, ring_y, uv_repeat, uv_offset_x, cap_circle, v,
+                 twopi=6.2832):
+    """
+    Builds the bark of a branch in one go: the vertices of every ring, the faces joining each ring
+    to the one before it and the cap on the tip, along with their UVs.  Takes one entry per ring
+    for the centers, tangents, axes, radii, resolutions, twists and UV V, and returns the vertex
+    coordinates, flat face loops (starting at vertex v), loop totals and per-loop UVs.
+
+    Every vertex is the ring's axis scaled by its radius and spun around the tangent, the same as
+    Quaternion(tan, angle) @ axis, a zero tangent leaving it where it is.  flare holds the root
+    flare amount of every ring of the trunk, None on other branches.  cap_circle is the unit circle
+    at the last ring's resolution as (x, y) rows for the cap UVs, or None to leave the tip open.
+
+    Rings follow the rules of ring_resolution, so each has as many vertices as the one before or
+    one fewer.  Where it steps down the gap is closed with a quad and a triangle.
+    """
+
+    centers = asarray(centers, dtype=float64)
+    tan = asarray(tan, dtype=float64)
+    axi = asarray(axi, dtype=float64)
+    radii = asarray(radii, dtype=float64)
+    resolutions = asarray(resolutions, dtype=int64)
+    twists = asarray(twists, dtype=float64)
+    ring_y = asarray(ring_y, dtype=float64)
+
+    # Vertices, ring after ring.
+    starts = cumsum(resolutions) - resolutions
+    ring = repeat(arange(len(resolutions)), resolutions)
+    i = arange(len(ring)) - starts[ring]
+    res = resolutions[ring]
+
+    radius = radii[ring]
+    if flare is not None:
+        amount = asarray(flare, dtype=float64)[ring]
+        radius = radius + amount * (1.0 + 0.5 * sin(i * 6 / res * twopi))
+        radius += amount * (1.0 + 0.5 * cos(i * 9 / res * twopi)) * 0.5
+
+    spoke = axi[ring] * radius[:, None]
+    length = sqrt(einsum('ij,ij->i', tan, tan))
+    with errstate(divide='ignore', invalid='ignore'):
+        unit = where(length[:, None] > 0.0, tan / length[:, None], 0.0)[ring]
+    angle = i / res * twopi + twists[ring]
+    c, s = cos(angle)[:, None], sin(angle)[:, None]
+    coords = (spoke * c + cross(unit, spoke) * s + unit * einsum('ij,ij->i', unit, spoke)[:, None] * (1.0 - c) 
+              + centers[ring])
+
+    # Faces between each ring and the one before it, the quads in order and then the face(s) closing the ring.
+    cur = resolutions[1:]
+    prev = resolutions[:-1]
+    first = starts[1:] + v
+    same = prev == cur
+    closing = where(same, (cur != 2).astype(int64), 2 * (prev == cur + 1))
+    face_counts = cur - 1 + closing
+    face_starts = cumsum(face_counts) - face_counts
+
+    face_total = int(face_counts.sum())
+    loops = full((face_total, 4), -1, dtype=int64)
+    uvs = zeros((face_total, 4, 2), dtype=float64)
+    totals = full(face_total, 4, dtype=int32)
+
+    # Quads, i runs from 1 to the ring's resolution - 1.
+    r = repeat(arange(len(cur)), cur - 1)
+    i = arange(len(r)) - (cumsum(cur - 1) - (cur - 1))[r] + 1
+    at = face_starts[r] + i - 1
+    s_r, c_r, p_r = first[r], cur[r], prev[r]
+    loops[at] = stack([s_r - c_r + i - 1, s_r - c_r + i, s_r + i, s_r + i - 1], axis=1)
+
+    previous_y, current_y = ring_y[:-1][r], ring_y[1:][r]
+    a = (i - 1) / c_r * uv_repeat + uv_offset_x
+    b = i / c_r * uv_repeat + uv_offset_x
+    shift = where(same[r], 0.0, (1 / p_r) * uv_repeat)
+    a_prev = where(same[r], a, (i - 1) / p_r * uv_repeat + uv_offset_x + shift)
+    b_prev = where(same[r], b, i / p_r * uv_repeat + uv_offset_x + shift)
+    uvs[at] = stack([stack([a_prev, previous_y], axis=1), stack([b_prev, previous_y], axis=1),
+                     stack([b, current_y], axis=1), stack([a, current_y], axis=1)], axis=1)
+
+    # Closing faces, a quad between rings of the same resolution (bar 2) or a quad and a triangle where it steps down.
+    # Their UVs are shifted left a whole repeat to keep the border of the UV map straight.
+    previous_y, current_y = ring_y[:-1], ring_y[1:]
+    i = cur - 1
+    a = i / cur * uv_repeat + uv_offset_x - uv_repeat
+    b = uv_repeat + uv_offset_x - uv_repeat
+    shift = (1 / prev) * uv_repeat
+    prev_a = (i + 1) / prev * uv_repeat + uv_offset_x - uv_repeat
+
+    quad = flatnonzero(same & (cur != 2))
+    at = face_starts[quad] + cur[quad] - 1
+    s_q, c_q = first[quad], cur[quad]
+    loops[at] = stack([s_q - 1, s_q - c_q, s_q, s_q + c_q - 1], axis=1)
+    uvs[at] = stack([stack([a[quad], previous_y[quad]], axis=1), stack([full(len(quad), b), previous_y[quad]], axis=1),
+                     stack([full(len(quad), b), current_y[quad]], axis=1), stack([a[quad], current_y[quad]], axis=1)],
+                    axis=1)
+
+    step = flatnonzero(prev == cur + 1)
+    at = face_starts[step] + cur[step] - 1
+    s_q, c_q = first[step], cur[step]
+    loops[at] = stack([s_q - c_q - 1, s_q - c_q, s_q, s_q + c_q - 1], axis=1)
+    uvs[at] = stack([stack([prev_a[step] + shift[step], previous_y[step]], axis=1),
+                     stack([b + shift[step], previous_y[step]], axis=1),
+                     stack([full(len(step), b), current_y[step]], axis=1),
+                     stack([a[step], current_y[step]], axis=1)], axis=1)
+    loops[at + 1, :3] = stack([s_q - 1, s_q - c_q - 1, s_q + c_q - 1], axis=1)
+    uvs[at + 1, :3] = stack([stack([prev_a[step], previous_y[step]], axis=1),
+                             stack([full(len(step), b), previous_y[step]], axis=1),
+                             stack([a[step], current_y[step]], axis=1)], axis=1)
+    totals[at + 1] = 3
+
+    loops = loops[arange(4) < totals[:, None]]
+    uvs = uvs[arange(4) < totals[:, None]]
+
+    # The cap, a fan of triangles from a vertex in the middle of the last ring.
+    if cap_circle is not None:
+        last_res = int(resolutions[-1])
+        last_first = int(starts[-1]) + v
+        center = v + len(coords)
+        i = arange(last_res)
+        cap_loops = stack([last_first + (last_res - 2 - i) % last_res, last_first + last_res - 1 - i,
+                           full(last_res, center)], axis=1)
+        cap_loops[-1, :2] = last_first + last_res - 1, last_first
+
+        cap_circle = asarray(cap_circle, dtype=float64) * 0.5 + 0.5
+        cap_uvs = stack([cap_circle[(i + 1) % last_res], cap_circle[i], full((last_res, 2), 0.5)], axis=1)
+
+        coords = concatenate([coords, centers[-1:]])
+        loops = concatenate([loops, cap_loops.reshape(-1)])
+        totals = concatenate([totals, full(last_res, 3, dtype=int32)])
+        uvs = concatenate([uvs, cap_uvs.reshape(-1, 2)])
+
+    return coords, loops.astype(int32), totals, uvs
+
+
+def kept_edgeloops(nodes, tan, reduce_factor):
+    """
+    Returns whether each node of a branch keeps its edge loop when Reduce Edge Loops is on.
+
+    A loop is skipped when the branch barely bends between it and the last loop that was kept,
+    unless a sub branch grows from it.  Every skip in a row raises the bar for the next one, so
+    long gentle curves still get the odd loop.  The first two and the last node are always kept.
+    """
+
+    units = unit_rows(tan)
+    increment = (1 - reduce_factor) / 10
+    threshold = reduce_factor
+    last_node_index = len(nodes) - 1
+    last_loop = None
+    kept = []
+
+    for j, n in enumerate(nodes):
+        if j > 1 and j != last_node_index:
+            dot = units[last_loop] @ units[j]
+
+            if dot > threshold:
+                if len(n.sub_branches) == 0:
+                    threshold += increment
+                    kept.append(False)
+                    continue
+            else:
+                last_loop = j
+                threshold = reduce_factor
+        else:
+            last_loop = j
+
+        kept.append(True)
+
+    return kept
+
+
+def tolerance_edgeloops(positions, radii, mandatory, tolerance):
+    """
+    Returns whether each node of a branch keeps its edge loop in the Tolerance mode of Reduce Edge Loops.
+
+    Between two kept loops the bark is a straight tube with its radius and the V of its UVs blended
+    linearly, so this keeps the fewest loops that hold every skipped node within the tolerance of that
+    blend (Douglas-Peucker on the node polyline).  The error of a node is how far its ring moves, its
+    position plus its radius, or how far its texture slides around that ring, whichever is more.
+    Nodes marked mandatory are always kept, as are the first and last.
+
+    Spans are split at their worst node until everything fits.  Where that would cut a span of 8 or
+    more nodes lopsided, leaving less than a quarter of it on one side, it's cut at its middle node
+    instead.  No part is then more than three quarters of the span it came from, so the splits are
+    O(log n) deep and the whole branch takes O(n log n) for n nodes, at the cost of the odd extra loop
+    on very lopsided branches.
+    """
+
+    positions = asarray(positions, dtype=float64)
+    radii = asarray(radii, dtype=float64)
+
+    # Distance along the branch, and V before the texture aspect is applied, which cancels out of the
+    # error once it's turned back into a distance around the ring.
+    lengths = sqrt(((positions[1:] - positions[:-1]) ** 2).sum(axis=1))
+    along = concatenate([[0.0], cumsum(lengths)])
+    v = concatenate([[0.0], cumsum(lengths / (2.0 * pi * maximum(radii[1:], 1e-9)))])
+
+    kept = asarray(mandatory, dtype=bool).copy()
+    kept[0] = kept[-1] = True
+
+    anchors = flatnonzero(kept)
+    spans = list(zip(anchors[:-1].tolist(), anchors[1:].tolist()))
+
+    while spans:
+        a, b = spans.pop()
+        if b - a < 2:
+            continue
+
+        span = along[b] - along[a]
+        t = (along[a + 1:b] - along[a]) / span if span > 0.0 else zeros(b - a - 1)
+
+        position_error = sqrt(((positions[a + 1:b] - (positions[a] + t[:, None] * (positions[b] - positions[a]))) ** 2)
+                              .sum(axis=1))
+        radius_error = abs(radii[a + 1:b] - (radii[a] + t * (radii[b] - radii[a])))
+        v_error = abs(v[a + 1:b] - (v[a] + t * (v[b] - v[a]))) * 2.0 * pi * radii[a + 1:b]
+        error = maximum(position_error + radius_error, v_error)
+
+        worst = int(argmax(error))
+        if error[worst] > tolerance:
+            m = a + 1 + worst
+            if b - a >= 8 and min(m - a, b - m) * 4 < b - a:
+                m = (a + b) // 2
+            kept[m] = True
+            spans.append((a, m))
+            spans.append((m, b))
+
+    return kept
+
+
+def select_edgeloops(nodes, tan, gardener, leading=2):
+    """
+    Returns whether each node of a branch keeps its edge loop, or None when Reduce Edge Loops is off.
+    In Tolerance mode the first leading nodes and any with a sub branch are always kept.
+    """
+
+    if not gardener.reduce_edgeloops:
+        return None
+
+    if gardener.edgeloop_reduce_mode == 'Tolerance':
+        mandatory = [j < leading or len(n.sub_branches) > 0 for j, n in enumerate(nodes)]
+        return tolerance_edgeloops([tuple(n.pos) for n in nodes], [n.radius for n in nodes], mandatory,
+                                   gardener.edgeloop_tolerance)
+
+    return kept_edgeloops(nodes, tan, gardener.edgeloop_reduce_factor)
+
+
+def root_flare_nodes(is_trunk, root_distribution, node_count):
+    """
+    Returns how many loops at the base of a branch select_edgeloops has to keep.  That's the first
+    two, or on the trunk every one the root flare shapes if there are more.
+    """
+
+    if not is_trunk:
+        return 2
+
+    return max(int(ceil(root_distribution * node_count)), 2)
+
+
+def lateral_twig_branching(branching, power):
+    """
+    Returns how many lateral twigs grow from a node of a branch with the given power.
+    """
+
+    current_branching = int(branching * min(1.0, power))
+    if branching > 1 and current_branching < 2:
+        current_branching = 2
+    elif branching == 1 and current_branching == 0:
+        current_branching = 1
+
+    return current_branching
+
+
+# The 12 edges of a box, as pairs of corner indices.  Corners are numbered by their x, y, z bits.
+BOX_EDGES = asarray([(0, 1), (2, 3), (4, 5), (6, 7), (0, 2), (1, 3), (4, 6), (5, 7), (0, 4), (1, 5), (2, 6), (3, 7)])
+BOX_CORNERS = asarray([(i & 1, (i >> 1) & 1, (i >> 2) & 1) for i in range(8)], dtype=float64)
+
+
+class TreeSkeleton:
+    """
+    A tree from The Grove exported once into flat arrays, so Gardener passes can ask it about every
+    node or branch at once rather than walking Branch and Node objects and reading their attributes.
+
+    Branches are stored in the order build_branches_mesh builds them (a branch's parent always has a
+    lower index) with their nodes laid end to end, branch b holding nodes branch_offsets[b] up to
+    branch_offsets[b + 1].  Branches with fewer than two nodes are left out as they're never built.
+    The Branch and Node objects are kept alongside for writing node radii back.
+    """
+
+    def __init__(self, branches, nodes, counts, parents, parent_nodes):
+        """
+        Takes every branch, all of their nodes end to end, how many nodes each branch has, the index
+        of each branch's parent and the index of the node it grows from (both -1 for the trunk).
+        """
+
+        self.branches = branches
+        self.nodes = nodes
+
+        counts = asarray(counts, dtype=int64)
+        self.branch_offsets = concatenate(([0], cumsum(counts)))
+        self.parents = asarray(parents, dtype=int64)
+        self.parent_nodes = asarray(parent_nodes, dtype=int64)
+        self.node_branch = repeat(arange(len(counts)), counts)
+
+        self.positions = asarray([node.pos[:] for node in nodes], dtype=float64).reshape(-1, 3)
+        self.radius = asarray([node.radius for node in nodes], dtype=float64)
+        self.thickness = asarray([node.thickness for node in nodes], dtype=float64)
+        self.age = asarray([node.age for node in nodes], dtype=float64)
+        self.weight = asarray([node.weight for node in nodes], dtype=float64)
+        self.photosynthesis = asarray([node.photosynthesis for node in nodes], dtype=float64)
+
+        # The node every node follows on from, the first node of a branch follows the node it grows from.
+        starts = self.branch_offsets[:-1]
+        self.node_parents = arange(len(nodes)) - 1
+        self.node_parents[starts] = self.parent_nodes
+
+        # Distance of every node from the start of its branch, along the nodes as The Grove grew them.
+        steps = self.positions[1:] - self.positions[:-1]
+        step_lengths = concatenate(([0.0], sqrt(einsum('ij,ij->i', steps, steps))))
+        step_lengths[starts] = 0.0
+        along = cumsum(step_lengths)
+        self.distances = along - repeat(along[starts], counts)
+        self.lengths = self.distances[self.branch_offsets[1:] - 1]
+
+        # Hierarchy restarts at 0 for every branch coming off the trunk, the way build_branches_mesh counts it.
+        self.hierarchy = maximum(branch_depths(self.parents) - 1, 0)
+
+        # What grows from every branch, and where each branch object sits for looking that up in a build.
+        self.subtree_depth, self.subtree_lengths, self.subtree_tips = subtree_index(self.parents, self.lengths)
+        self.rows = {id(branch): i for i, branch in enumerate(branches)}
+
+        # The length of every branch once smoothed, which Length cutoffs and frond picking go by.  Builds
+        # and counts fill this in with record_lengths, until then it's the length as grown.
+        self.smoothed_lengths = self.lengths.copy()
+
+    @classmethod
+    def from_tree(cls, tree):
+        """
+        Walks a tree from The Grove once, in build order.
+        """
+
+        branches = []
+        nodes = []
+        counts = []
+        parents = []
+        parent_nodes = []
+
+        unvisited = [(tree, -1, -1)]
+        while unvisited:
+            branch, parent, parent_node = unvisited.pop()
+            index = len(branches)
+            first = len(nodes)
+
+            branches.append(branch)
+            nodes.extend(branch.nodes)
+            counts.append(len(branch.nodes))
+            parents.append(parent)
+            parent_nodes.append(parent_node)
+
+            for i in reversed(range(len(branch.nodes))):
+                for sub_branch in reversed(branch.nodes[i].sub_branches):
+                    if len(sub_branch.nodes) >= 2:
+                        unvisited.append((sub_branch, index, first + i))
+
+        return cls(branches, nodes, counts, parents, parent_nodes)
+
+    def __len__(self):
+        return len(self.branches)
+
+    def first_nodes(self, values):
+        """
+        Returns the value of the first node of every branch, from one of the node arrays.
+        """
+
+        return values[self.branch_offsets[:-1]]
+
+    def replaced(self, replace_type, thickness_cutoff, hierarchy_cutoff, length_cutoff, hierarchy_reverse=False):
+        """
+        Returns which branches would be replaced with fronds and which would be left out because a
+        branch they grow from was replaced, judging lengths by smoothed_lengths.
+        """
+
+        return replaced_branches(self.parents, self.first_nodes(self.thickness), self.hierarchy, 
+                                 self.smoothed_lengths, replace_type, thickness_cutoff, hierarchy_cutoff, length_cutoff,
+                                 hierarchy_reverse, self.subtree_depth, self.subtree_lengths)
+
+    def tip_distances(self, tips):
+        """
+        Returns how far every node is from the closest of the given tip nodes along the tree, infinite
+        everywhere without any.
+
+        The skeleton is a tree, so shortest paths from every tip at once take one pass in from the tips
+        to the trunk and one back out, each a generation of branches at a time.  Along a branch that's a
+        running minimum, and every branch hands its first node over to the node it grows from.
+        """
+
+        distances = full(len(self.nodes), inf)
+        tips = asarray(tips, dtype=int64)
+        if len(tips) == 0:
+            return distances
+        distances[tips] = 0.0
+
+        along = self.distances
+        starts = self.branch_offsets[:-1]
+        depth = branch_depths(self.parents)
+        node_depth = depth[self.node_branch]
+
+        # How far the first node of every branch is from the node it grows from.
+        joins = zeros(len(self), dtype=float64)
+        grown = flatnonzero(self.parents >= 0)
+        steps = self.positions[starts[grown]] - self.positions[self.parent_nodes[grown]]
+        joins[grown] = sqrt(einsum('ij,ij->i', steps, steps))
+
+        levels = range(int(depth.max(initial=0)) + 1)
+        level_nodes = [flatnonzero(node_depth == level) for level in levels]
+        level_branches = [flatnonzero((depth == level) & (self.parents >= 0)) for level in levels]
+
+        # In towards the trunk, every node takes the closest tip further out along its branch or beyond.
+        for level in reversed(levels):
+            nodes = level_nodes[level]
+            distances[nodes] = segment_minimum(distances[nodes] + along[nodes], self.node_branch[nodes], 
+                                               reverse=True) - along[nodes]
+
+            branches = level_branches[level]
+            minimum.at(distances, self.parent_nodes[branches], distances[starts[branches]] + joins[branches])
+
+        # Back out, every node also takes the closest tip back down its branch and through its parent.
+        for level in levels:
+            branches = level_branches[level]
+            firsts = starts[branches]
+            distances[firsts] = minimum(distances[firsts], distances[self.parent_nodes[branches]] + joins[branches])
+
+            nodes = level_nodes[level]
+            distances[nodes] = segment_minimum(distances[nodes] - along[nodes], self.node_branch[nodes]) + along[nodes]
+
+        return distances
+
+    def record_lengths(self, rows, lengths):
+        """
+        Keeps the smoothed lengths of the given branches, as a build or count measured them.
+        """
+
+        rows = asarray(rows, dtype=int64)
+        if len(rows):
+            self.smoothed_lengths[rows] = lengths
+
+    def highest_point(self):
+        """
+        Returns the height of the highest node, never below 0 as the tree grows up from there.
+        """
+
+        return max(float(self.positions[:, 2].max()), 0.0)
+
+    def refresh_radii(self):
+        """
+        Reads every node radius in again, as smoothing evens them out in place during a build.
+        """
+
+        self.radius = asarray([node.radius for node in self.nodes], dtype=float64)
+
+    def restore_radii(self):
+        """
+        Puts every node radius back to what it was when the tree was exported (or last refreshed).
+        """
+
+        for node, radius in zip(self.nodes, self.radius.tolist()):
+            node.radius = radius
+
+
+class SkeletonPreview:
+    """
+    Every branch of a tree as flat arrays, for previewing which branches Gardener would replace
+    without building anything.
+
+    Branches are stored parent first (a branch's parent always has a lower index), with the nodes
+    of every branch laid end to end in points.  Everything that doesn't depend on the replacement
+    settings is worked out once here, so replaced() and frond_boxes() only do array operations.
+
+    Branch lengths are the smoothed ones a build judges them by when they're given (see
+    TreeSkeleton.smoothed_lengths), so the preview agrees with the build and the Polycount panel
+    right at a Length cutoff.  Subtree lengths are always measured along the nodes as The Grove
+    grew them, as the build does too.
+    """
+
+    def __init__(self, points, counts, parents, hierarchy, thickness, radius, lengths=None):
+        """
+        Takes the nodes of every branch end to end, how many each branch has, the index of each
+        branch's parent (-1 for the trunk), its hierarchy and the thickness and radius of its first node.
+        Lengths are measured along the nodes unless they're given.
+        """
+
+        self.points = asarray(points, dtype=float64).reshape(-1, 3)
+        self.counts = asarray(counts, dtype=int64)
+        self.parents = asarray(parents, dtype=int64)
+        self.hierarchy = asarray(hierarchy, dtype=int64)
+        self.thickness = asarray(thickness, dtype=float64)
+        self.starts = cumsum(self.counts) - self.counts
+
+        # Every segment between two nodes of the same branch, and which branch it belongs to.
+        branch_of_point = repeat(arange(len(self.counts)), self.counts)
+        first = zeros(len(self.points), dtype=bool)
+        first[self.starts] = True
+        ends = arange(1, len(self.points))[~first[1:]]
+        self.segments = stack([ends - 1, ends], axis=1)
+        self.segment_branch = branch_of_point[ends]
+
+        # Branch lengths.
+        steps = self.points[ends] - self.points[ends - 1]
+        grown_lengths = bincount(self.segment_branch, weights=sqrt(einsum('ij,ij->i', steps, steps)),
+                                 minlength=len(self.counts))
+        self.lengths = grown_lengths if lengths is None else asarray(lengths, dtype=float64)
+        self.subtree_depth, self.subtree_lengths, _ = subtree_index(self.parents, grown_lengths)
+
+        # Widths and tip spreads are only needed with a match weight, see pick_fronds.
+        self.radius = asarray(radius, dtype=float64)
+        self.widths = None
+        self.tip_spreads = None
+
+        # The frame of the first node, which frond boxes are lined up with.
+        tangents = unit_rows(self.points[self.starts + 1] - self.points[self.starts])
+        up = zeros(tangents.shape)
+        up[:, 2] = 1.0
+        vertical = abs(tangents[:, 2]) > 0.999
+        up[vertical] = (1.0, 0.0, 0.0)
+        axes = unit_rows(cross(up, tangents))
+        self.frames = stack([tangents, axes, cross(tangents, axes)], axis=1)
+
+        self.frond_ids = None
+        self.frond_key = None
+
+    @classmethod
+    def from_skeleton(cls, skeleton):
+        """
+        Takes every branch of an exported TreeSkeleton, with positions relative to the base of the trunk.
+        """
+
+        return cls(skeleton.positions - skeleton.positions[0], diff(skeleton.branch_offsets), skeleton.parents,
+                   skeleton.hierarchy, skeleton.first_nodes(skeleton.thickness), skeleton.first_nodes(skeleton.radius),
+                   skeleton.smoothed_lengths)
+
+    @classmethod
+    def from_tree(cls, tree):
+        """
+        Walks a tree from The Grove and returns every branch of it, see from_skeleton.
+        """
+
+        return cls.from_skeleton(TreeSkeleton.from_tree(tree))
+
+    def __len__(self):
+        return len(self.counts)
+
+    def replaced(self, replace_type, thickness_cutoff, hierarchy_cutoff, length_cutoff, hierarchy_reverse=False):
+        """
+        Returns which branches would be replaced with fronds and which would be left out because a
+        branch they grow from was replaced.
+        """
+
+        return replaced_branches(self.parents, self.thickness, self.hierarchy, self.lengths,
+                                 replace_type, thickness_cutoff, hierarchy_cutoff, length_cutoff,
+                                 hierarchy_reverse, self.subtree_depth, self.subtree_lengths)
+
+    def pick_fronds(self, frond_index, weight):
+        """
+        Returns the frond every branch would be replaced with, worked out once per match weight.
+        Branch widths are measured the first time a weight is used, after that a new weight is only
+        a few array operations.
+        """
+
+        key = (id(frond_index), weight)
+        if self.frond_key == key:
+            return self.frond_ids
+
+        if weight > 0.0 and self.widths is None:
+            descriptors = [branch_descriptor(self.points[s:s + c], r)
+                           for s, c, r in zip(self.starts, self.counts, self.radius)]
+            self.widths = asarray([d[0] for d in descriptors], dtype=float64)
+            self.tip_spreads = asarray([d[1] for d in descriptors], dtype=float64)
+
+        self.frond_ids = frond_index.lookup_weighted(self.lengths, self.widths, self.tip_spreads, weight)
+
+        self.frond_key = key
+
+        return self.frond_ids
+
+    def skeleton_lines(self, shown):
+        """
+        Returns the start and end point of every segment of the branches marked in shown.
+        """
+
+        segments = self.segments[shown[self.segment_branch]]
+        return self.points[segments.reshape(-1)]
+
+    def frond_boxes(self, selected, frond_ids, frond_bounds, stretch_x, stretch_yz):
+        """
+        Returns the edges of the bounding box of the frond every selected branch would get, stretched
+        the way build_branches_mesh would stretch it, as pairs of points.
+
+        frond_bounds holds the lowest and highest corner of every frond in the library as (n, 2, 3).
+        """
+
+        branches = arange(len(self.counts))[selected]
+        ids = frond_ids[branches]
+        low = frond_bounds[ids, 0]
+        high = frond_bounds[ids, 1]
+
+        stretch = zeros((len(branches), 3)) + 1.0
+        if stretch_x > 0:
+            with errstate(divide='ignore', invalid='ignore'):
+                fit = self.lengths[branches] / (high[:, 0] - low[:, 0]) - 1.0
+            fit = where(isfinite(fit), fit, 0.0)
+            stretch[:, 0] = fit * stretch_x + 1.0
+            if stretch_yz > 0:
+                stretch[:, 1] = fit * stretch_yz + 1.0
+                stretch[:, 2] = fit * stretch_yz + 1.0
+
+        corners = (low[:, None, :] + (high - low)[:, None, :] * BOX_CORNERS[None]) * stretch[:, None, :]
+        corners = einsum('bij,bjk->bik', corners, self.frames[branches])
+        corners += self.points[self.starts[branches]][:, None, :]
+
+        return corners[:, BOX_EDGES.reshape(-1)].reshape(-1, 3), repeat(ids, len(BOX_EDGES) * 2)
+
+
+class PolyCountTable:
+    """
+    What every branch of a tree adds to the mesh, both drawn as bark and replaced with a frond,
+    recorded by Branch.count_branches_mesh without building any geometry.
+
+    Only the replacement decision depends on the cutoffs, so totals() gives the exact count for
+    any cutoff with a few array operations and solve() can try as many as it likes.  Counts for
+    bark branches include their twig triangles, triangles count quads as two.
+
+    Branches are added in the same order as TreeSkeleton holds them, so the subtree depths and
+    lengths of the skeleton line up with the rows for Reverse Hierarchy and the subtree modes.
+
+    Frond counts are always recorded, instanced fronds never reach the tree mesh so totals() leaves
+    them out when the frond output is 'Instances'.  That's the output the tree was counted with
+    unless another one is given.
+    """
+
+    def __init__(self, subtree_depth=None, subtree_lengths=None, frond_output='Mesh'):
+        self.rows = []
+        self.arrays = None
+        self.subtree_depth = subtree_depth
+        self.subtree_lengths = subtree_lengths
+        self.frond_output = frond_output
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, parent, hierarchy, thickness, length, bark, frond):
+        """
+        Adds a branch and returns its index.  bark and frond are (vertices, faces, triangles).
+        """
+
+        self.rows.append((parent, hierarchy, thickness, length) + tuple(bark) + tuple(frond))
+        self.arrays = None
+        return len(self.rows) - 1
+
+    def columns(self):
+        if self.arrays is None:
+            table = asarray(self.rows, dtype=float64).reshape(-1, 10)
+            self.arrays = (table[:, 0].astype(int64), table[:, 1].astype(int64), table[:, 2], table[:, 3],
+                           table[:, 4:7].astype(int64), table[:, 7:10].astype(int64))
+        return self.arrays
+
+    def totals(self, use_fronds, replace_type, thickness_cutoff, hierarchy_cutoff, length_cutoff,
+               hierarchy_reverse=False, frond_output=None):
+        """
+        Returns the vertex, face and triangle count of the tree with the given settings.
+        """
+
+        parents, hierarchy, thickness, lengths, bark, frond = self.columns()
+        if (frond_output or self.frond_output) == 'Instances':
+            frond = zeros_like(frond)
+
+        if not use_fronds:
+            return tuple(int(total) for total in bark.sum(axis=0))
+
+        replaced, hidden = replaced_branches(parents, thickness, hierarchy, lengths,
+                                             replace_type, thickness_cutoff, hierarchy_cutoff, length_cutoff,
+                                             hierarchy_reverse, self.subtree_depth, self.subtree_lengths)
+        kept = ~replaced & ~hidden
+
+        return tuple(int(total) for total in bark[kept].sum(axis=0) + frond[replaced].sum(axis=0))
+
+    def candidates(self, cutoff, hierarchy_reverse=False, subtree=False, minimum_length=0.0):
+        """
+        Returns one value of the given cutoff ('thickness', 'hierarchy' or 'length') for every
+        distinct way it can split the tree, in increasing order.  Float cutoffs sit halfway between
+        the branch values so they survive being stored as a float property.  Hierarchy counts from
+        the tips with hierarchy_reverse and lengths are subtree lengths with subtree.  Lengths are
+        kept to at least minimum_length, the smallest the length cutoff property will hold.
+        """
+
+        parents, hierarchy, thickness, lengths, bark, frond = self.columns()
+
+        if cutoff == 'hierarchy':
+            if hierarchy_reverse:
+                return arange(1, max(int(self.subtree_depth.max()) + 1, 2))
+            return arange(1, max(int(hierarchy.max()) + 2, 2))
+
+        if cutoff == 'length' and subtree:
+            lengths = self.subtree_lengths
+
+        values = unique(thickness if cutoff == 'thickness' else lengths)
+        if len(values) == 0:
+            return asarray([0.0 if cutoff == 'thickness' else minimum_length])
+
+        values = concatenate([[0.0], (values[:-1] + values[1:]) / 2.0, [values[-1] * 1.01 + 0.0001]])
+        if cutoff == 'length':
+            # GARDENER - Anything under the minimum would be clamped up to it once stored, giving
+            # a different triangle count than the one reported.
+            values = unique(maximum(values, minimum_length))
+        return values
+
+    def solve(self, budget, replace_type, thickness_cutoff, hierarchy_cutoff, length_cutoff, hierarchy_reverse=False,
+              frond_output=None, minimum_length=0.0):
+        """
+        Binary searches the cutoff the replace type works from (thickness for Hierarchy + Thickness,
+        length for Hierarchy + Length and the subtree modes) for the value whose triangle count lands
+        closest to the budget.  The other cutoffs and the frond output stay as given, and a length
+        cutoff is never set under minimum_length.
+
+        Returns the name of the cutoff, its value and the triangle count it gives.
+        """
+
+        cutoff = {'Thickness': 'thickness', 'HierarchyThickness': 'thickness', 'Hierarchy': 'hierarchy',
+                  'Length': 'length', 'HierarchyLength': 'length', 'SubtreeLength': 'length', 
+                  'HierarchySubtreeLength': 'length'}[replace_type]
+        values = self.candidates(cutoff, hierarchy_reverse, replace_type in SUBTREE_REPLACE_TYPES, minimum_length)
+        settings = {'thickness': thickness_cutoff, 'hierarchy': hierarchy_cutoff, 'length': length_cutoff}
+
+        def triangles(k):
+            settings[cutoff] = values[k]
+            return self.totals(True, replace_type, settings['thickness'], settings['hierarchy'], 
+                               settings['length'], hierarchy_reverse, frond_output)[2]
+
+        # Raising a thickness or length cutoff (or lowering a hierarchy one, raising it when counted from
+        # the tips) replaces more branches, which normally means fewer triangles.  Search for the first
+        # value at or under the budget.
+        fewer = cutoff != 'hierarchy' or hierarchy_reverse
+        low, high = 0, len(values) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if (triangles(middle) <= budget) == fewer:
+                high = middle
+            else:
+                low = middle + 1
+
+        # Fronds can outweigh the branches they replace, so settle on whichever neighbour is closest.
+        best = min((abs(triangles(k) - budget), k) for k in range(max(low - 1, 0), min(low + 2, len(values))))[1]
+
+        return cutoff, values[best].item(), triangles(best)
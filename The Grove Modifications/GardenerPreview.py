@@ -0,0 +1,136 @@
+# This adds the frond replacement preview, which draws the tree's skeleton in the viewport along with
+# boxes showing which branches would be replaced by which fronds, without building a mesh.
+
+import bpy
+import gpu
+from gpu_extras.batch import batch_for_shader
+from colorsys import hsv_to_rgb
+from numpy import asarray, concatenate, stack, zeros, float32
+from .GardenerMesh import SkeletonPreview
+
+# GARDENER - The skeleton of the last build made with Preview Replacement on, see capture_preview.
+preview_state = {}
+
+# Colour of the branches that would stay bark.
+SKELETON_COLOR = (0.85, 0.85, 0.85, 1.0)
+
+
+def capture_preview(skeleton, ob, frond_data, scale_to_twig):
+    """
+    Keeps every branch of the tree's TreeSkeleton as a SkeletonPreview for the viewport, including the ones
+    this build replaced and never meshed, along with the bounds of the frond library.
+    """
+
+    # The build smoothed node radii since the skeleton was exported.
+    skeleton.refresh_radii()
+
+    preview_state.clear()
+    preview_state['skeleton'] = SkeletonPreview.from_skeleton(skeleton)
+    preview_state['object'] = ob.name
+    preview_state['scale_to_twig'] = scale_to_twig
+    preview_state['batch_key'] = None
+
+    if frond_data and frond_data[0]:
+        fronds, material_layers, frond_index, signature = frond_data
+        preview_state['frond_index'] = frond_index
+        preview_state['frond_bounds'] = stack([stack([frond.coords.min(axis=0), frond.coords.max(axis=0)])
+                                               for frond in fronds])
+        preview_state['frond_colors'] = frond_colors(len(fronds))
+
+    register_preview()
+    tag_preview_redraw()
+
+
+def frond_colors(count):
+    """
+    Returns a distinct colour for every frond in the library, spread around the hue wheel.
+    """
+
+    return asarray([hsv_to_rgb((i * 0.618034) % 1.0, 0.75, 1.0) + (1.0,) for i in range(count)], dtype=float32)
+
+
+def preview_batch(scene):
+    """
+    Returns the line batch for the current replacement settings, only rebuilding it when one of them changed.
+    """
+
+    skeleton = preview_state['skeleton']
+
+    key = (scene.gardener_use_fronds, scene.gardener_frond_replace_type, scene.gardener_thickness_cutoff,
+           scene.gardener_hierarchy_cutoff, scene.gardener_hierarchy_reverse, scene.gardener_length_cutoff, 
+           scene.gardener_frond_match_weight,
+           scene.gardener_stretch_factor_x, scene.gardener_stretch_factor_yz)
+    if preview_state['batch_key'] == key:
+        return preview_state['batch']
+
+    replaced = zeros(len(skeleton), dtype=bool)
+    hidden = zeros(len(skeleton), dtype=bool)
+    if scene.gardener_use_fronds and 'frond_index' in preview_state:
+        replaced, hidden = skeleton.replaced(scene.gardener_frond_replace_type, scene.gardener_thickness_cutoff,
+                                             scene.gardener_hierarchy_cutoff,
+                                             scene.gardener_length_cutoff / preview_state['scale_to_twig'],
+                                             scene.gardener_hierarchy_reverse)
+
+    coords = skeleton.skeleton_lines(~replaced & ~hidden)
+    colors = zeros((len(coords), 4), dtype=float32) + asarray(SKELETON_COLOR, dtype=float32)
+
+    if replaced.any():
+        frond_ids = skeleton.pick_fronds(preview_state['frond_index'], scene.gardener_frond_match_weight)
+        box_coords, box_ids = skeleton.frond_boxes(replaced, frond_ids, preview_state['frond_bounds'],
+                                                   scene.gardener_stretch_factor_x, scene.gardener_stretch_factor_yz)
+        coords = concatenate([coords, box_coords])
+        colors = concatenate([colors, preview_state['frond_colors'][box_ids]])
+
+    shader = gpu.shader.from_builtin('3D_SMOOTH_COLOR')
+    preview_state['shader'] = shader
+    preview_state['batch'] = batch_for_shader(shader, 'LINES', {"pos": coords.astype(float32), "color": colors})
+    preview_state['batch_key'] = key
+
+    return preview_state['batch']
+
+
+def draw_preview():
+    """
+    Draws the preview over the built tree, following the object if it was moved since.
+    """
+
+    scene = bpy.context.scene
+    if not getattr(scene, 'gardener_preview', False) or 'skeleton' not in preview_state:
+        return
+
+    ob = bpy.data.objects.get(preview_state['object'])
+    if ob is None:
+        return
+
+    batch = preview_batch(scene)
+
+    gpu.matrix.push()
+    gpu.matrix.multiply_matrix(ob.matrix_world)
+    preview_state['shader'].bind()
+    batch.draw(preview_state['shader'])
+    gpu.matrix.pop()
+
+
+def register_preview():
+    """
+    Adds draw_preview to the 3D viewport.  The handle lives in the driver namespace so reloading
+    The Grove replaces the old handler rather than drawing the preview twice.
+    """
+
+    namespace = bpy.app.driver_namespace
+    handle = namespace.get('gardener_preview_handle')
+    if handle is not None:
+        if namespace.get('gardener_preview_draw') is draw_preview:
+            return
+        bpy.types.SpaceView3D.draw_handler_remove(handle, 'WINDOW')
+
+    namespace['gardener_preview_handle'] = bpy.types.SpaceView3D.draw_handler_add(draw_preview, (), 'WINDOW',
+                                                                                  'POST_VIEW')
+    namespace['gardener_preview_draw'] = draw_preview
+
+
+def tag_preview_redraw():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
@@ -3,10 +3,11 @@
 
 # INSTALLATION : Add this to the top of the Branch file (around line 21)
 
-import bl_math
-from numpy import array, amax, arange, concatenate
-from numpy import delete as numpy_delete
-from .GardenerBuild import take_boundaries
+from numpy import array, concatenate, cumsum, sqrt, maximum, repeat as repeat_each
+from .GardenerMesh import node_frames, place_frond, node_lerp, unit_rows, pitch_from_tangents, branch_descriptor
+from .GardenerMesh import replaces_branch, ring_resolution, select_edgeloops, root_flare_nodes, lateral_twig_branching
+from .GardenerMesh import branch_rings, straight_skeleton, smoothed_skeleton, transported_axes, uses_subtrees
+from .GardenerMesh import TreeSkeleton, tracks_frond_tips
 
 
 # -------------------------------------------------------
@@ -18,13 +19,17 @@ from .GardenerBuild import take_boundaries
 #
 # This function is located at line at around line 1440 (depending on where you add the import
 # statement above)
+#
+# INSTALLATION : build_branch_skeleton, build_branch_fragment, sub_branch_parents, lateral_twig_nodes
+# and count_branches_mesh at the bottom of this file are new, add them to the Branch class right
+# below build_branches_mesh.
 
 
 def build_branches_mesh(self, lateral_on_apical,
                         profile_resolution, profile_resolution_reduction, twist, u_repeat, texture_aspect_ratio, scale_to_twig,
                         root_distribution, root_shape, root_scale, root_bump, base_weight,
-                        parent_previous_node, parent_node, parent_next_node, v, verts, faces, uvs, shape, layers, fronds, frond_materials, 
-                        branch_index, branch_index_parent, branch_group, curr_trunk_distance,  trunk_distance_index, hierarchy,
+                        parent_previous_node, parent_node, parent_next_node, v, verts, faces, uvs, shape, layers, fronds, frond_placements, gardener,
+                        branch_index, branch_index_parent, branch_group, curr_trunk_distance, hierarchy,
                         origin, circles,
                         lateral_twig_age_limit, dead_twig_wither, branch_angle, branching, plagiotropism_buds, add_planar, 
                         wind_force, tree_age,
@@ -52,11 +57,179 @@ def build_branches_mesh(self, lateral_on_apical,
     Option wind_shape builds without wasting time on UVs, faces and data layers.
         Just the new positions are interesting, everything else has been calculated already on a regular build.
     
+    GARDENER - Builds this branch and every branch growing from it off a stack rather than calling itself
+    for every sub branch, so deep trees can't run into the recursion limit.  Branches are built in the
+    same order and numbered the same as before.
     """
 
-    # Randomize UV's for every branch.
-    uv_offset_x = self.uv_offset_x
-    uv_offset_y = self.uv_offset_y
+    # GARDENER - Build stages are timed when profiling is on, this does nothing otherwise.
+    profiler = gardener.profiler
+
+    do_layers = not (wind_shape or spring_shape)
+    gardener_use_fronds = gardener.use_fronds
+    gardener_replace_type = gardener.replace_type
+
+    branch_cache = gardener.branch_cache
+    use_branch_cache = branch_cache is not None and do_layers
+
+    # GARDENER - Reverse Hierarchy and the subtree modes look every branch up in the subtree index of the
+    # tree's skeleton, exported here if the build didn't come with one.  The Branch to Frond layer needs
+    # to know which skeleton node every vertex was built at, and where every frond ends.  With a skeleton
+    # the smoothed length of every branch is also handed back for the replacement preview.
+    use_subtrees = gardener_use_fronds and uses_subtrees(gardener_replace_type, gardener.hierarchy_reverse)
+    track_tips = do_layers and tracks_frond_tips(gardener)
+    if gardener.skeleton is None and (use_subtrees or track_tips):
+        gardener = gardener._replace(skeleton=TreeSkeleton.from_tree(self))
+    tree_skeleton = gardener.skeleton
+    record_lengths = do_layers and tree_skeleton is not None
+
+    # GARDENER - Every branch still to build, the next one on top, as the branch, the nodes it grows from,
+    # its parent's index, its branch group, its distance to the trunk, its hierarchy and whether it starts
+    # a branch group.  Sub branches are pushed in reverse so they come off in order, each one followed by
+    # everything growing from it.  Ones too short to build are pushed without parent nodes, as they still
+    # take up a branch index.
+    branches = [(self, (parent_previous_node, parent_node, parent_next_node), branch_index_parent,
+                 branch_group, curr_trunk_distance, hierarchy, False)]
+    root_hierarchy = hierarchy
+
+    # This branch takes the index it was given, every branch after it the next one along.
+    next_branch_index = branch_index - 1
+
+    while branches:
+        branch, parents, branch_index_parent, branch_group, curr_trunk_distance, hierarchy, starts_group = branches.pop()
+        next_branch_index += 1
+        branch_index = next_branch_index
+
+        # If the branch is too short we skip it and everything growing from it.
+        if parents is None:
+            continue
+
+        # We also need to mark where the group's distances to the trunk start, every group
+        # is divided by its own highest distance in one pass once the tree is built.
+        if starts_group and do_layers:
+            layers.group_starts.append(len(layers['layer_trunk_distance']))
+
+        stage_token = profiler.start()
+
+        # GARDENER - Smoothing the nodes and finding the tangent, axis and distance along the branch of
+        # each one happens in build_branch_skeleton.  With the branch cache on the skeleton from the last
+        # build is reused, as long as this branch and the nodes it grows from haven't changed.
+        skeleton = None
+
+        if use_branch_cache:
+            skeleton_key = branch_cache.skeleton_key(branch, *parents, gardener)
+            skeleton = branch_cache.get_skeleton(skeleton_key, branch)
+
+        if skeleton is None:
+            skeleton = branch.build_branch_skeleton(*parents, gardener, vector_zero, spring_shape, wind_shape)
+            if use_branch_cache:
+                branch_cache.store_skeleton(skeleton_key, skeleton, branch)
+
+        nodes, pos, tan, axi, dir, dist = skeleton
+
+        profiler.stop('Skeleton Smoothing', stage_token)
+
+        # GARDENER - Where the branch sits in the tree's skeleton, and where its nodes start there.
+        row = None
+        skeleton_node = None
+        if tree_skeleton is not None:
+            row = tree_skeleton.rows[id(branch)]
+            if track_tips:
+                skeleton_node = int(tree_skeleton.branch_offsets[row])
+            if record_lengths:
+                layers.branch_rows.append(row)
+                layers.branch_lengths.append(float(dist[-1]))
+
+        # GARDENER - Does Grove Gardener need to intervene?  DECIDE NOW.
+        gardener_intervention = False
+        if gardener_use_fronds is True:
+            subtree_depth, subtree_length = 0, 0.0
+            if use_subtrees:
+                subtree_depth = int(tree_skeleton.subtree_depth[row])
+                subtree_length = float(tree_skeleton.subtree_lengths[row])
+
+            gardener_intervention = replaces_branch(gardener_replace_type, branch.nodes[0].thickness, hierarchy, 
+                                                    float(dist[-1]), gardener.thickness_cutoff, 
+                                                    gardener.hierarchy_cutoff, gardener.length_cutoff,
+                                                    gardener.hierarchy_reverse, subtree_depth, subtree_length)
+
+            if gardener_intervention and track_tips:
+                layers.frond_tips.append(int(tree_skeleton.branch_offsets[row + 1]) - 1)
+
+        # GARDENER - Draw the branch as a frond or as rings of vertices, along with its twigs.  If it was
+        # drawn the same way last build, the branch cache copies that in instead.
+        fragment = None
+        if use_branch_cache:
+            build_values = (lateral_on_apical, profile_resolution, profile_resolution_reduction, twist, u_repeat, 
+                            texture_aspect_ratio, root_distribution, root_shape, root_scale, root_bump, base_weight,
+                            curr_trunk_distance, tuple(origin), lateral_twig_age_limit, dead_twig_wither, branch_angle, 
+                            branching, plagiotropism_buds, add_planar, tree_age, skeleton_node)
+            fragment_key = branch_cache.fragment_key(skeleton_key, gardener_intervention, gardener, fronds, build_values)
+            fragment = branch_cache.get_fragment(fragment_key)
+
+        if fragment is not None:
+            v = branch_cache.splice(fragment, v, verts, faces, uvs, layers, frond_placements,
+                                    branch_index, branch_index_parent, branch_group)
+        else:
+            if use_branch_cache:
+                fragment_start = branch_cache.mark(v, verts, faces, uvs, layers, frond_placements)
+
+            v = branch.build_branch_fragment(nodes, pos, tan, axi, dir, dist, gardener_intervention,
+                                             lateral_on_apical, profile_resolution, profile_resolution_reduction, 
+                                             twist, u_repeat, texture_aspect_ratio, 
+                                             root_distribution, root_shape, root_scale, root_bump, base_weight,
+                                             v, verts, faces, uvs, shape, layers, fronds, frond_placements, gardener,
+                                             branch_index, branch_index_parent, branch_group, curr_trunk_distance,
+                                             origin, circles,
+                                             lateral_twig_age_limit, dead_twig_wither, branch_angle, branching, 
+                                             plagiotropism_buds, add_planar, tree_age,
+                                             spring_shape=spring_shape, wind_shape=wind_shape,
+                                             skeleton_node=skeleton_node)
+
+            if use_branch_cache:
+                branch_cache.store_fragment(fragment_key, 
+                                            branch_cache.cut(fragment_start, v, verts, faces, uvs, layers, 
+                                                             frond_placements))
+
+        # TK NOTE - Loops through to any sub-branches that may be in this node.
+
+        # If Grove Gardener has intervened here, we skip sub-branches.
+        if gardener_intervention is True:
+            next_branch_index += sum(len(node.sub_branches) for node in branch.nodes)
+            continue
+
+        # Queue sub branches.  If we're in the trunk, increment the index group.
+        sub_branches = []
+        for i, node in enumerate(branch.nodes):
+            for sub_branch in node.sub_branches:
+                if len(sub_branch.nodes) < 2:
+                    sub_branches.append((sub_branch, None, branch_index, branch_group, 0, 0, False))
+                    continue
+
+                # GARDENER - The distance tallied depends on what the previous node sent will be.
+                sub_parents = branch.sub_branch_parents(nodes, i)
+
+                if branch.is_trunk:
+                    branch_group += 1
+                    sub_branches.append((sub_branch, sub_parents, branch_index, branch_group, 0, 0, True))
+                else:
+                    sub_branches.append((sub_branch, sub_parents, branch_index, branch_group, 
+                                         curr_trunk_distance + dist[i], hierarchy + 1, False))
+
+        branches.extend(reversed(sub_branches))
+
+    return v, next_branch_index, root_hierarchy - 1
+
+
+def build_branch_skeleton(self, parent_previous_node, parent_node, parent_next_node, gardener,
+                          vector_zero=Vector((0.0, 0.0, 0.0)), spring_shape=False, wind_shape=False):
+    """
+    GARDENER - The node smoothing and skeleton half of build_branches_mesh, split off so the branch
+    cache can skip it.
+
+    Returns the smoothed nodes of the branch and the position, tangent, axis, direction and distance
+    from the start of the branch of every one of them.
+    """
 
     build_skeleton = False
 
@@ -270,12 +443,85 @@ def build_branches_mesh(self, lateral_on_apical,
     # DEBUG: Enable to skip smoothing.
     # nodes = self.nodes
 
+    # GARDENER - Positions, directions, tangents, axes and distances along the branch are worked out
+    # as arrays over all of the nodes at once, and handed to frond placement and ring meshing as they are.
+    points = array([tuple(n.pos) for n in nodes])
+
+    if spring_shape:
+        # Growth animation builds on last year's positions, without tangents.
+        pos = array([tuple(n.pos_last_year) for n in nodes])
+        dir, tan = straight_skeleton(points)
+        tan = tan * 0.0
+
+    # No smooth value or Gardener Build?  No problem.
+    elif gardener.smooth_factor == 0 or gardener.use_fronds is False:
+        pos = points
+        dir, tan = straight_skeleton(points)
+
+    # GARDENER - If we have a smoothing value, we have to do a LOT more.
+    else:
+        pos, dir, tan = smoothed_skeleton(points, gardener.smooth_factor)
+
+    tan = unit_rows(tan)
+
+    # Distance calculation
+    dist = concatenate([[0.0], cumsum(sqrt(((pos[1:] - pos[:-1]) ** 2).sum(axis=1)))])
+
+    # Axis of the first node, then carried along the branch with minimal twisting around the tangent.
+    first_axis = Vector(dir[0]).to_track_quat('X', 'Z') @ Vector((0.0, 1.0, 0.0))
+    first_axis.normalize()
+    axi, zero_segments = transported_axes(pos, tan, tuple(first_axis))
+
+    if gardener.verbose:
+        for j in zero_segments:
+            print('GARDENER - Zero length segment at node ' + str(j) + ' out of ' + str(len(nodes)))
+
+    # Smooth out extreme thicknesses steps for a nice taper.
+    # WATCH OUT: This messes up wind animation! Repeated building adds thickness!
+    # It strengthens branches and lessens bending over time, causing the loop to stutter.
+    if not wind_shape:
+        for o in range(len(nodes)):
+            if o < 5 or o == len(nodes) - 1:
+                continue
+            median_radius = (nodes[o - 1].radius + nodes[o + 1].radius) / 2
+            if nodes[o].radius < median_radius:
+                nodes[o].radius = median_radius * 1
+
+    return nodes, pos, tan, axi, dir, dist
+
+
+def build_branch_fragment(self, nodes, pos, tan, axi, dir, dist, gardener_intervention,
+                          lateral_on_apical, profile_resolution, profile_resolution_reduction, 
+                          twist, u_repeat, texture_aspect_ratio, 
+                          root_distribution, root_shape, root_scale, root_bump, base_weight,
+                          v, verts, faces, uvs, shape, layers, fronds, frond_placements, gardener,
+                          branch_index, branch_index_parent, branch_group, curr_trunk_distance,
+                          origin, circles,
+                          lateral_twig_age_limit, dead_twig_wither, branch_angle, branching, 
+                          plagiotropism_buds, add_planar, tree_age,
+                          vector_zero=Vector((0.0, 0.0, 0.0)),
+                          vector_z=Vector((0.0, 0.0, 1.0)),
+                          twopi=6.2832, spring_shape=False, wind_shape=False, skeleton_node=None):
+    """
+    GARDENER - The drawing half of build_branches_mesh, split off so the branch cache can record
+    everything a branch adds to the mesh.  Draws the branch from its skeleton either as a frond or
+    as rings of vertices, then adds its twigs.
+
+    skeleton_node is the index of the branch's first node in the TreeSkeleton, given when the build
+    records which node every vertex was built at for the Branch to Frond layer.
+
+    Returns the new vertex count.
+    """
+
+    profiler = gardener.profiler
+
+    # Randomize UV's for every branch.
+    uv_offset_x = self.uv_offset_x
+    uv_offset_y = self.uv_offset_y
 
     # TK NOTE - Okay the smoothing has ended, this is where more important stuff happens.
 
     number_of_nodes = len(nodes)
-    circle = []
-    previous_y = uv_offset_y
     current_y = uv_offset_y
 
     verts_append = verts.append
@@ -287,27 +533,28 @@ def build_branches_mesh(self, lateral_on_apical,
     do_layers = not (wind_shape or spring_shape)
     
     if do_layers:
-        layers_shade_extend = layers['layer_shade'].extend
-        layers_thickness_extend = layers['layer_thickness'].extend
-        layers_age_extend = layers['layer_age'].extend
-        layers_weight_extend = layers['layer_weight'].extend
-        layers_power_extend = layers['layer_power'].extend
-        layers_health_extend = layers['layer_health'].extend
-        layers_dead_extend = layers['layer_dead'].extend
-        layers_pitch_extend = layers['layer_pitch'].extend
-        layers_apical_extend = layers['layer_apical'].extend
-        layers_upward_extend = layers['layer_upward'].extend
-        layers_dead_twig_extend = layers['layer_dead_twig'].extend  
-        layers_lateral_extend = layers['layer_lateral'].extend
-        layers_branch_index_extend = layers['layer_branch_index'].extend
-        layers_branch_index_parent_extend = layers['layer_branch_index_parent'].extend
+        layers_shade = layers['layer_shade']
+        layers_thickness = layers['layer_thickness']
+        layers_age = layers['layer_age']
+        layers_weight = layers['layer_weight']
+        layers_power = layers['layer_power']
+        layers_health = layers['layer_health']
+        layers_dead = layers['layer_dead']
+        layers_pitch = layers['layer_pitch']
+        layers_apical = layers['layer_apical']
+        layers_upward = layers['layer_upward']
+        layers_dead_twig = layers['layer_dead_twig']  
+        layers_lateral = layers['layer_lateral']
+        layers_branch_index = layers['layer_branch_index']
+        layers_branch_index_parent = layers['layer_branch_index_parent']
         
         # GARDENER - Gardener-specific data layers
-        layers_frond_extend = layers['layer_frond'].extend
-        layer_height_extend = layers['layer_height'].extend
-        layer_trunk_distance_extend = layers['layer_trunk_distance'].extend
-        layer_branch_distance_extend = layers['layer_branch_distance'].extend
-        layer_branch_group_extend = layers['layer_branch_group'].extend
+        layers_frond = layers['layer_frond']
+        layer_height = layers['layer_height']
+        layer_trunk_distance = layers['layer_trunk_distance']
+        layer_branch_distance = layers['layer_branch_distance']
+        layer_branch_group = layers['layer_branch_group']
+        layer_branch_node = layers['layer_branch_node']
 
         # Prevent division by zero when creating vertex groups.
         if base_weight == 0.0:
@@ -323,247 +570,17 @@ def build_branches_mesh(self, lateral_on_apical,
     
     # TK NOTE - USEFUL DATA FOR ALL NODES IN THE CURRENT BRANCH CALCULATED HERE!
 
-    # GARDENER - Set some values for easy access.
-    gardener_reduce_el = bpy.context.scene.gardener_reduce_edgeloops
-    gardener_reduce_el_value = bpy.context.scene.gardener_edgeloop_reduce_factor
-    gardener_use_fronds = bpy.context.scene.gardener_use_fronds
-    gardener_replace_type = bpy.context.scene.gardener_frond_replace_type
-
-    
-    # Calculate tangent and axis for each node.
-    pos = []  # pos
-    tan = []  # tangent
-    axi = []  # axis
-    dir = []  # direction (like tangent, but has length)
-    dist = [0.0] # distances (calculated using direction)
-
-    # this is slightly modified to remove references to variables not
-    # currently applicable.
-
-    last_node_index = len(nodes) - 1
-    last_direction = nodes[1].pos - nodes[0].pos
-    cur_twist = 0.0
-
-    # Defines what range of nodes the smoothing process uses.
-    # 3 seems to work so far, this solution requires more effort though
-    smooth_range = 3
-    if smooth_range > len(nodes):
-        smooth_range = len(nodes)
+    # GARDENER - Set some values for easy access.  These come from the settings snapshot
+    # made once per build in OperatorBuild rather than the scene.
+    gardener_use_fronds = gardener.use_fronds
+    gardener_replace_type = gardener.replace_type
 
-    # This defines how much corners are smoothed, proportional to the
-    # sharpness of each node
-    smooth_value = bpy.context.scene.gardener_smooth_factor
-    
-    for j, n in enumerate(nodes):
-        
-        tangent = Vector()
-        direction = Vector()
-
-        if spring_shape:
-            pos.append(n.pos_last_year)
-
-            if j == last_node_index:
-                direction = last_direction
-            else:
-                direction = nodes[j + 1].pos - n.pos
-        
-        # No smooth value or Gardener Build?  No problem.
-        elif smooth_value == 0 or gardener_use_fronds is False:
-            pos.append(n.pos)
-
-            if j == last_node_index:
-                direction = last_direction
-            else:
-                direction = nodes[j + 1].pos - n.pos
-
-            if j == 0:
-                tangent = direction
-            else:
-                tangent = (direction + last_direction) / 2.0
-        
-        # GARDENER - If we have a smoothing value, we have to do a LOT more.
-        else:
-
-            if j >= last_node_index - smooth_range:
-                smooth_range -= 1
-
-            # First and last positions require little change.
-            if j == 0:
-                pos.append(n.pos)
-            
-            # If we're at the last index we need nothing more than 
-            # the last tangent
-            elif j == last_node_index:
-                direction = last_direction
-                tangent = direction
-            
-            # If we're at the penultimate index, we can't use trigonometry
-            # and just have to set the last position
-            elif j == last_node_index - 1:
-                pos.append(nodes[j + 1].pos)
-                direction = nodes[j + 1].pos - pos[j]
-                tangent = direction
-            
-            # Otherwise we need both the current tangent and the next position
-            # derived from it.
-            #
-            # This finds a rotated version of a direction that points towards
-            # the position afterwards, using trigonometry to keep the lengths
-            # proportional.
-            #
-            if j < last_node_index - 1:
-                current_direction = nodes[j + 1].pos - pos[j]
-                next_direction = nodes[j + smooth_range].pos - nodes[j + 1].pos
-                
-                unit_0 = current_direction.normalized()
-                unit_1 = next_direction.normalized()
-                dot = unit_0.dot(unit_1)
-                sharpness = ((dot * -1) + 1) / 2
-                lerp = min((sharpness * smooth_value), 1)
-
-                # Once we have our lerp value, we need a projection axis
-                # with which we can collapse this into two dimensions.
-                p_0 = pos[j]
-                p_1 = nodes[j + 1].pos
-                p_2 = nodes[j + smooth_range].pos
-                v_0 = p_1 - p_0
-                v_1 = p_2 - p_0
-                z_axis = v_0.cross(v_1)
-                y_axis = v_0.cross(z_axis)
-                
-                trig_mat = Matrix()
-                trig_mat[0][0:3] = v_0.normalized()
-                trig_mat[1][0:3] = y_axis.normalized()
-                trig_mat[2][0:3] = z_axis.normalized()
-                
-                # Transform the vectors we need for trigonometry
-                v_A = (v_0 @ trig_mat).xy
-                v_B = (v_1 @ trig_mat).xy
-                
-                # Get the angle between, and then solve for v_B's true length.
-                angle = v_A.angle(v_B, 0)
-                
-                # If the angle is 0, we failed, revert to normal behaviours.
-                if angle == 0:
-                    direction = p_1 - p_0
-                    tangent = direction
-                    pos.append(pos[j] + direction)
-
-                # If the angle isn't 0, turn v_1 into a unit vector and multiply by the length,
-                # we're finally done!
-                else:
-                    len_B = v_A.length * cos(angle)
-                    d_unit = v_1.normalized()
-                    max_direction = Vector((d_unit.x * len_B, d_unit.y * len_B, d_unit.z * len_B))
-                    direction = current_direction.lerp(max_direction, lerp)
-                    tangent = direction
-                    pos.append(pos[j] + direction)
-
-
-        
-        tangent.normalize()
-        tan.append(tangent)
-        dir.append(direction)
-        last_direction = direction
-
-        # GARDENER - This didn't work T _ T
-        # if j != 0:
-        #     dist.append(dist[-1] + direction.length)
-    
-    # Distance calculation
-    i = 0
-    d = 0.0
-    while i < (len(nodes) - 1):
-            p_diff = pos[i + 1] - pos[i]
-            d += p_diff.length
-            dist.append(d)
-            i += 1
-
-    # Axis calculations
-    for j, n in enumerate(nodes):
-        
-        direction = dir[j]
-        # axis.
-        if j == 0:
-            axis = direction.to_track_quat('X', 'Z') @ Vector((0.0, 1.0, 0.0))
-            axis.normalize()
-        else:
-            axis = last_direction.cross(direction).normalized()
-            if axis.length == 0.0:
-                axis = Vector((0.0, 1.0, 0.0))
-        axi.append(axis)
-
-        last_direction = direction * 1.0
-    
-    # Minimize twisting around the tangent.
-    for j, n in enumerate(nodes):
-        if j == 0:
-            continue
-
-        # Reflect previous nodes's tangent and axis of rotation onto the current point.
-        # through the plane at the point in the middle.
-        v1 = pos[j] - pos[j - 1]
-        c1 = v1.dot(v1)
-
-        if v1.length == 0.0:
-            print(str(j) + ' out of ' + str(len(nodes)))
-            print('zerooooooooo')
-        
-        axi_flipped = axi[j - 1] - (2 / c1) * v1.dot(axi[j - 1]) * v1
-        tan_flipped = tan[j - 1] - (2 / c1) * v1.dot(tan[j - 1]) * v1
-
-        # Second reflection over a plane at the current point,
-        # to align the frame tangent with the curve tangent again.
-        v2 = tan[j] - tan_flipped
-        c2 = v2.dot(v2)
-
-        axi[j] = axi_flipped - v2 * (2 / c2 * v2.dot(axi_flipped))
-
-    # Smooth out extreme thicknesses steps for a nice taper.
-    # WATCH OUT: This messes up wind animation! Repeated building adds thickness!
-    # It strengthens branches and lessens bending over time, causing the loop to stutter.
-    if not wind_shape:
-        for o in range(len(nodes)):
-            if o < 5 or o == len(nodes) - 1:
-                continue
-            median_radius = (nodes[o - 1].radius + nodes[o + 1].radius) / 2
-            if nodes[o].radius < median_radius:
-                nodes[o].radius = median_radius * 1
-
-
-    # ////////////////////////////////////////////////////////////////////////
-    # -----------------------------------------------------------------------
-    # ////////////////////////////////////////////////////////////////////////
-
-    # GARDENER - Does Grove Gardener need to intervene?  DECIDE NOW.
-    thickness_cutoff = bpy.context.scene.gardener_thickness_cutoff
-    hierarchy_cutoff = bpy.context.scene.gardener_hierarchy_cutoff
-    length_cutoff = (bpy.context.scene.gardener_length_cutoff / scale_to_twig)
-    gardener_intervention = False
-
-    if gardener_use_fronds is True:
-        if gardener_replace_type == 'Thickness': 
-            if self.nodes[0].thickness < thickness_cutoff:
-                gardener_intervention = True
-        elif gardener_replace_type == 'Hierarchy':
-            if hierarchy >= hierarchy_cutoff:
-                gardener_intervention = True
-        elif gardener_replace_type == 'Length':
-            if dist[-1] < length_cutoff:
-                gardener_intervention = True
-        elif gardener_replace_type == 'HierarchyThickness':
-                if hierarchy >= hierarchy_cutoff:
-                    if self.nodes[0].thickness < thickness_cutoff:
-                        gardener_intervention = True
-        elif gardener_replace_type == 'HierarchyLength':
-                if hierarchy >= hierarchy_cutoff:
-                    if dist[-1] < length_cutoff:
-                        gardener_intervention = True
+    # The twig code below uses the direction left over from the skeleton loops.
+    direction = Vector(dir[-1])
 
     # GARDENER - If it intervenes, its time to perform the "real" drawing code.
-    gardener_loop_inc = (1 - gardener_reduce_el_value) / 10
-    gardener_cur_reduc_val = gardener_reduce_el_value
     disable_twigs = gardener_intervention
+    stage_token = profiler.start()
     
     if gardener_intervention is True:
         
@@ -573,201 +590,126 @@ def build_branches_mesh(self, lateral_on_apical,
         radius = nodes[0].radius
         branch_length = dist[-1]            
         # Build transform points
-        i = 0
-        node_tf_points = []
-        while i < (len(nodes)):
-            pos_i = pos[i]
-            tan_i = tan[i]
-            axi_i = axi[i]
-            
-            # NOTE - The tangents used are not a full direction towards the next node,
-            # keep that in mind when making transformations
-            mat_i = Matrix()
-            mat_i[0][0:3] = tan_i
-            mat_i[1][0:3] = axi_i
-            mat_i[2][0:3] = tan_i.cross(axi_i)
-
-            node_tf_points.append(mat_i)
-
-            i += 1
+        # NOTE - The tangents used are not a full direction towards the next node,
+        # keep that in mind when making transformations
+        node_tf_points = node_frames(tan, axi)
         
-        # Pick the right frond mesh
-        frond_target = None
-        target_diff = 0.0
-        for j, frond in enumerate(fronds[0]):
-            
-            diff = abs(branch_length - frond[4].x)
-            if j == 0 or diff < target_diff:
-                frond_target = frond
-                target_diff = diff
+        # Pick the right frond mesh, the library keeps a sorted index of frond sizes for this.
+        match_weight = gardener.frond_match_weight
+        branch_width, branch_tip_spread = 0.0, 0.0
+        if match_weight > 0.0:
+            branch_width, branch_tip_spread = branch_descriptor(pos, radius)
 
-        # Create a matrix for stretching the target mesh, 
+        frond_id = fronds[2].lookup(branch_length, branch_width, branch_tip_spread, match_weight)
+        frond_target = fronds[0][frond_id]
+
+        # Create a scale for stretching the target mesh, 
         # used to better fit the length of the branch.
-        stretch_x = bpy.context.scene.gardener_stretch_factor_x
-        stretch_yz = bpy.context.scene.gardener_stretch_factor_yz
-        mat_stretch = Matrix()
+        stretch_x = gardener.stretch_x
+        stretch_yz = gardener.stretch_yz
+        stretch = [1.0, 1.0, 1.0]
 
         if stretch_x > 0:
-            factor_x = ( ( (branch_length / frond_target[4].x) - 1) * stretch_x) + 1
-            axis_x = Vector((factor_x, 0, 0))
-            axis_y = Vector((0, 1, 0))
-            axis_z = Vector((0, 0, 1))
+            stretch[0] = ( ( (branch_length / frond_target.bounds[0]) - 1) * stretch_x) + 1
 
             if stretch_yz > 0:
-                factor_y = ( ( (branch_length / frond_target[4].x) - 1) * stretch_yz) + 1
-                factor_z = ( ( (branch_length / frond_target[4].x) - 1) * stretch_yz) + 1
-                axis_y = Vector((0, factor_y, 0))
-                axis_z = Vector((0, 0, factor_z))
-            
-            mat_stretch[0][0:3] = axis_x
-            mat_stretch[1][0:3] = axis_y
-            mat_stretch[2][0:3] = axis_z
-
-
-        for co in frond_target[0]:
-            co_tr = co.copy()
+                stretch[1] = ( ( (branch_length / frond_target.bounds[0]) - 1) * stretch_yz) + 1
+                stretch[2] = ( ( (branch_length / frond_target.bounds[0]) - 1) * stretch_yz) + 1
 
-            if stretch_x > 0:
-                co_tr = co_tr @ mat_stretch
+        # GARDENER - Instanced fronds stay out of the mesh, only the frond, the frame of the first node and
+        # the stretch are recorded for GardenerBuild.build_frond_instances.
+        if gardener.frond_output == 'Instances':
+            frond_placements.add_instance(frond_id, pos[0] - array(origin), node_tf_points[0], stretch)
 
-            border_dist = take_boundaries(dist, co.x)
-            i_0 = dist.index(border_dist[0])
-            i_1 = dist.index(border_dist[1])
-            co_tr.x = co_tr.x - border_dist[0]
-
-            # Used to interpolate layer data between the previous and next node.
-            lerp_range = (border_dist[1] - border_dist[0])
-            lerp_val = (co.x - border_dist[0]) / lerp_range
-            lerp_val = max(0, min(1, lerp_val))
-            
-            
-            # Get the initial transform of the point we start from,
-            # as well as two tangents used to smooth the rotation of 
-            # our points.
-            
-            mat_0 = node_tf_points[i_0]
-            tan_origin = tan[i_0]
-            tan_0 = ((tan[i_0])).normalized()
-            tan_1 = ((tan[i_1])).normalized()
-            
-
-            # This ended up causing distortion, will patch in later once fixed
-            # if i_1 < len(tan) - 1:
-            #     tan_1 = ((tan[i_0] + tan[i_1])).normalized()
-            # if i_0 > 0:
-            #     tan_0 = ((tan[i_0] + tan[i_0 - 1])).normalized()
-            # tan_lerp = tan_0.lerp(tan_1, lerp_val)
-            
-            # rotation_mat = rotate_align(tan_origin, tan_lerp)
-            
-            # co_tr_xb = co_tr.x
-            # co_tr.x = 0
-            # co_tr =  rotation_mat @ co_tr
-            # co_tr.x += co_tr_xb
-            
-            co_tr = co_tr @ mat_0
-            co_tr = (co_tr + pos[i_0]) - origin
-            verts_append(co_tr.copy())
+        else:
+            # GARDENER - Every frond vertex is placed in one batch, the old per-vertex loop
+            # (take_boundaries, Matrix multiply, bl_math.lerp) was most of the build time.
+            frond_co = frond_target.coords
+            placed, i_0, i_1, lerp_val, lerp_range = place_frond(frond_co, stretch, dist, node_tf_points, pos, origin)
+            verts_extend(placed)
 
             if do_layers:
-                number = 1
-                n_0 = nodes[i_0]
-                n_1 = nodes[i_1]
-                v_thickness = bl_math.lerp(n_0.thickness, n_1.thickness, lerp_val)
-                v_age = bl_math.lerp(n_0.age, n_1.age, lerp_val)
-                v_weight = bl_math.lerp(n_0.weight, n_1.weight, lerp_val)
-                v_photosys = bl_math.lerp(n_0.photosynthesis, n_1.photosynthesis, lerp_val)
-                v_height = bl_math.lerp(n_0.pos.z, n_1.pos.z, lerp_val)
-                pitch_tan = tan_0.lerp(tan_1, lerp_val)
-                pitch = 1.0 - (vector_z.angle(pitch_tan, 0.0) / pi)
-                length_fract = co.x / frond_target[4].x
+                number = len(placed)
+                v_thickness = node_lerp([n.thickness for n in nodes], i_0, i_1, lerp_val)
+                v_age = node_lerp([n.age for n in nodes], i_0, i_1, lerp_val)
+                v_weight = node_lerp([n.weight for n in nodes], i_0, i_1, lerp_val)
+                v_photosys = node_lerp([n.photosynthesis for n in nodes], i_0, i_1, lerp_val)
+                v_height = node_lerp([n.pos.z for n in nodes], i_0, i_1, lerp_val)
+                tan_units = unit_rows(tan)
+                pitch_tan = tan_units[i_0] + (tan_units[i_1] - tan_units[i_0]) * lerp_val[:, None]
+                pitch = pitch_from_tangents(pitch_tan)
+                length_fract = frond_co[:, 0] / frond_target.bounds[0]
                 dist_to_trunk = curr_trunk_distance + dist[i_0] + (lerp_range * lerp_val)
 
-                layers_shade_extend([self.shade] * number)
-                layers_thickness_extend([v_thickness] * number)
-                layers_age_extend([v_age / tree_age] * number)
-                layers_weight_extend([v_weight / base_weight] * number)
-                layers_power_extend([self.power] * number)
-                layers_health_extend([pow(v_photosys, 0.2)] * number)
+                layers_shade.fill(self.shade, number)
+                layers_thickness.extend(v_thickness)
+                layers_age.extend(v_age / tree_age)
+                layers_weight.extend(v_weight / base_weight)
+                layers_power.fill(self.power, number)
+                layers_health.extend(v_photosys ** 0.2)
                 if self.dead:
-                    layers_dead_extend([1.0] * number)
+                    layers_dead.fill(1.0, number)
                 else:
-                    layers_dead_extend([0.0] * number)
-                layers_pitch_extend([pitch] * number)
-                layers_apical_extend([0.0] * number)
-                layers_upward_extend([0.0] * number)
-                layers_dead_twig_extend([0.0] * number)
-                layers_lateral_extend([0.0] * number)
-                layers_branch_index_extend([branch_index] * number)
-                layers_branch_index_parent_extend([branch_index_parent] * number)
+                    layers_dead.fill(0.0, number)
+                layers_pitch.extend(pitch)
+                layers_apical.fill(0.0, number)
+                layers_upward.fill(0.0, number)
+                layers_dead_twig.fill(0.0, number)
+                layers_lateral.fill(0.0, number)
+                layers_branch_index.fill(branch_index, number)
+                layers_branch_index_parent.fill(branch_index_parent, number)
 
                 # GARDENER - Extra layers
-                layers_frond_extend([1.0] * number)
-                layer_height_extend([v_height] * number)
+                layers_frond.fill(1.0, number)
+                layer_height.extend(v_height)
                 if self.is_trunk:
-                    layer_trunk_distance_extend([0] * number)
+                    layer_trunk_distance.fill(0, number)
                 else:
-                    layer_trunk_distance_extend([dist_to_trunk] * number)
-                layer_branch_distance_extend([length_fract] * number)
-                layer_branch_group_extend([branch_group] * number)
+                    layer_trunk_distance.extend(dist_to_trunk)
+                layer_branch_distance.extend(length_fract)
+                layer_branch_group.fill(branch_group, number)
+                if skeleton_node is not None:
+                    layer_branch_node.fill(skeleton_node, number)
 
 
-        for face in frond_target[1]:
-            new_face = []
-            for i in face:
-                new_face.append(i + v)
-            faces_append(new_face)
+            # Frond materials are only recorded as the face the frond starts at and which frond it is,
+            # OperatorBuild expands them into material indices in one go.
+            frond_placements.add(len(faces), frond_id)
 
-        for uv in frond_target[2]:
-            uvs_extend(uv)
+            faces.extend_flat(frond_target.loops + v, frond_target.loop_totals)
+            uvs_extend(frond_target.uvs)
 
-        # Copies the same system for data layers as simulation_items to keep things uniform.
-        # ...just in a clunkier way Q _ Q
-        i = 0
-        
-        for mat_id in frond_target[3]:
-            for id_list in frond_materials.values():
-                if i == mat_id:
-                    id_list.append(1.0)
-                else:
-                    id_list.append(0.0)
-                i += 1
-            i = 0
-        
-        # Populate data layers
-        v += len(frond_target[0])
+            # Populate data layers
+            v += len(frond_target.coords)
         
 
     # GARDENER - Standard branch build code.
     # Draw current node's profile and connect it to the previous profile with faces.
     else:
 
-        for j, n in enumerate(nodes):
-            aspect = texture_aspect_ratio * repeat
-
-            # GARDENER - First attempt at reducing loop count by skipping out of nodes early.
-            # TODO: This break wind and recording and it isnt really elegant.
-            if gardener_reduce_el == True:
+        # GARDENER - Loops that don't add to the shape of the branch are skipped when reducing edge loops.
+        # The root flare of the trunk is never reduced in Tolerance mode as it's shaped further down.
+        # TODO: This break wind and recording and it isnt really elegant.
+        kept_loops = select_edgeloops(nodes, tan, gardener, root_flare_nodes(self.is_trunk, root_distribution, 
+                                                                             number_of_nodes))
+
+        # GARDENER - Work out where every ring goes first, then build all of their vertices, faces and UVs
+        # in one batch with branch_rings, the old per-vertex Quaternion loop was most of the ring time.
+        aspect = texture_aspect_ratio * repeat
+        amount = 0.0
+        ring_nodes = []
+        ring_centers = []
+        ring_radii = []
+        ring_flare = []
+        ring_resolutions = []
+        ring_twists = []
+        ring_y = []
 
-                if j > 1 and j != (len(nodes) - 1):
-                    
-                    dot = last_loop_tan.dot(tan[j]) / (last_loop_tan.length * tan[j].length)
-                    
-                    if dot > gardener_cur_reduc_val:
-                        if len(n.sub_branches) == 0:
-                            # Everytime we skip a loop, the threshold gets higher
-                            gardener_cur_reduc_val += gardener_loop_inc
-                            radius = n.radius
-                            circumference = 2 * pi * n.radius
-                            current_y += aspect / circumference * abs((n.pos - nodes[j - 1].pos).length)
-                            continue        
-                    else:
-                        last_loop_tan = tan[j]
-                        gardener_cur_reduc_val = gardener_reduce_el_value
-                
-                else:
-                    last_loop_tan = tan[j]
-            
+        for j, n in enumerate(nodes):
+            if kept_loops is not None and not kept_loops[j]:
+                circumference = 2 * pi * n.radius
+                current_y += aspect / circumference * abs((n.pos - nodes[j - 1].pos).length)
+                continue
 
             if spring_shape: 
                 pos_offset = n.pos_last_year - origin
@@ -782,10 +724,8 @@ def build_branches_mesh(self, lateral_on_apical,
                 circumference = 2 * pi * n.radius
                 if j != 0:
                     current_y += aspect / circumference * abs((n.pos - nodes[j - 1].pos).length)
-            
-            print("*"*50)
 
-            # Scale root of the trunk.
+            # Scale root of the trunk.  The bumps carry on past the flare with the last amount.
             if self.is_trunk:
                 root_scale_reach = root_distribution * number_of_nodes
                 if j < root_scale_reach:
@@ -795,219 +735,105 @@ def build_branches_mesh(self, lateral_on_apical,
                     radius += radius * multiplier
 
                     amount = multiplier * 0.2 * root_bump * radius
-            
-            pitch = 1.0 - (vector_z.angle(tan[j], 0.0) / pi)  # Used for pitch data layer.
 
             if j > 0:
                 cur_twist += twist
 
-            # Reduce profile resolution on thinner branches, imited to one vertex per node. Minimum of 3 vertices.
-            cur_res = profile_resolution * n.thickness
-            if j == 0:
-                # Start with the original first node's thickness, without the nodes added for smoothing.
-                # Without this the different smoothing methods will mess up building with wind.
-                cur_res = profile_resolution * self.nodes[0].thickness
-            cur_res = profile_resolution_reduction * cur_res + (1.0 - profile_resolution_reduction) * profile_resolution
-            cur_res = int(cur_res)
-            if cur_res < 3:
-                cur_res = 3
-            # The first node has no previous resolution, set it equal to the current resolution.
+            # Reduce profile resolution on thinner branches.  The first ring starts with the original first
+            # node's thickness, without the nodes added for smoothing, as the different smoothing methods will
+            # mess up building with wind otherwise.
             if j == 0:
+                cur_res = ring_resolution(profile_resolution, profile_resolution_reduction, self.nodes[0].thickness)
                 prev_res = cur_res
-            elif cur_res < prev_res - 1:
-                cur_res = prev_res - 1
-            elif cur_res == 3 and prev_res == 4:
-                # When the resolution steps down from 4 to 3, the tesselation of the first quad produces ugly triangles.
-                # Very visible with high polygon reduction. Fix this by slightly twisting back.
-                cur_twist += 0.5
-            elif cur_res > prev_res:
-                # This can happen because we're starting with the original first node's thickness and not the smoothed nodes.
-                # Then for the following nodes, I take the smoothed node's thickness which is thicker.
-                cur_res = prev_res
-            
-            if cur_res > profile_resolution:
-                cur_res = profile_resolution * 1
-            
-            # Use pre-calculated circles for a speed-up.
-            circle = circles[cur_res]
-
-            # GARDENER - Variable to keep faces indexed.
-            face_number = 0
-
-            if build_skeleton:
-                cur_res = 1
-
-            for i in range(cur_res):
-                a = (i - 1) / cur_res * repeat + uv_offset_x
-                b = i / cur_res * repeat + uv_offset_x
-                c = (1 / prev_res) * repeat
-
-                # Root shape.
-                if self.is_trunk:
-                    curradius = radius + amount * (1.0 + 0.5 * sin(i * 6 / cur_res * twopi))
-                    curradius += amount * (1.0 + 0.5 * cos(i * 9 / cur_res * twopi)) * 0.5
-                else:
-                    curradius = radius
-
-                if build_skeleton:
-                    curradius = 0.0
-
-                # Rotate the normal of the node along the tangent to draw the circle points.
-                co = Quaternion(tan[j], (i / cur_res) * twopi + cur_twist) @ (axi[j] * curradius) + pos_offset
-
-                if wind_shape or spring_shape:
-                    shape_extend(co)
-                if not wind_shape:
-                    verts_append(co)
-                    v += 1
-
-                    # Create faces between vertices.
-                    if j > 0 and i > 0:
-                        offset = v - 1
-                        faces_append((offset - 1 - cur_res,
-                                    offset - cur_res,
-                                    offset,
-                                    offset - 1))
-                        face_number += 1
-
-                        if prev_res == cur_res:
-                            uvs_extend([(a, previous_y),
-                                        (b, previous_y),
-                                        (b, current_y),
-                                        (a, current_y)])
-
-                        elif prev_res == cur_res + 1:
-                            uvs_extend([((i - 1) / prev_res * repeat + uv_offset_x + ((1 / prev_res) * repeat), previous_y),
-                                        (i / prev_res * repeat + uv_offset_x + ((1 / prev_res) * repeat), previous_y),
-                                        (i / cur_res * repeat + uv_offset_x, current_y),
-                                        ((i - 1) / cur_res * repeat + uv_offset_x, current_y)])
-
-            if j > 0 and not wind_shape:
-                # Close the loop by creating the last face between the last vertices
-                # and the first vertices in this loop.
-
-                move_back_x = repeat  # Shift the triangle and slanted rectangle to the left to fix the jagged border of UV maps.
-
-                offset = v - 1 - i
-
-                a = i / cur_res * repeat + uv_offset_x
-                b = repeat + uv_offset_x
-                c = (1 / prev_res) * repeat
-
-                if prev_res == cur_res and cur_res != 2:  # LOD
-                    faces_append((offset - 1,
-                                offset - cur_res,
-                                offset,
-                                offset + cur_res - 1))
-                    face_number += 1
-
-                    uvs_extend([(a - move_back_x, previous_y),
-                                (b - move_back_x, previous_y),
-                                (b - move_back_x, current_y),
-                                (a - move_back_x, current_y)])
-
-                # Step down resolution. Fill the gap with a triangle.
-                elif prev_res == cur_res + 1:
-                    prev_a = (i + 1) / prev_res * repeat + uv_offset_x
-
-                    faces_append((offset - cur_res - 1,
-                                offset - cur_res,
-                                offset,
-                                offset + cur_res - 1))
-                    face_number += 1
-
-                    uvs_extend([(prev_a + c - move_back_x, previous_y),
-                                (b + c - move_back_x, previous_y),
-                                (b - move_back_x, current_y),
-                                (a - move_back_x, current_y)])
-
-                    faces_append((offset - 1,
-                                offset - cur_res - 1,
-                                offset + cur_res - 1))
-                    face_number += 1
-
-                    uvs_extend([(prev_a - move_back_x, previous_y),
-                                (b - move_back_x, previous_y),
-                                (a - move_back_x, current_y)])
-
-            if j == last_node_index:
-                if cur_res == 2 and i == 1: # LOD, allow 2 resolution.
-                    pass
-                else:
-                    # Cap the tip.
-                    if wind_shape or spring_shape:
-                        shape_extend(pos_offset)
-                    if not wind_shape:
-                        verts_append(pos_offset)
-                        v += 1
-
-                        for i in range(cur_res):
-                            if i == cur_res - 1:
-                                faces_append((v - 2,
-                                            v - 2 - i,
-                                            v - 1))
-                                face_number += 1
-
-                                uvs_extend([(0.5 * circle[0].x + 0.5, 0.5 * circle[0].y + 0.5),
-                                            (0.5 * circle[i].x + 0.5, 0.5 * circle[i].y + 0.5),
-                                            (0.5, 0.5)])
-                            else:
-                                faces_append((v - 3 - i,
-                                            v - 2 - i,
-                                            v - 1))
-                                face_number += 1
-
-                                uvs_extend([(0.5 * circle[i + 1].x + 0.5, 0.5 * circle[i + 1].y + 0.5),
-                                            (0.5 * circle[i].x + 0.5, 0.5 * circle[i].y + 0.5),
-                                            (0.5, 0.5)])
-            
-            # GARDENER - Moved numbers here as Gardener needs these!
-            if j == last_node_index:
-                number = cur_res + 1
             else:
-                number = cur_res
+                cur_res = ring_resolution(profile_resolution, profile_resolution_reduction, n.thickness, prev_res)
+                if cur_res == 3 and prev_res == 4:
+                    # When the resolution steps down from 4 to 3, the tesselation of the first quad produces ugly triangles.
+                    # Very visible with high polygon reduction. Fix this by slightly twisting back.
+                    cur_twist += 0.5
+
+            ring_nodes.append(j)
+            ring_centers.append(tuple(pos_offset))
+            ring_radii.append(radius)
+            ring_flare.append(amount)
+            ring_resolutions.append(cur_res)
+            ring_twists.append(cur_twist)
+            ring_y.append(current_y)
+            prev_res = cur_res
 
-            if cur_res == 2:
-                number = cur_res  # LOD
+        # The cap uses the pre-calculated circle for its UVs, a resolution of 2 leaves the tip open.  # LOD
+        cap_circle = None
+        if cur_res != 2:
+            cap_circle = [(p.x, p.y) for p in circles[cur_res]]
 
-            if do_layers:
-                layers_shade_extend([self.shade] * number)
-                layers_thickness_extend([n.thickness] * number)
-                layers_age_extend([n.age / tree_age] * number)
-                layers_weight_extend([n.weight / base_weight] * number)
-                layers_power_extend([self.power] * number)
-                layers_health_extend([pow(n.photosynthesis, 0.2)] * number)
-                if self.dead:
-                    layers_dead_extend([1.0] * number)
-                else:
-                    layers_dead_extend([0.0] * number)
-                layers_pitch_extend([pitch] * number)
-                layers_apical_extend([0.0] * number)
-                layers_upward_extend([0.0] * number)
-                layers_dead_twig_extend([0.0] * number)
-                layers_lateral_extend([0.0] * number)
-                layers_branch_index_extend([branch_index] * number)
-                layers_branch_index_parent_extend([branch_index_parent] * number)
-
-                # GARDENER - Additional layers
-                layers_frond_extend([0.0] * number)
-                layer_height_extend([n.pos.z] * number)
-                if self.is_trunk:
-                    layer_trunk_distance_extend([0.0] * number)
-                else:
-                    layer_trunk_distance_extend([curr_trunk_distance + dist[j]] * number)
-                layer_branch_distance_extend([0.0] * number)
-                layer_branch_group_extend([branch_group] * number)
-            
-            # Material indexes for frond meshes are counted differently.
-            if gardener_use_fronds:
-                for id_list in frond_materials.values():
-                    id_list.extend([0.0] * face_number)
+        coords, ring_loops, ring_totals, ring_uvs = branch_rings(
+            ring_centers, tan[ring_nodes], axi[ring_nodes], ring_radii,
+            ring_flare if self.is_trunk else None, ring_resolutions, ring_twists, ring_y, repeat, uv_offset_x, 
+            cap_circle, v, twopi)
 
-            previous_y = current_y
-            prev_res = cur_res
+        if wind_shape or spring_shape:
+            shape_extend(coords.reshape(-1).tolist())
+        if not wind_shape:
+            verts_extend(coords)
+            faces.extend_flat(ring_loops, ring_totals)
+            uvs_extend(ring_uvs)
+            v += len(coords)
+
+        # GARDENER - Moved numbers here as Gardener needs these!  The last ring also holds the cap.
+        numbers = array(ring_resolutions)
+        if cur_res != 2:
+            numbers[-1] += 1
+        ring_pitch = pitch_from_tangents(tan[ring_nodes])
+
+        if do_layers:
+            ring_node_list = [nodes[j] for j in ring_nodes]
+            number = int(numbers.sum())
+            layers_shade.fill(self.shade, number)
+            layers_thickness.extend(repeat_each(array([n.thickness for n in ring_node_list]), numbers))
+            layers_age.extend(repeat_each(array([n.age / tree_age for n in ring_node_list]), numbers))
+            layers_weight.extend(repeat_each(array([n.weight / base_weight for n in ring_node_list]), numbers))
+            layers_power.fill(self.power, number)
+            layers_health.extend(repeat_each(array([pow(n.photosynthesis, 0.2) for n in ring_node_list]), numbers))
+            if self.dead:
+                layers_dead.fill(1.0, number)
+            else:
+                layers_dead.fill(0.0, number)
+            layers_pitch.extend(repeat_each(ring_pitch, numbers))
+            layers_apical.fill(0.0, number)
+            layers_upward.fill(0.0, number)
+            layers_dead_twig.fill(0.0, number)
+            layers_lateral.fill(0.0, number)
+            layers_branch_index.fill(branch_index, number)
+            layers_branch_index_parent.fill(branch_index_parent, number)
+
+            # GARDENER - Additional layers
+            layers_frond.fill(0.0, number)
+            layer_height.extend(repeat_each(array([n.pos.z for n in ring_node_list]), numbers))
+            if self.is_trunk:
+                layer_trunk_distance.fill(0.0, number)
+            else:
+                layer_trunk_distance.extend(repeat_each(curr_trunk_distance + dist[ring_nodes], numbers))
+            layer_branch_distance.fill(0.0, number)
+            layer_branch_group.fill(branch_group, number)
+
+            # Nodes added in front for smoothing all count as the branch's first node.
+            if skeleton_node is not None:
+                node_shift = number_of_nodes - len(self.nodes)
+                ring_skeleton_nodes = skeleton_node + maximum(array(ring_nodes) - node_shift, 0)
+                layer_branch_node.extend(repeat_each(ring_skeleton_nodes, numbers))
+
+        # The twigs below carry on from the last ring.
+        j = last_node_index
+        n = nodes[-1]
+        pitch = ring_pitch[-1]
     
+    if gardener_intervention is True:
+        profiler.stop('Frond Placement', stage_token)
+    else:
+        profiler.stop('Ring Meshing', stage_token)
+
     # TK NOTE - Apical and Lateral Twig distribution.
+    stage_token = profiler.start()
 
     # Skip distributing twigs on dead branches.
     # if not self.dead:
@@ -1046,68 +872,54 @@ def build_branches_mesh(self, lateral_on_apical,
                 
                 # Upward twigs, if pointing upward more than a set angle, use an upward twig instead of a regular apical twig.
                 if self.dead or last_node.dead:
-                    layers_apical_extend([0.0] * number)
-                    layers_lateral_extend([0.0] *number)
-                    layers_upward_extend([0.0] * number)
-                    layers_dead_twig_extend([1.0] * number)
+                    layers_apical.fill(0.0, number)
+                    layers_lateral.fill(0.0, number)
+                    layers_upward.fill(0.0, number)
+                    layers_dead_twig.fill(1.0, number)
                 else:
                     direction_flat = direction.copy()
                     direction_flat.z = 0.0
                     if direction.angle(direction_flat, 3.14159) > 0.8 and direction.z > 0.0:  # 70 degrees is 1.2. 1.0 works well.
-                        layers_apical_extend([0.0] * number)
-                        layers_upward_extend([1.0] * number)
+                        layers_apical.fill(0.0, number)
+                        layers_upward.fill(1.0, number)
                     else:
-                        layers_apical_extend([1.0] * number)
-                        layers_upward_extend([0.0] * number)
-                    layers_lateral_extend([0.0] * number)
-                    layers_dead_twig_extend([0.0] * number)
-
-                layers_shade_extend([self.shade] * number)
-                layers_thickness_extend([last_node.thickness] * number)
-                layers_age_extend([last_node.age / tree_age] * number)
-                layers_weight_extend([last_node.weight / base_weight] * number)
-                layers_power_extend([self.power] * number)
-                layers_health_extend([pow(last_node.photosynthesis, 0.2)] * number)
+                        layers_apical.fill(1.0, number)
+                        layers_upward.fill(0.0, number)
+                    layers_lateral.fill(0.0, number)
+                    layers_dead_twig.fill(0.0, number)
+
+                layers_shade.fill(self.shade, number)
+                layers_thickness.fill(last_node.thickness, number)
+                layers_age.fill(last_node.age / tree_age, number)
+                layers_weight.fill(last_node.weight / base_weight, number)
+                layers_power.fill(self.power, number)
+                layers_health.fill(pow(last_node.photosynthesis, 0.2), number)
                 if self.dead:
-                    layers_dead_extend([1.0] * number)
+                    layers_dead.fill(1.0, number)
                 else:
-                    layers_dead_extend([0.0] * number)
-                layers_pitch_extend([pitch] * number)
-                layers_branch_index_extend([branch_index] * number)
-                layers_branch_index_parent_extend([branch_index_parent] * number)
+                    layers_dead.fill(0.0, number)
+                layers_pitch.fill(pitch, number)
+                layers_branch_index.fill(branch_index, number)
+                layers_branch_index_parent.fill(branch_index_parent, number)
 
                 # Gardener-specific layers
-                layers_frond_extend([0.0] * number)
-                layer_height_extend([last_node.pos.z] * number)
+                layers_frond.fill(0.0, number)
+                layer_height.fill(last_node.pos.z, number)
                 if self.is_trunk:
-                    layer_trunk_distance_extend([0.0] * number)
+                    layer_trunk_distance.fill(0.0, number)
                 else:
-                    layer_trunk_distance_extend([curr_trunk_distance + dist[j]] * number)
-                layer_branch_distance_extend([0.0] * number)
-                layer_branch_group_extend([branch_group] * number)
-            
-
-            if gardener_use_fronds:
-                for id_list in frond_materials.values():
-                    id_list.extend([0.0])
+                    layer_trunk_distance.fill(curr_trunk_distance + dist[j], number)
+                layer_branch_distance.fill(0.0, number)
+                layer_branch_group.fill(branch_group, number)
+                if skeleton_node is not None:
+                    layer_branch_node.fill(skeleton_node + len(self.nodes) - 1, number)
 
     
     # Add lateral twigs.
     last_node_index = len(self.nodes) - 1
     if disable_twigs is False:
-        for i, n in enumerate(self.nodes):
-            if i == 0 or n.age > lateral_twig_age_limit + dead_twig_wither:
-                    continue
-
-            if i == last_node_index:
-                if not lateral_on_apical:
-                    continue
-
-            if len(n.sub_branches):
-                # Don't add lateral twigs to nodes with sub branches.
-                if len(n.sub_branches[0].nodes) > 2:
-                    continue
-
+        for i in self.lateral_twig_nodes(lateral_on_apical, lateral_twig_age_limit, dead_twig_wither):
+            n = self.nodes[i]
             direction = n.direction
             if i != last_node_index:
                 direction = self.nodes[i + 1].pos - n.pos  # Use bent direction.
@@ -1116,11 +928,7 @@ def build_branches_mesh(self, lateral_on_apical,
                     if direction.length == 0.0:
                         direction = n.direction
 
-            current_branching = int(branching * min(1.0, self.power))
-            if branching > 1 and current_branching < 2:
-                current_branching = 2
-            elif branching == 1 and current_branching == 0:
-                current_branching = 1
+            current_branching = lateral_twig_branching(branching, self.power)
             for b in range(current_branching):
 
                 sub_branch_dir = deviate(branch_angle, current_branching, twist, self.initial_phyllotaxic_angle,
@@ -1149,121 +957,197 @@ def build_branches_mesh(self, lateral_on_apical,
                     number = 3
 
                     if do_layers:
-                        layers_shade_extend([self.shade] * number)
-                        layers_thickness_extend([n.thickness] * number)
-                        layers_age_extend([n.age / tree_age] * number)
-                        layers_weight_extend([n.weight / base_weight] * number)
-                        layers_power_extend([self.power] * number)
-                        layers_health_extend([pow(n.photosynthesis, 0.2)] * number)
+                        layers_shade.fill(self.shade, number)
+                        layers_thickness.fill(n.thickness, number)
+                        layers_age.fill(n.age / tree_age, number)
+                        layers_weight.fill(n.weight / base_weight, number)
+                        layers_power.fill(self.power, number)
+                        layers_health.fill(pow(n.photosynthesis, 0.2), number)
                         if self.dead:
-                            layers_dead_extend([1.0] * number)
+                            layers_dead.fill(1.0, number)
                         else:
-                            layers_dead_extend([0.0] * number)
+                            layers_dead.fill(0.0, number)
                         
-                        layers_pitch_extend([pitch] * number)
+                        layers_pitch.fill(pitch, number)
 
-                        layers_apical_extend([0.0] * number)
-                        layers_upward_extend([0.0] * number)
+                        layers_apical.fill(0.0, number)
+                        layers_upward.fill(0.0, number)
 
                         if n.age > lateral_twig_age_limit or self.dead:
-                            layers_lateral_extend([0.0] * number)
-                            layers_dead_twig_extend([1.0] * number)
+                            layers_lateral.fill(0.0, number)
+                            layers_dead_twig.fill(1.0, number)
                         else:
-                            layers_lateral_extend([1.0] * number)
-                            layers_dead_twig_extend([0.0] * number)
+                            layers_lateral.fill(1.0, number)
+                            layers_dead_twig.fill(0.0, number)
                         
-                        layers_branch_index_extend([branch_index] * number)
-                        layers_branch_index_parent_extend([branch_index_parent] * number)
+                        layers_branch_index.fill(branch_index, number)
+                        layers_branch_index_parent.fill(branch_index_parent, number)
 
                         # GARDENER - Additional layers
-                        layers_frond_extend([0.0] * number)
-                        layer_height_extend([n.pos.z] * number)
+                        layers_frond.fill(0.0, number)
+                        layer_height.fill(n.pos.z, number)
                         if self.is_trunk:
-                            layer_trunk_distance_extend([0.0] * number)
+                            layer_trunk_distance.fill(0.0, number)
                         else:
-                            layer_trunk_distance_extend([curr_trunk_distance + dist[j]] * number)
-                        layer_branch_distance_extend([0.0] * number)
-                        layer_branch_group_extend([branch_group] * number)
-            
-                    if gardener_use_fronds:
-                        for id_list in frond_materials.values():
-                            id_list.extend([0.0])
+                            layer_trunk_distance.fill(curr_trunk_distance + dist[j], number)
+                        layer_branch_distance.fill(0.0, number)
+                        layer_branch_group.fill(branch_group, number)
+                        if skeleton_node is not None:
+                            layer_branch_node.fill(skeleton_node + i, number)
     
-    # TK NOTE - Loops through to any sub-branches that may be in this node.
+    profiler.stop('Twig Placement', stage_token)
 
-    # Build sub branches.
-    next_branch_index = branch_index
-    for i, node in enumerate(self.nodes):
-        if node.sub_branches:
-            for sub_branch in node.sub_branches:
-                next_branch_index += 1
+    return v
 
-                # If the branch is too short or if Grove Gardener has intervened here,
-                # we skip sub-branches.
-                if len(sub_branch.nodes) < 2 or gardener_intervention is True:
-                    continue
-                
-                next_trunk_distance = curr_trunk_distance + dist[i]
-                hierarchy += 1
-                
-                # If we're in the trunk, increment the index group.
-                # We also need to collapse the current set of distances to the trunk.
-                if self.is_trunk:
-                    branch_group += 1
-                    next_trunk_distance = 0
-                    hierarchy = 0
 
-                    # Slice the trunk distance data layer and divide it by the highest length.
-                    trunk_length = len(layers['layer_trunk_distance'])
-                    trunk_indices = arange(trunk_distance_index, trunk_length)
-                    trunk_array = array(layers['layer_trunk_distance'])
+def sub_branch_parents(self, nodes, i):
+    """
+    GARDENER - Returns the nodes a sub branch growing from node i of this branch smooths itself
+    into, as (previous, current, next).  nodes are the smoothed nodes from build_branch_skeleton.
+    """
 
-                    trunk_sliced = layers['layer_trunk_distance'][trunk_distance_index:]
-                    trunk_remainder = numpy_delete(trunk_array, trunk_indices)
+    if i == 0:
+        return None, self.nodes[0], self.nodes[1]
+    elif i == 1 and i != len(self.nodes) - 1:
+        # Second node sub branch and not the last node.
+        if len(self.nodes) == len(nodes):
+            # This branch has no additional smoothing.
+            return self.nodes[0], self.nodes[1], self.nodes[2]
+        elif len(nodes) - len(self.nodes) == 2:
+            # This branch has smoothing at the start.
+            return nodes[2], nodes[3], nodes[4]
+        else:
+            # Only inserted one extra node for smoothing on thick branches.
+            return nodes[1], nodes[2], nodes[3]
+    elif i < len(self.nodes) - 1:
+        # Not the last node.
+        return self.nodes[i - 1], self.nodes[i], self.nodes[i + 1]
+    else:
+        # Sub branch of the last node.
+        return self.nodes[i - 1], self.nodes[i], None
 
-                    slice_max = amax(trunk_sliced)
-                    trunk_sliced = trunk_sliced / slice_max
-                    final_list = concatenate((trunk_remainder, trunk_sliced))
-                    layers['layer_trunk_distance'] = final_list.tolist()
 
-                    trunk_distance_index = len(layers['layer_trunk_distance']) + 1
-                    
-                # GARDENER - The distance tallied depends on what the previous node sent will be.
-                if i == 0:
-                    previous_node, current_node, next_node = None, self.nodes[0], self.nodes[1]
-                elif i == 1 and i != len(self.nodes) - 1:
-                    # Second node sub branch and not the last node.
-                    if len(self.nodes) == len(nodes):
-                        # This branch has no additional smoothing.
-                        previous_node, current_node, next_node = self.nodes[0], self.nodes[1], self.nodes[2]
-                    else:
-                        if len(nodes) - len(self.nodes) == 2:
-                            # This branch has smoothing at the start.
-                            previous_node, current_node, next_node = nodes[2], nodes[3], nodes[4]
-                        else:
-                            # Only inserted one extra node for smoothing on thick branches.
-                            previous_node, current_node, next_node = nodes[1], nodes[2], nodes[3]
-                elif i < len(self.nodes) - 1:
-                    # Not the last node.
-                    previous_node, current_node, next_node = self.nodes[i - 1], self.nodes[i], self.nodes[i + 1]
-                else:
-                    # Sub branch of the last node.
-                    previous_node, current_node, next_node = self.nodes[i - 1], self.nodes[i], None
-
-                v, next_branch_index, hierarchy = sub_branch.build_branches_mesh(
-                    lateral_on_apical,
-                    profile_resolution, profile_resolution_reduction,
-                    twist, u_repeat, texture_aspect_ratio, scale_to_twig,
-                    root_distribution, root_shape, root_scale, root_bump,
-                    base_weight,
-                    previous_node, current_node, next_node, v,
-                    verts, faces, uvs, shape, layers, fronds, frond_materials, 
-                    next_branch_index, branch_index, branch_group, next_trunk_distance, trunk_distance_index, hierarchy,
-                    origin, circles,
-                    lateral_twig_age_limit, dead_twig_wither, branch_angle, branching, plagiotropism_buds, add_planar, 
-                    wind_force, 
-                    tree_age,
-                    spring_shape=spring_shape, wind_shape=wind_shape)
-    
-    hierarchy -= 1
-    return v, next_branch_index, hierarchy
\ No newline at end of file
+def lateral_twig_nodes(self, lateral_on_apical, lateral_twig_age_limit, dead_twig_wither):
+    """
+    GARDENER - Returns the index of every node of this branch that grows lateral twigs.
+    """
+
+    last_node_index = len(self.nodes) - 1
+    twig_nodes = []
+
+    for i, n in enumerate(self.nodes):
+        if i == 0 or n.age > lateral_twig_age_limit + dead_twig_wither:
+            continue
+
+        if i == last_node_index:
+            if not lateral_on_apical:
+                continue
+
+        if len(n.sub_branches):
+            # Don't add lateral twigs to nodes with sub branches.
+            if len(n.sub_branches[0].nodes) > 2:
+                continue
+
+        twig_nodes.append(i)
+
+    return twig_nodes
+
+
+def count_branches_mesh(self, profile_resolution, profile_resolution_reduction, 
+                        parent_previous_node, parent_node, parent_next_node, fronds, gardener,
+                        parent_index, hierarchy, table,
+                        lateral_on_apical, lateral_twig_age_limit, dead_twig_wither, branching, root_distribution,
+                        vector_zero=Vector((0.0, 0.0, 0.0))):
+    """
+    GARDENER - Follows build_branches_mesh through the tree without building anything, adding what
+    every branch would add to the mesh to a PolyCountTable, both drawn as bark and replaced with a
+    frond.  Unlike a build it carries on into branches growing from ones that would be replaced, so
+    the table holds the count for any cutoff.
+
+    Smoothing evens out node radii in place like it does in a build, save them beforehand if the
+    tree is going to be built afterwards (see GardenerBuild.count_tree_polygons).
+    """
+
+    branch_cache = gardener.branch_cache
+
+    # Walked off a stack in the same order as build_branches_mesh.
+    branches = [(self, (parent_previous_node, parent_node, parent_next_node), parent_index, hierarchy)]
+    while branches:
+        branch, parents, parent_index, hierarchy = branches.pop()
+
+        skeleton = None
+        if branch_cache is not None:
+            skeleton = branch_cache.get_skeleton(branch_cache.skeleton_key(branch, *parents, gardener), branch)
+        if skeleton is None:
+            skeleton = branch.build_branch_skeleton(*parents, gardener, vector_zero)
+
+        nodes, pos, tan, axi, dir, dist = skeleton
+
+        # Bark, counted ring by ring the way build_branch_fragment draws them.
+        kept_loops = select_edgeloops(nodes, tan, gardener, 
+                                      root_flare_nodes(branch.is_trunk, root_distribution, len(nodes)))
+
+        vertex_count = 0
+        quad_count = 0
+        triangle_count = 0
+        prev_res = None
+
+        for j, n in enumerate(nodes):
+            if kept_loops is not None and not kept_loops[j]:
+                continue
+
+            if j == 0:
+                cur_res = ring_resolution(profile_resolution, profile_resolution_reduction, branch.nodes[0].thickness)
+            else:
+                cur_res = ring_resolution(profile_resolution, profile_resolution_reduction, n.thickness, prev_res)
+
+                # Faces between this ring and the last, closed with a quad or with a quad and a triangle
+                # where the resolution steps down.
+                quad_count += cur_res - 1
+                if prev_res == cur_res and cur_res != 2:
+                    quad_count += 1
+                elif prev_res == cur_res + 1:
+                    quad_count += 1
+                    triangle_count += 1
+
+            vertex_count += cur_res
+            prev_res = cur_res
+
+        # Cap the tip.
+        if prev_res != 2:
+            vertex_count += 1
+            triangle_count += prev_res
+
+        # Twigs are a triangle each.
+        twig_count = lateral_twig_branching(branching, branch.power) * len(
+            branch.lateral_twig_nodes(lateral_on_apical, lateral_twig_age_limit, dead_twig_wither))
+        if branch.nodes[-1].age < 4:
+            twig_count += 1
+
+        bark = (vertex_count + twig_count * 3, quad_count + triangle_count + twig_count,
+                quad_count * 2 + triangle_count + twig_count)
+
+        # The frond this branch would be replaced with.
+        frond = (0, 0, 0)
+        if gardener.use_fronds and fronds and fronds[0]:
+            match_weight = gardener.frond_match_weight
+            branch_width, branch_tip_spread = 0.0, 0.0
+            if match_weight > 0.0:
+                branch_width, branch_tip_spread = branch_descriptor(pos, nodes[0].radius)
+
+            frond_target = fronds[0][fronds[2].lookup(dist[-1], branch_width, branch_tip_spread, match_weight)]
+            frond = (len(frond_target.coords), len(frond_target.loop_totals), 
+                     int(frond_target.loop_totals.sum()) - 2 * len(frond_target.loop_totals))
+
+        index = table.add(parent_index, hierarchy, branch.nodes[0].thickness, dist[-1], bark, frond)
+
+        sub_branches = []
+        for i, node in enumerate(branch.nodes):
+            for sub_branch in node.sub_branches:
+                if len(sub_branch.nodes) < 2:
+                    continue
+
+                sub_branches.append((sub_branch, branch.sub_branch_parents(nodes, i),
+                                     index, 0 if branch.is_trunk else hierarchy + 1))
+
+        branches.extend(reversed(sub_branches))
@@ -3,8 +3,14 @@
 # INSTALLATION : Add this to the top of the OperatorBuild file (around line 27)
 
 # GARDENER - Required imports
-from numpy import array, arange, random
-from .GardenerBuild import load_frond_set, build_normal_reprojection, vertex_colors_layer_from_colors
+from numpy import array, zeros, count_nonzero, int32, float32
+from .GardenerMesh import LayerStore, LayerBuffer, VertexBuffer, FaceBuffer, FrondPlacements
+from .GardenerMesh import normalize_ranges, shuffle_branch_groups, frond_tip_distances, tracks_frond_tips
+from .GardenerBuild import load_frond_set, build_normal_reprojection, vertex_colors_layer_from_colors, get_gardener_settings
+from .GardenerBuild import write_mesh, build_normal_field_reprojection, gardener_profile_settings, count_tree_polygons
+from .GardenerBuild import lod_settings, lod_screen_sizes, build_frond_instances
+from .GardenerMesh import BranchCache, TreeSkeleton
+from .GardenerPreview import capture_preview
 
 
 # -------------------------------------------------------
@@ -43,70 +49,235 @@ def build_branches_mesh(tree, properties, context):
 
     # Load frond data if we're replacing branches.
     # Also contains an indexed list of all materials used.
-    gardener_use_fronds = bpy.context.scene.gardener_use_fronds
-    gardener_reproject_normals = bpy.context.scene.gardener_normal_use_reproject
+    gardener = get_gardener_settings(bpy.context.scene, properties.scale_to_twig)
+    gardener_use_fronds = gardener.use_fronds
+    profiler = gardener.profiler
     frond_data = []
-    frond_materials = {}
 
     if gardener_use_fronds:
+        stage_token = profiler.start()
         frond_data = load_frond_set(bpy.context.scene.gardener_frond_collection, properties.scale_to_twig)
-        for mat_name in frond_data[1]:
-            frond_materials[mat_name] = []
+        profiler.stop('Frond Library Load', stage_token)
+
+    # GARDENER - Lower levels of detail reuse the skeletons the first build leaves in the branch cache,
+    # so each one only meshes the branches again.  With Reuse Branches off they get a cache of their own.
+    # Their fragments go in a cache that only lasts the chain, see BranchCache.level_cache.
+    if gardener.lod_levels > 1 and gardener.branch_cache is None:
+        gardener = gardener._replace(branch_cache=BranchCache())
+
+    # GARDENER - Branches that haven't changed since the last build are copied from the branch cache.
+    if gardener.branch_cache is not None:
+        gardener.branch_cache.begin_build()
+
+    tree.engulf_branches(None, None)
+
+    # GARDENER - Export the tree into flat arrays once, for every pass that doesn't need to build it.
+    stage_token = profiler.start()
+    skeleton = TreeSkeleton.from_tree(tree)
+    profiler.stop('Skeleton Export', stage_token)
+    gardener = gardener._replace(skeleton=skeleton)
+
+    # GARDENER - Count every branch both ways before building, so the Polycount panel can give the count
+    # for any cutoff and fit the cutoffs to a triangle budget without building again.
+    estimate = None
+    if bpy.context.scene.gardener_count_polygons:
+        poly_count = count_tree_polygons(tree, properties, gardener, frond_data)
+        estimate = poly_count.totals(gardener_use_fronds, gardener.replace_type, gardener.thickness_cutoff,
+                                     gardener.hierarchy_cutoff, gardener.length_cutoff, gardener.hierarchy_reverse)
+
+    ob, simulation_data, vertices, faces = build_gardener_mesh(tree, properties, context, gardener, frond_data, 
+                                                               im, texture_aspect_ratio, properties.profile_resolution,
+                                                               str(properties.preset_name))
+    properties.number_of_polygons += len(faces)
+
+    # GARDENER - Every level of detail past the first becomes a child of the tree object, named after the
+    # preset with the level on the end.  The screen size each one takes over at is kept on the object.
+    if gardener.lod_levels > 1:
+        lods = [ob]
+        triangle_counts = [faces.triangle_count()]
+        level_cache = gardener.branch_cache.level_cache()
+        for level in range(1, gardener.lod_levels):
+            level_gardener, level_resolution = lod_settings(gardener, level, properties.profile_resolution)
+            level_gardener = level_gardener._replace(branch_cache=level_cache)
+            lod, lod_data, lod_vertices, lod_faces = build_gardener_mesh(tree, properties, context, level_gardener, 
+                                                                         frond_data, im, texture_aspect_ratio, 
+                                                                         level_resolution,
+                                                                         '{}_LOD{}'.format(properties.preset_name, level))
+
+            # The tree object already carries the location and scale.
+            lod.parent = ob
+            lod.location = Vector((0.0, 0.0, 0.0))
+            lod.scale = Vector((1.0, 1.0, 1.0))
+            bpy.context.collection.objects.link(lod)
+
+            lods.append(lod)
+            triangle_counts.append(lod_faces.triangle_count())
+
+        for lod, triangles, screen_size in zip(lods, triangle_counts, lod_screen_sizes(triangle_counts)):
+            lod['gardener_lod_screen_size'] = screen_size
+            if gardener.verbose:
+                print('GARDENER - {} has {} triangles, shown below {:.0%} screen size'.format(lod.name, triangles, 
+                                                                                            screen_size))
+
+    if gardener.branch_cache is not None:
+        gardener.branch_cache.end_build()
+        if gardener.verbose:
+            print('GARDENER - Reused {} of {} branches'.format(gardener.branch_cache.hits, 
+                                                               gardener.branch_cache.hits + gardener.branch_cache.misses))
+
+    if estimate is not None and gardener.verbose:
+        print('GARDENER - Counted {} vertices and {} faces, built {} and {}'.format(estimate[0], estimate[1], 
+                                                                                  len(vertices), len(faces)))
+
+    if properties.twigs_menu != t('no_twigs'):
+        # Build twigs.
+        set_viewport_detail(properties)
+
+        # Apical twig particle system.
+        modifier = ob.modifiers.new("Apical Twigs", 'PARTICLE_SYSTEM')
+        psystem = ob.particle_systems[-1]
+        psystem.name = "Apical Twigs"
+        ps = psystem.settings
+        ps.count = count_nonzero(simulation_data['layer_apical'] == 1.0) / 3
+        configure_particles(ps, psystem, modifier)
+        psystem.vertex_group_density = t('layer_apical')
+
+        # Lateral twig particle system.
+        modifier = ob.modifiers.new("Lateral Twigs", 'PARTICLE_SYSTEM')
+        psystem = ob.particle_systems[-1]
+        psystem.name = "Lateral Twigs"
+        ps = psystem.settings
+        ps.count = (count_nonzero(simulation_data['layer_lateral'] == 1.0) / 3
+                    * properties.lateral_twig_chance)
+        configure_particles(ps, psystem, modifier)
+        psystem.vertex_group_density = t('layer_lateral')
+
+        # Upward twig particle system.
+        modifier = ob.modifiers.new("Upward Twigs", 'PARTICLE_SYSTEM')
+        psystem = ob.particle_systems[-1]
+        psystem.name = "Upward Twigs"
+        ps = psystem.settings
+        ps.count = (count_nonzero(simulation_data['layer_upward'] == 1.0) / 3)
+        configure_particles(ps, psystem, modifier)
+        psystem.vertex_group_density = t('layer_upward')
+
+        # Dead twig particle system.
+        modifier = ob.modifiers.new("Dead Twigs", 'PARTICLE_SYSTEM')
+        psystem = ob.particle_systems[-1]
+        psystem.name = "Dead Twigs"
+        ps = psystem.settings
+        ps.count = (count_nonzero(simulation_data['layer_dead_twig'] == 1.0) / 3)
+        configure_particles(ps, psystem, modifier)
+        psystem.vertex_group_density = t('layer_dead_twig')
+
+    # GARDENER - Keep the whole skeleton around so the replacement preview can redraw without a build.
+    if bpy.context.scene.gardener_preview:
+        capture_preview(skeleton, ob, frond_data, properties.scale_to_twig)
+
+    # GARDENER - Keep the build's timings on the scene for the Build Profile panel.
+    if profiler.enabled:
+        bpy.context.scene.gardener_profile_report = profiler.to_json(preset=str(properties.preset_name),
+                                                                     vertices=len(vertices), faces=len(faces),
+                                                                     settings=gardener_profile_settings(gardener))
+        if gardener.verbose:
+            profiler.print_report()
+
+    return ob
+
+
+# -------------------------------------------------------
+
+# GARDENER - This builds the Gardener mesh of a tree at one level of detail, split off from
+# build_branches_mesh above so LOD chains can build the tree more than once.
+#
+# INSTALLATION : Add this right below build_branches_mesh inside OperatorBuild.
 
-    vertices = []
-    faces = []
-    uvs = []
+def build_gardener_mesh(tree, properties, context, gardener, frond_data, im, texture_aspect_ratio, 
+                        profile_resolution, name):
+    """
+    Builds the branches mesh of a tree with the given Gardener settings and profile resolution,
+    and returns the object along with its data layers and the vertex and face buffers.
+    Twig particle systems are left to the caller.
+    """
+
+    gardener_use_fronds = gardener.use_fronds
+    gardener_reproject_normals = gardener.reproject_normals
+    profiler = gardener.profiler
+    frond_placements = FrondPlacements()
+
+    # GARDENER - Geometry goes into flat typed buffers that are written to the mesh in bulk.
+    vertices = VertexBuffer()
+    faces = FaceBuffer()
+    uvs = LayerBuffer(float32)
     shape = []
     
 
-    simulation_data = {'layer_shade': [],
-                       'layer_thickness': [],
-                       'layer_age': [],
-                       'layer_weight': [],
-                       'layer_power': [],
-                       'layer_health': [],
-                       'layer_dead': [],
-                       'layer_pitch': [],
-                       'layer_apical': [],
-                       'layer_lateral': [],
-                       'layer_upward': [],
-                       'layer_dead_twig': [],
-                       'layer_branch_index': [],
-                       'layer_branch_index_parent': [],
-
-                       # GARDENER - Extra data sets.
-                       'layer_frond': [],
-                       'layer_height': [],
-                       'layer_trunk_distance': [],
-                       'layer_branch_distance': [],
-                       'layer_branch_group': [],
-                       }
+    # GARDENER - Layers are kept in typed, growable arrays rather than lists of floats.
+    simulation_data = LayerStore(['layer_shade',
+                                  'layer_thickness',
+                                  'layer_age',
+                                  'layer_weight',
+                                  'layer_power',
+                                  'layer_health',
+                                  'layer_dead',
+                                  'layer_pitch',
+                                  'layer_apical',
+                                  'layer_lateral',
+                                  'layer_upward',
+                                  'layer_dead_twig',
+                                  'layer_branch_index',
+                                  'layer_branch_index_parent',
+
+                                  # GARDENER - Extra data sets.
+                                  'layer_frond',
+                                  'layer_height',
+                                  'layer_trunk_distance',
+                                  'layer_branch_distance',
+                                  'layer_branch_group',
+
+                                  # GARDENER - The skeleton node every vertex was built at, only filled in
+                                  # for the Branch to Frond layer and never added to the mesh.
+                                  'layer_branch_node',
+                                  ],
+                                 int_names=('layer_branch_index', 'layer_branch_index_parent', 'layer_branch_node'))
 
-    tree.engulf_branches(None, None)
     tree.build_branches_mesh(properties.lateral_on_apical,
-                             properties.profile_resolution, properties.profile_resolution_reduction,
+                             profile_resolution, properties.profile_resolution_reduction,
                              properties.twist, properties.u_repeat, texture_aspect_ratio, 
                              properties.scale_to_twig,
                              properties.root_distribution, properties.root_shape,
                              properties.root_scale, properties.root_bump,
                              tree.nodes[0].weight,
                              None, None, None, 0,
-                             vertices, faces, uvs, shape, simulation_data, frond_data, frond_materials, 
-                             0, 0, 0, 0, 0, 0,
-                             tree.nodes[0].pos, pre_compute_circles(properties.profile_resolution),
+                             vertices, faces, uvs, shape, simulation_data, frond_data, frond_placements, gardener,
+                             0, 0, 0, 0, 0,
+                             tree.nodes[0].pos, pre_compute_circles(profile_resolution),
                              properties.lateral_twig_age_limit, properties.dead_twig_wither,
                              properties.branch_angle, int(properties.branching),
                              properties.plagiotropism_buds, properties.add_planar, 
                              0.0, tree.nodes[0].age + 1)
 
-    # Name branches object after the preset.
-    me = bpy.data.meshes.new(str(properties.preset_name))
-    me.from_pydata(vertices, [], faces)
+    # GARDENER - Normalize the distance to the trunk within every branch group.
+    stage_token = profiler.start()
+    normalize_ranges(simulation_data['layer_trunk_distance'].view(), simulation_data.group_starts)
+
+    # GARDENER - Measure the distance to the closest frond tip along the skeleton, from every vertex at once.
+    if tracks_frond_tips(gardener):
+        frond_tip_distances(simulation_data['layer_branch_distance'].view(), simulation_data['layer_frond'].view(),
+                            simulation_data['layer_branch_node'].view(), gardener.skeleton, simulation_data.frond_tips)
+
+    # GARDENER - Keep the smoothed length of every branch for the replacement preview.
+    gardener.skeleton.record_lengths(simulation_data.branch_rows, simulation_data.branch_lengths)
 
-    uv_layer = me.uv_layers.new(name="UVMap")
-    uv_layer.data.foreach_set("uv", [uv for pair in uvs for uv in pair])
+    # GARDENER - Every layer from here on is a NumPy array viewing the layer store.
+    simulation_data = simulation_data.views()
+    del simulation_data['layer_branch_node']
+    profiler.stop('Layer Post-processing', stage_token)
 
-    me.polygons.foreach_set("use_smooth", [True] * len(me.polygons))
+    stage_token = profiler.start()
+    me = bpy.data.meshes.new(name)
+    write_mesh(me, vertices, faces, uvs)
+    profiler.stop('Mesh Creation', stage_token)
 
     bark_material = None
     try:
@@ -123,44 +294,31 @@ def build_branches_mesh(tree, properties, context):
             bark_material.roughness = 1.0
     me.materials.append(bark_material)
 
-    properties.number_of_polygons += len(faces)
-
-    ob = bpy.data.objects.new(str(properties.preset_name), me)
+    ob = bpy.data.objects.new(name, me)
     me = ob.data  # Just to be sure. This could fix the unstable behavior.
 
     # GARDENER - Inserts property booleans to populate our custom vertex layers.
+    stage_token = profiler.start()
     properties.do_layer_frond = gardener_use_fronds
-    properties.do_layer_height = bpy.context.scene.gardener_datalayer_height
-    properties.do_layer_trunk_distance = bpy.context.scene.gardener_datalayer_trunktobranch
-    properties.do_layer_branch_distance = bpy.context.scene.gardener_datalayer_branchtofrond
-    properties.do_layer_branch_group = bpy.context.scene.gardener_datalayer_branchgroup
+    properties.do_layer_height = gardener.datalayer_height
+    properties.do_layer_trunk_distance = gardener.datalayer_trunktobranch
+    properties.do_layer_branch_distance = gardener.datalayer_branchtofrond
+    properties.do_layer_branch_group = gardener.datalayer_branchgroup
 
     # GARDENER - This needs an actual interface, right now though itll force include all
     # gamedev-relevant vertex groups.
-    gardener_merge_layers = bpy.context.scene.gardener_merge_layers
+    gardener_merge_layers = gardener.merge_layers
 
     if properties.do_layer_height or gardener_merge_layers:
-        max_height = tree.find_highest_point(0.0)
+        max_height = gardener.skeleton.highest_point()
         height_array = array(simulation_data['layer_height'])
         simulation_data['layer_height'] = height_array / max_height
 
     if properties.do_layer_branch_group or gardener_merge_layers:
-        branch_array = array(simulation_data['layer_branch_group'])
-        branch_group_value = branch_array[len(branch_array) - 1]
-
-        # make an array with values counting up to the branch group value and SHUFFLE
-        randomizer = arange(branch_group_value + 1)
-        random.shuffle(randomizer)
-
-        # replace the numbers incrementally
-        i = 0
-        print(randomizer)
-        print(branch_array)
-        while i < branch_group_value:
-            branch_array[branch_array == i] = randomizer[i]
-            i += 1
-
-        simulation_data['layer_branch_group'] = branch_array / branch_group_value
+        # GARDENER - Shuffle the branch groups so neighbouring groups get different values, seeded
+        # so the same tree gets the same colors on every build.
+        simulation_data['layer_branch_group'] = shuffle_branch_groups(simulation_data['layer_branch_group'], 
+                                                                      gardener.branch_group_seed)
     
     # GARDENER - Merges all active Gardener data layers into a single color group.
     if gardener_merge_layers:
@@ -176,7 +334,9 @@ def build_branches_mesh(tree, properties, context):
     if properties.show_dead_preview:
         properties.do_layer_dead = True
 
-    material_indices = [0] * len(faces)
+    # GARDENER - Twig materials are picked from the layer value of each face's first vertex.
+    face_first_vertex = faces.first_vertices()
+    material_indices = zeros(len(face_first_vertex), dtype=int32)
     for name, data in simulation_data.items():
         if getattr(properties, "do_" + str.lower(name)):
 
@@ -198,8 +358,7 @@ def build_branches_mesh(tree, properties, context):
                     bark_material.roughness = 0.8
                 me.materials.append(bpy.data.materials["TheGroveApicalTwigs"])
                 index = me.materials.find("TheGroveApicalTwigs")
-                material_indices = [material_indices[i] + (index * int(data[face[0]]))
-                                    for i, face in enumerate(faces)]
+                material_indices += index * data[face_first_vertex].astype(int32)
             
             if name == "layer_upward" and properties.do_layer_upward:
                 if "TheGroveUpwardTwigs" not in bpy.data.materials:
@@ -209,8 +368,7 @@ def build_branches_mesh(tree, properties, context):
                     bark_material.roughness = 0.8
                 me.materials.append(bpy.data.materials["TheGroveUpwardTwigs"])
                 index = me.materials.find("TheGroveUpwardTwigs")
-                material_indices = [material_indices[i] + (index * int(data[face[0]]))
-                                    for i, face in enumerate(faces)]
+                material_indices += index * data[face_first_vertex].astype(int32)
             
             if name == "layer_dead_twig" and properties.do_layer_dead_twig:
                 if "TheGroveDeadTwigs" not in bpy.data.materials:
@@ -220,8 +378,7 @@ def build_branches_mesh(tree, properties, context):
                     bark_material.roughness = 0.8
                 me.materials.append(bpy.data.materials["TheGroveDeadTwigs"])
                 index = me.materials.find("TheGroveDeadTwigs")
-                material_indices = [material_indices[i] + (index * int(data[face[0]]))
-                                    for i, face in enumerate(faces)]
+                material_indices += index * data[face_first_vertex].astype(int32)
 
             if name == "layer_lateral" and properties.do_layer_lateral:
                 if "TheGroveLateralTwigs" not in bpy.data.materials:
@@ -231,10 +388,9 @@ def build_branches_mesh(tree, properties, context):
                     bark_material.roughness = 0.8
                 me.materials.append(bpy.data.materials["TheGroveLateralTwigs"])
                 index = me.materials.find("TheGroveLateralTwigs")
-                material_indices = [material_indices[i] + (index * int(data[face[0]]))
-                                    for i, face in enumerate(faces)]
+                material_indices += index * data[face_first_vertex].astype(int32)
                 # Store to later tweak twig density without needing a full rebuild.
-                ob['number_of_lateral_twigs'] = material_indices.count(index)
+                ob['number_of_lateral_twigs'] = int(count_nonzero(material_indices == index))
 
             # if name == "layer_dead" and properties.do_layer_dead:
             if name == "layer_dead" and properties.show_dead_preview:
@@ -245,31 +401,28 @@ def build_branches_mesh(tree, properties, context):
                     bark_material.roughness = 0.8
                 me.materials.append(bpy.data.materials["TheGroveDeadBranches"])
                 index = me.materials.find("TheGroveDeadBranches")
-                material_indices = [material_indices[i] + (index * int(data[face[0]]))
-                                    for i, face in enumerate(faces)]
+                material_indices += index * data[face_first_vertex].astype(int32)
+
+    profiler.stop('Layer Post-processing', stage_token)
 
     # Assign custom frond materials
+    stage_token = profiler.start()
     if gardener_use_fronds:
-        custom_i = 0
-        for mat_name, mat_data in frond_materials.items():
+        frond_slots = []
+        for mat_name in frond_data[1]:
             me.materials.append(bpy.data.materials[mat_name])
-            index = me.materials.find(mat_name)
+            frond_slots.append(me.materials.find(mat_name))
 
-            for i, face in enumerate(faces):
-                result = index * int(mat_data[i])
-                material_indices[i] = material_indices[i] + result
-        
+        frond_material_ids = frond_placements.face_material_ids(frond_data[0], len(material_indices))
+        frond_faces = frond_material_ids >= 0
+        material_indices[frond_faces] += array(frond_slots, dtype=int32)[frond_material_ids[frond_faces]]
+    profiler.stop('Material Assignment', stage_token)
     
     # Needle layer WIP. TODO: Finalize!
+    stage_token = profiler.start()
     if getattr(properties, 'do_layer_young'):
-        data = simulation_data['layer_age']
+        data = (simulation_data['layer_age'] * properties.age < 3).astype(float32)
         name = t('layer_young')
-
-        for i in range(len(data)):
-            if data[i] * properties.age < 3:
-                data[i] = 1
-            else:
-                data[i] = 0
         
         vertex_group_layer_from_data(ob, name, data)
         
@@ -277,58 +430,34 @@ def build_branches_mesh(tree, properties, context):
             properties.display_vertex_colors_warning = True
             print(t('colors_limit_message').format(name))
     
+    profiler.stop('Layer Post-processing', stage_token)
+    
     # Set material indices for twig duplicator faces.
+    stage_token = profiler.start()
     me.polygons.foreach_set("material_index", material_indices)
-
-    # GARDENER - Reproject normals using a duplicated hull of the tree.
-    if gardener_use_fronds and gardener_reproject_normals:
-        hull_res = bpy.context.scene.gardener_normal_hull_res
-        hull_expand = bpy.context.scene.gardener_normal_hull_size
-        build_normal_reprojection(ob, properties.scale_to_twig, hull_res, hull_expand)
+    profiler.stop('Material Assignment', stage_token)
+
+    # GARDENER - Reproject normals, either from a field built from the tree's vertices or
+    # using a duplicated and remeshed hull of the tree.  Instanced fronds keep their own normals.
+    if gardener_use_fronds and gardener_reproject_normals and gardener.frond_output != 'Instances':
+        stage_token = profiler.start()
+        hull_res = gardener.hull_res
+        hull_expand = gardener.hull_size
+        if gardener.reproject_mode == 'Field':
+            build_normal_field_reprojection(ob, simulation_data['layer_frond'], properties.scale_to_twig, 
+                                            hull_res, hull_expand)
+        else:
+            build_normal_reprojection(ob, properties.scale_to_twig, hull_res, hull_expand)
+        profiler.stop('Normal Reprojection', stage_token)
 
     me['the_grove'] = 'Grown with The Grove.'
     ob.location = tree.nodes[0].pos * properties.scale_to_twig
     ob.scale = Vector((properties.scale_to_twig, properties.scale_to_twig, properties.scale_to_twig))
 
-    if properties.twigs_menu != t('no_twigs'):
-        # Build twigs.
-        set_viewport_detail(properties)
-
-        # Apical twig particle system.
-        modifier = ob.modifiers.new("Apical Twigs", 'PARTICLE_SYSTEM')
-        psystem = ob.particle_systems[-1]
-        psystem.name = "Apical Twigs"
-        ps = psystem.settings
-        ps.count = len([selection for selection in simulation_data['layer_apical'] if selection == 1.0]) / 3
-        configure_particles(ps, psystem, modifier)
-        psystem.vertex_group_density = t('layer_apical')
-
-        # Lateral twig particle system.
-        modifier = ob.modifiers.new("Lateral Twigs", 'PARTICLE_SYSTEM')
-        psystem = ob.particle_systems[-1]
-        psystem.name = "Lateral Twigs"
-        ps = psystem.settings
-        ps.count = (len([selection for selection in simulation_data['layer_lateral'] if selection == 1.0]) / 3
-                    * properties.lateral_twig_chance)
-        configure_particles(ps, psystem, modifier)
-        psystem.vertex_group_density = t('layer_lateral')
-
-        # Upward twig particle system.
-        modifier = ob.modifiers.new("Upward Twigs", 'PARTICLE_SYSTEM')
-        psystem = ob.particle_systems[-1]
-        psystem.name = "Upward Twigs"
-        ps = psystem.settings
-        ps.count = (len([selection for selection in simulation_data['layer_upward'] if selection == 1.0]) / 3)
-        configure_particles(ps, psystem, modifier)
-        psystem.vertex_group_density = t('layer_upward')
-
-        # Dead twig particle system.
-        modifier = ob.modifiers.new("Dead Twigs", 'PARTICLE_SYSTEM')
-        psystem = ob.particle_systems[-1]
-        psystem.name = "Dead Twigs"
-        ps = psystem.settings
-        ps.count = (len([selection for selection in simulation_data['layer_dead_twig'] if selection == 1.0]) / 3)
-        configure_particles(ps, psystem, modifier)
-        psystem.vertex_group_density = t('layer_dead_twig')
+    # GARDENER - Fronds placed as instances go on a child object of points, see build_frond_instances.
+    if gardener_use_fronds and gardener.frond_output == 'Instances':
+        stage_token = profiler.start()
+        build_frond_instances(ob, frond_placements, frond_data, properties.scale_to_twig, gardener.realize_fronds)
+        profiler.stop('Frond Instancing', stage_token)
 
-    return ob
\ No newline at end of file
+    return ob, simulation_data, vertices, faces
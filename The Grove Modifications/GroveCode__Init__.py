@@ -1,12 +1,17 @@
-
-# You'll need to add these two lines in The Grove's __init__.py file in order for
-# the plugin to recognize the GardenerBuild file you need to add.
+# You'll need to add these lines in The Grove's __init__.py file in order for
+# the plugin to recognize the Gardener files you need to add.
 
 
 # INSTALLATION : Add this below line 112 in __init__.py
 
+importlib.reload(GardenerMesh)
+importlib.reload(GardenerProfile)
 importlib.reload(GardenerBuild)
+importlib.reload(GardenerPreview)
 
 # INSTALLATION : Add this below line 153 in __init__.py
 
-from . import GardenerBuild
\ No newline at end of file
+from . import GardenerMesh
+from . import GardenerProfile
+from . import GardenerBuild
+from . import GardenerPreview
@@ -0,0 +1,407 @@
+# Headless benchmarks for the Gardener meshing path.
+#
+# Runs in a background Blender (no GUI, no copy of The Grove needed) :
+#
+#   blender --background --factory-startup --python benchmarks/run_benchmarks.py -- --output results.json
+#
+# Options after the -- are :
+#
+#   --tiers small medium large     Size tiers to run, see synthetic.TIERS.
+#   --repeats 3                    Timed runs per benchmark, the fastest and the mean are reported.
+#   --output results.json          Where the results are written.
+#   --compare old_results.json     Prints how every benchmark changed against an earlier run.
+#
+# The Gardener files are loaded straight from "The Grove Modifications" into a throwaway package,
+# with the stand-ins from synthetic.py filling in for The Grove.
+
+import sys
+import os
+import gc
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import importlib.util
+from math import cos, sin, pi
+from types import ModuleType
+
+import bpy
+import numpy
+from mathutils import Matrix, Vector, Quaternion
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MODIFICATIONS_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'The Grove Modifications')
+PACKAGE = 'gardener_bench'
+
+sys.path.insert(0, BENCH_DIR)
+import synthetic
+
+
+# Same layers OperatorBuild fills.
+LAYER_NAMES = ['layer_shade', 'layer_thickness', 'layer_age', 'layer_weight', 'layer_power', 'layer_health',
+               'layer_dead', 'layer_pitch', 'layer_apical', 'layer_lateral', 'layer_upward', 'layer_dead_twig',
+               'layer_branch_index', 'layer_branch_index_parent',
+               'layer_frond', 'layer_height', 'layer_trunk_distance', 'layer_branch_distance', 'layer_branch_group',
+               'layer_branch_node']
+INT_LAYER_NAMES = ('layer_branch_index', 'layer_branch_index_parent', 'layer_branch_node')
+
+
+def load_gardener():
+    """
+    Imports GardenerMesh, GardenerBuild and the Gardener build_branches_mesh as a package, and
+    attaches build_branches_mesh to the synthetic Branch.
+    """
+
+    package = ModuleType(PACKAGE)
+    package.__path__ = [MODIFICATIONS_DIR]
+    sys.modules[PACKAGE] = package
+
+    modules = {}
+    for name in ('GardenerMesh', 'GardenerBuild', 'GroveCode_Branch'):
+        spec = importlib.util.spec_from_file_location(PACKAGE + '.' + name, os.path.join(MODIFICATIONS_DIR, name + '.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+
+        # The Branch code lives inside The Grove's Branch module, so give it what that module has.
+        if name == 'GroveCode_Branch':
+            module.__dict__.update(Node=synthetic.Node, deviate=synthetic.deviate,
+                                   two_point_transform=synthetic.two_point_transform,
+                                   Matrix=Matrix, Vector=Vector, Quaternion=Quaternion,
+                                   cos=cos, sin=sin, pi=pi)
+
+        spec.loader.exec_module(module)
+        setattr(package, name, module)
+        modules[name] = module
+
+    branch_code = modules['GroveCode_Branch']
+    synthetic.Branch.build_branches_mesh = branch_code.build_branches_mesh
+    synthetic.Branch.build_branch_skeleton = branch_code.build_branch_skeleton
+    synthetic.Branch.build_branch_fragment = branch_code.build_branch_fragment
+    synthetic.Branch.sub_branch_parents = branch_code.sub_branch_parents
+    synthetic.Branch.lateral_twig_nodes = branch_code.lateral_twig_nodes
+    synthetic.Branch.count_branches_mesh = branch_code.count_branches_mesh
+
+    return modules['GardenerMesh'], modules['GardenerBuild']
+
+
+def measure(function, repeats, setup=None):
+    """
+    Calls function repeats times, each time with a fresh argument from setup if one is given.
+
+    Returns the wall times, the peak Python memory of the first call (tracked on its own, so
+    tracing doesn't slow the timed calls down) and the last result.
+    """
+
+    def call():
+        if setup is None:
+            return function()
+        return function(setup())
+
+    gc.collect()
+    tracemalloc.start()
+    result = call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeats):
+        argument = setup() if setup is not None else None
+        gc.collect()
+        start = time.perf_counter()
+        result = function(argument) if setup is not None else function()
+        times.append(time.perf_counter() - start)
+
+    return times, peak, result
+
+
+def record(results, benchmark, tier, scenario, times, peak, vertices=None, **extra):
+    entry = {
+        'benchmark': benchmark,
+        'tier': tier,
+        'scenario': scenario,
+        'repeats': len(times),
+        'wall_time_min': min(times),
+        'wall_time_mean': sum(times) / len(times),
+        'peak_memory_bytes': peak,
+    }
+    if vertices is not None:
+        entry['vertices'] = vertices
+        entry['verts_per_second'] = vertices / min(times) if min(times) > 0.0 else None
+    entry.update(extra)
+    results.append(entry)
+
+    print('{:<34} {:<7} {:<7} {:>9.4f}s  {:>8.1f} KiB peak'.format(
+        benchmark, tier, scenario, entry['wall_time_min'], peak / 1024))
+
+
+def build_tree_mesh(gardener_mesh, gardener_build, tree, properties, scene, fronds):
+    """
+    Runs the Gardener build_branches_mesh over a tree the way OperatorBuild does, returning the buffers.
+    """
+
+    gardener = gardener_build.get_gardener_settings(scene, properties.scale_to_twig)
+    gardener = gardener._replace(skeleton=gardener_mesh.TreeSkeleton.from_tree(tree))
+    if gardener.branch_cache is not None:
+        gardener.branch_cache.begin_build()
+
+    built = mesh_tree(gardener_mesh, tree, properties, gardener, fronds, properties.profile_resolution)
+
+    if gardener.branch_cache is not None:
+        gardener.branch_cache.end_build()
+
+    return built
+
+
+def build_lod_chain(gardener_mesh, gardener_build, tree, properties, scene, fronds):
+    """
+    Builds every level of detail of a tree the way OperatorBuild does, returning the buffers of each.
+    """
+
+    gardener = gardener_build.get_gardener_settings(scene, properties.scale_to_twig)
+    gardener = gardener._replace(skeleton=gardener_mesh.TreeSkeleton.from_tree(tree))
+    if gardener.branch_cache is None:
+        gardener = gardener._replace(branch_cache=gardener_mesh.BranchCache())
+    gardener.branch_cache.begin_build()
+
+    levels = []
+    level_cache = gardener.branch_cache.level_cache()
+    for level in range(gardener.lod_levels):
+        level_gardener, level_resolution = gardener_build.lod_settings(gardener, level, properties.profile_resolution)
+        if level > 0:
+            level_gardener = level_gardener._replace(branch_cache=level_cache)
+        levels.append(mesh_tree(gardener_mesh, tree, properties, level_gardener, fronds, level_resolution))
+
+    gardener.branch_cache.end_build()
+
+    return levels
+
+
+def mesh_tree(gardener_mesh, tree, properties, gardener, fronds, profile_resolution):
+    """
+    Calls build_branches_mesh on a tree with the given settings and fresh buffers.
+    """
+
+    vertices = gardener_mesh.VertexBuffer()
+    faces = gardener_mesh.FaceBuffer()
+    uvs = gardener_mesh.LayerBuffer(numpy.float32)
+    simulation_data = gardener_mesh.LayerStore(LAYER_NAMES, int_names=INT_LAYER_NAMES)
+    frond_placements = gardener_mesh.FrondPlacements()
+
+    p = properties
+    tree.build_branches_mesh(p.lateral_on_apical,
+                             profile_resolution, p.profile_resolution_reduction,
+                             p.twist, p.u_repeat, p.texture_aspect_ratio, p.scale_to_twig,
+                             p.root_distribution, p.root_shape, p.root_scale, p.root_bump,
+                             tree.nodes[0].weight,
+                             None, None, None, 0,
+                             vertices, faces, uvs, [], simulation_data, fronds, frond_placements, gardener,
+                             0, 0, 0, 0, 0,
+                             tree.nodes[0].pos, synthetic.pre_compute_circles(profile_resolution),
+                             p.lateral_twig_age_limit, p.dead_twig_wither,
+                             p.branch_angle, int(p.branching),
+                             p.plagiotropism_buds, p.add_planar,
+                             0.0, tree.nodes[0].age + 1)
+
+    gardener_mesh.normalize_ranges(simulation_data['layer_trunk_distance'].view(), simulation_data.group_starts)
+    gardener.skeleton.record_lengths(simulation_data.branch_rows, simulation_data.branch_lengths)
+    if gardener_mesh.tracks_frond_tips(gardener):
+        gardener_mesh.frond_tip_distances(simulation_data['layer_branch_distance'].view(), 
+                                          simulation_data['layer_frond'].view(), 
+                                          simulation_data['layer_branch_node'].view(), gardener.skeleton, 
+                                          simulation_data.frond_tips)
+
+    return vertices, faces, uvs, simulation_data
+
+
+def run_tier(gardener_mesh, gardener_build, tier, repeats, results):
+    shape = synthetic.TIERS[tier]
+    properties = synthetic.make_properties()
+    fronds_per_tier = {'small': 6, 'medium': 24, 'large': 96}[tier]
+
+    collection = synthetic.make_frond_collection(bpy, name='GardenerBench_' + tier, count=fronds_per_tier)
+
+    try:
+        # Frond library loading, cold reads every object, warm comes straight out of the cache.
+        def load_cold():
+            gardener_build.frond_cache.clear()
+            return gardener_build.load_frond_set(collection, properties.scale_to_twig)
+
+        times, peak, fronds = measure(load_cold, repeats)
+        record(results, 'load_frond_set', tier, 'cold', times, peak, fronds=len(fronds[0]))
+
+        times, peak, fronds = measure(lambda: gardener_build.load_frond_set(collection, properties.scale_to_twig), repeats)
+        record(results, 'load_frond_set', tier, 'warm', times, peak, fronds=len(fronds[0]))
+
+        # The tree itself, a fresh skeleton every run as building smooths node radii in place.
+        # Fronds go last, the vertex colors below use that build.
+        for scenario, scene in (('bark', synthetic.make_scene()),
+                                ('reduce_angle', synthetic.make_scene(gardener_reduce_edgeloops=True)),
+                                ('reduce_tolerance', synthetic.make_scene(gardener_reduce_edgeloops=True,
+                                                                          gardener_edgeloop_reduce_mode='Tolerance')),
+                                ('frond_instances', synthetic.make_scene(collection, gardener_frond_output='Instances')),
+                                ('branch_to_frond', synthetic.make_scene(collection, 
+                                                                         gardener_datalayer_branchtofrond=True)),
+                                ('fronds', synthetic.make_scene(collection))):
+            make_tree = lambda: synthetic.make_tree(**shape)
+            branch_count = make_tree().count()
+
+            frond_data = fronds if scene.gardener_use_fronds else []
+            build = lambda tree: build_tree_mesh(gardener_mesh, gardener_build, tree, properties, scene, frond_data)
+            times, peak, built = measure(build, repeats, setup=make_tree)
+            vertices, faces, uvs, simulation_data = built
+            record(results, 'build_branches_mesh', tier, scenario, times, peak, vertices=len(vertices),
+                   faces=len(faces), branches=branch_count)
+
+        # Rebuilding one tree with the branch cache on while the thickness cutoff moves back and forth,
+        # like dragging the slider on a finished tree.
+        tree = synthetic.make_tree(**shape)
+        slider = [synthetic.make_scene(collection, gardener_cache_branches=True, gardener_thickness_cutoff=cutoff)
+                  for cutoff in (0.1, 0.11)]
+        build_tree_mesh(gardener_mesh, gardener_build, tree, properties, slider[0], fronds)
+        moves = []
+
+        def retune():
+            moves.append(None)
+            return build_tree_mesh(gardener_mesh, gardener_build, tree, properties, slider[len(moves) % 2], fronds)
+
+        times, peak, rebuilt = measure(retune, repeats)
+        cache = gardener_build.branch_cache
+        record(results, 'build_branches_mesh', tier, 'retune', times, peak, vertices=len(rebuilt[0]),
+               faces=len(rebuilt[1]), branches_reused=cache.hits, branches_rebuilt=cache.misses)
+        cache.clear()
+
+        # Exporting the tree into flat arrays, done once at the start of every build.
+        times, peak, skeleton = measure(gardener_mesh.TreeSkeleton.from_tree, repeats,
+                                        setup=lambda: synthetic.make_tree(**shape))
+        record(results, 'export_skeleton', tier, 'tree', times, peak, branches=len(skeleton), nodes=len(skeleton.nodes))
+
+        # The replacement preview redrawing while the thickness cutoff moves, everything short of the GPU batch.
+        preview = gardener_mesh.SkeletonPreview.from_tree(synthetic.make_tree(**shape))
+        frond_bounds = numpy.stack([numpy.stack([frond.coords.min(axis=0), frond.coords.max(axis=0)])
+                                    for frond in fronds[0]])
+        frond_ids = preview.pick_fronds(fronds[2], 0.0)
+        cutoffs = []
+
+        def redraw_preview():
+            cutoffs.append(None)
+            replaced, hidden = preview.replaced('Thickness', (0.1, 0.11)[len(cutoffs) % 2], 2, 0.2)
+            lines = preview.skeleton_lines(~replaced & ~hidden)
+            boxes, box_ids = preview.frond_boxes(replaced, frond_ids, frond_bounds, 0.4, 0.4)
+            return len(lines) + len(boxes)
+
+        times, peak, points = measure(redraw_preview, repeats)
+        record(results, 'preview', tier, 'retune', times, peak, branches=len(preview), line_points=points)
+
+        # Counting the tree instead of building it, checked against a build with the same settings.
+        count_scene = synthetic.make_scene(collection, gardener_reduce_edgeloops=True)
+        gardener = gardener_build.get_gardener_settings(count_scene, properties.scale_to_twig)
+        count = lambda tree: gardener_build.count_tree_polygons(tree, properties, gardener, fronds)
+        times, peak, table = measure(count, repeats, setup=lambda: synthetic.make_tree(**shape))
+        counted = table.totals(True, gardener.replace_type, gardener.thickness_cutoff, gardener.hierarchy_cutoff,
+                               gardener.length_cutoff)
+        built = build_tree_mesh(gardener_mesh, gardener_build, synthetic.make_tree(**shape), properties, count_scene,
+                                fronds)
+        record(results, 'count_tree_polygons', tier, 'fronds', times, peak, vertices=counted[0], faces=counted[1],
+               triangles=counted[2], matches_build=counted[:2] == (len(built[0]), len(built[1])))
+
+        budget = counted[2] // 2
+        times, peak, solved = measure(lambda: table.solve(budget, 'Thickness', 0.1, 2, 0.2), repeats)
+        record(results, 'poly_count_solve', tier, 'thickness', times, peak, budget=budget, triangles=solved[2])
+
+        # A three level LOD chain, every level after the first meshed from the skeletons the first one left.
+        lod_scene = synthetic.make_scene(collection, gardener_lod_levels=3)
+        chain = lambda tree: build_lod_chain(gardener_mesh, gardener_build, tree, properties, lod_scene, fronds)
+        times, peak, levels = measure(chain, repeats, setup=lambda: synthetic.make_tree(**shape))
+        record(results, 'build_lod_chain', tier, 'fronds', times, peak, 
+               triangles=[level[1].triangle_count() for level in levels])
+
+        # Vertex colors, on the tree built with fronds.
+        me = gardener_build.write_mesh(bpy.data.meshes.new('GardenerBench_' + tier), vertices, faces, uvs)
+        ob = bpy.data.objects.new(me.name, me)
+        layers = simulation_data.views()
+        channels = (layers['layer_height'], layers['layer_trunk_distance'],
+                    layers['layer_branch_distance'], layers['layer_thickness'])
+
+        def add_colors():
+            gardener_build.vertex_colors_layer_from_colors(ob, 'GardenerBench', *channels)
+            # Only eight color layers fit on a mesh.
+            me.vertex_colors.remove(me.vertex_colors['GardenerBench'])
+
+        times, peak, _ = measure(add_colors, repeats)
+        record(results, 'vertex_colors_layer_from_colors', tier, 'fronds', times, peak, vertices=len(vertices))
+
+        bpy.data.objects.remove(ob)
+        bpy.data.meshes.remove(me)
+
+        # The old nearest-distance lookup, kept around in GardenerBuild.
+        rng = numpy.random.default_rng(1)
+        distances = sorted(rng.uniform(0.0, 10.0, 64).tolist())
+        queries = rng.uniform(0.0, 10.0, 1000 * fronds_per_tier).tolist()
+
+        def find_boundaries():
+            take_boundaries = gardener_build.take_boundaries
+            for query in queries:
+                take_boundaries(distances, query)
+
+        times, peak, _ = measure(find_boundaries, repeats)
+        record(results, 'take_boundaries', tier, 'queries', times, peak, queries=len(queries))
+
+    finally:
+        synthetic.remove_frond_collection(bpy, collection)
+
+
+def compare(results, path):
+    """
+    Prints the change in fastest wall time for every benchmark also found in an earlier results file.
+    """
+
+    with open(path) as f:
+        previous = json.load(f)
+
+    earlier = {(r['benchmark'], r['tier'], r['scenario']): r for r in previous['results']}
+
+    print('\nAgainst ' + path)
+    for result in results:
+        key = (result['benchmark'], result['tier'], result['scenario'])
+        if key not in earlier:
+            continue
+        ratio = result['wall_time_min'] / earlier[key]['wall_time_min']
+        print('{:<34} {:<7} {:<7} {:>7.2f}x {}'.format(*key, ratio, 'slower' if ratio > 1.0 else 'faster'))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks the Gardener meshing path.')
+    parser.add_argument('--tiers', nargs='+', default=list(synthetic.TIERS), choices=list(synthetic.TIERS))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default='gardener_benchmarks.json')
+    parser.add_argument('--compare', default=None)
+    args = parser.parse_args(argv)
+
+    gardener_mesh, gardener_build = load_gardener()
+
+    results = []
+    for tier in args.tiers:
+        run_tier(gardener_mesh, gardener_build, tier, max(args.repeats, 1), results)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'blender': bpy.app.version_string,
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'tiers': {tier: synthetic.TIERS[tier] for tier in args.tiers},
+        'results': results,
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('\nResults written to ' + args.output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    # Blender passes its own arguments too, ours come after the --.
+    main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
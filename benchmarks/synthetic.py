@@ -0,0 +1,297 @@
+# Synthetic trees, scenes and frond libraries for benchmarking Gardener without The Grove.
+#
+# Node, Branch, deviate, two_point_transform and pre_compute_circles stand in for the parts of
+# The Grove that build_branches_mesh leans on.  They only need to be shaped like the real thing,
+# the numbers they produce just have to look enough like a tree to exercise every code path.
+
+import random
+from math import cos, sin, pi
+from types import SimpleNamespace
+
+from mathutils import Matrix, Vector, Quaternion
+
+
+class Node:
+    """
+    Stand-in for The Grove's Node, holding only what build_branches_mesh reads.
+    """
+
+    def __init__(self, direction):
+        self.direction = direction
+        self.pos = Vector((0.0, 0.0, 0.0))
+        self.pos_last_year = Vector((0.0, 0.0, 0.0))
+        self.radius = 0.01
+        self.radius_last_year = 0.01
+        self.thickness = 0.02
+        self.age = 1
+        self.weight = 1.0
+        self.photosynthesis = 1.0
+        self.dead = False
+        self.sub_branches = []
+
+
+class Branch:
+    """
+    Stand-in for The Grove's Branch.  build_branches_mesh is attached by the benchmark runner once
+    the Gardener version of it has been loaded.
+    """
+
+    def __init__(self, nodes, is_trunk=False, power=1.0, shade=0.0, seed=0):
+        rng = random.Random(seed)
+
+        self.nodes = nodes
+        self.is_trunk = is_trunk
+        self.dead = False
+        self.power = power
+        self.shade = shade
+        self.uv_offset_x = rng.random()
+        self.uv_offset_y = rng.random()
+        self.initial_phyllotaxic_angle = rng.random() * 2.0 * pi
+
+    def count(self):
+        """
+        Returns the number of branches in this branch and everything growing from it.
+        """
+
+        return 1 + sum(sub.count() for node in self.nodes for sub in node.sub_branches)
+
+
+def pre_compute_circles(resolution):
+    """
+    Unit circles for every profile resolution up to the given one, indexed by resolution.
+    """
+
+    circles = [[]]
+    for res in range(1, resolution + 1):
+        circles.append([Vector((cos(i / res * 2.0 * pi), sin(i / res * 2.0 * pi), 0.0)) for i in range(res)])
+
+    return circles
+
+
+def two_point_transform(point_1, point_2):
+    """
+    A 4x4 rotation that points Z from point_1 towards point_2.
+    """
+
+    direction = point_2 - point_1
+    if direction.length == 0.0:
+        return Matrix()
+
+    return direction.to_track_quat('Z', 'Y').to_matrix().to_4x4()
+
+
+def deviate(branch_angle, branching, twist, initial_phyllotaxic_angle,
+            plagiotropism_buds, add_planar, random_heading, direction, node_index, bud_index):
+    """
+    Bends a direction away by the branch angle and spins it around phyllotaxically, close enough
+    to The Grove's lateral bud directions for placing twigs.
+    """
+
+    if direction.length == 0.0:
+        direction = Vector((0.0, 0.0, 1.0))
+
+    axis = direction.orthogonal().normalized()
+    spin = initial_phyllotaxic_angle + node_index * 2.4 + bud_index * 2.0 * pi / max(branching, 1) + twist
+    bent = Quaternion(axis, branch_angle) @ direction.normalized()
+
+    return Quaternion(direction.normalized(), spin) @ bent
+
+
+# Size tiers, from a sapling to something that takes a while to build.
+TIERS = {
+    'small': dict(depth=3, branching=3, nodes=8),
+    'medium': dict(depth=4, branching=4, nodes=10),
+    'large': dict(depth=5, branching=4, nodes=12),
+}
+
+
+def make_tree(depth=3, branching=3, nodes=8, seed=1, internode=0.3, trunk_radius=0.15, tree_age=12):
+    """
+    Grows a deterministic tree skeleton.
+
+    Every branch has the given number of nodes and, until the depth runs out, the given number of
+    sub branches spread over its inner nodes.  Radius, internode length and age drop off with each
+    level so thin branches still end up being replaced by fronds.
+    """
+
+    rng = random.Random(seed)
+
+    def grow(start, direction, level, radius, age, is_trunk):
+        branch_nodes = []
+        position = start.copy()
+        heading = direction.normalized()
+        length = internode * (0.75 ** level)
+
+        for i in range(nodes):
+            fraction = i / (nodes - 1)
+            node = Node(heading.copy())
+            node.pos = position.copy()
+            node.pos_last_year = position.copy()
+            node.radius = max(radius * (1.0 - 0.8 * fraction), 0.002)
+            node.radius_last_year = node.radius * 0.95
+            node.thickness = node.radius * 2.0
+            node.age = max(int(age * (1.0 - fraction)), 1)
+            node.weight = node.radius * 10.0
+            node.photosynthesis = 0.5 + 0.5 * rng.random()
+            branch_nodes.append(node)
+
+            # Wander a little, with a pull back up.
+            wobble = Vector((rng.uniform(-0.3, 0.3), rng.uniform(-0.3, 0.3), rng.uniform(-0.1, 0.3)))
+            heading = (heading + wobble * 0.5).normalized()
+            position = position + heading * length
+
+        branch = Branch(branch_nodes, is_trunk=is_trunk, power=rng.uniform(0.5, 1.0),
+                        shade=rng.random(), seed=rng.randrange(1 << 30))
+
+        if level < depth:
+            inner = list(range(1, nodes - 1))
+            for b in range(branching):
+                i = inner[(b * len(inner)) // branching + rng.randrange(max(len(inner) // branching, 1))]
+                parent = branch_nodes[i]
+                side = deviate(0.8, branching, 0.0, branch.initial_phyllotaxic_angle, 0.0, 0.0, 0.0,
+                               parent.direction, i, b)
+                sub = grow(parent.pos, side, level + 1, parent.radius * 0.6, parent.age, False)
+                parent.sub_branches.append(sub)
+
+        return branch
+
+    return grow(Vector((0.0, 0.0, 0.0)), Vector((0.0, 0.0, 1.0)), 0, trunk_radius, tree_age, True)
+
+
+def make_properties(**overrides):
+    """
+    The Grove build properties build_branches_mesh is called with, at its defaults.
+    """
+
+    properties = dict(
+        lateral_on_apical=False,
+        profile_resolution=16,
+        profile_resolution_reduction=0.5,
+        twist=0.0,
+        u_repeat=1,
+        texture_aspect_ratio=3.0,
+        scale_to_twig=1.0,
+        root_distribution=0.2,
+        root_shape=0.3,
+        root_scale=1.5,
+        root_bump=0.5,
+        lateral_twig_age_limit=3,
+        dead_twig_wither=1,
+        branch_angle=0.8,
+        branching=2,
+        plagiotropism_buds=0.0,
+        add_planar=0.0,
+    )
+    properties.update(overrides)
+
+    return SimpleNamespace(**properties)
+
+
+def make_scene(frond_collection=None, **overrides):
+    """
+    Stand-in for bpy.context.scene, carrying the Gardener settings at their addon defaults.
+    Fronds are switched on whenever a frond collection is given.
+    """
+
+    settings = dict(
+        gardener_use_fronds=frond_collection is not None,
+        gardener_frond_collection=frond_collection,
+        gardener_frond_replace_type='Thickness',
+        gardener_thickness_cutoff=0.1,
+        gardener_hierarchy_cutoff=2,
+        gardener_length_cutoff=0.2,
+        gardener_hierarchy_reverse=False,
+        gardener_frond_match_weight=0.0,
+        gardener_preview=False,
+        gardener_smooth_factor=0.4,
+        gardener_stretch_factor_x=0.4,
+        gardener_stretch_factor_yz=0.4,
+        gardener_frond_output='Mesh',
+        gardener_realize_fronds=False,
+        gardener_reduce_edgeloops=False,
+        gardener_edgeloop_reduce_mode='Angle',
+        gardener_edgeloop_reduce_factor=0.9,
+        gardener_edgeloop_tolerance=0.005,
+        gardener_normal_use_reproject=True,
+        gardener_normal_reproject_mode='Field',
+        gardener_normal_hull_res=0.5,
+        gardener_normal_hull_size=0.2,
+        gardener_datalayer_height=False,
+        gardener_datalayer_trunktobranch=False,
+        gardener_datalayer_branchtofrond=False,
+        gardener_datalayer_branchgroup=False,
+        gardener_merge_layers=False,
+        gardener_branch_group_seed=0,
+        gardener_verbose=False,
+        gardener_count_polygons=False,
+        gardener_triangle_budget=20000,
+        gardener_lod_levels=1,
+        gardener_lod_cutoff_scale=2.0,
+        gardener_lod_resolution_scale=0.6,
+        gardener_lod_edgeloop_step=0.05,
+        gardener_profile_build=False,
+        gardener_cache_branches=False,
+    )
+    settings.update(overrides)
+
+    return SimpleNamespace(**settings)
+
+
+def make_frond_collection(bpy, name='GardenerBenchFronds', count=6, segments=8, seed=1):
+    """
+    Builds a frond library in bpy.data: strips of quads lying along +X with a UV map and a material
+    each, from short and narrow to long and wide.  Returns the collection.
+    """
+
+    rng = random.Random(seed)
+
+    collection = bpy.data.collections.new(name)
+    bpy.context.scene.collection.children.link(collection)
+
+    # A few fronds share each material, like a real library would.
+    materials = [bpy.data.materials.new('{}_Material_{}'.format(name, m)) for m in range(3)]
+
+    for k in range(count):
+        length = 0.2 + 1.3 * k / max(count - 1, 1)
+        width = length * rng.uniform(0.2, 0.4)
+
+        coords = []
+        for s in range(segments + 1):
+            x = length * s / segments
+            half = 0.5 * width * sin(pi * (0.15 + 0.85 * s / segments))
+            droop = -0.1 * x * x
+            coords.append((x, -half, droop))
+            coords.append((x, half, droop))
+
+        faces = [(2 * s, 2 * s + 2, 2 * s + 3, 2 * s + 1) for s in range(segments)]
+
+        me = bpy.data.meshes.new('{}_{}'.format(name, k))
+        me.from_pydata(coords, [], faces)
+        uv_layer = me.uv_layers.new(name='UVMap')
+        for loop in me.loops:
+            co = coords[loop.vertex_index]
+            uv_layer.data[loop.index].uv = (co[0] / length, co[1] / width + 0.5)
+        me.materials.append(materials[k % len(materials)])
+        me.update()
+
+        ob = bpy.data.objects.new(me.name, me)
+        collection.objects.link(ob)
+
+    return collection
+
+
+def remove_frond_collection(bpy, collection):
+    """
+    Deletes a collection made by make_frond_collection along with its objects, meshes and materials.
+    """
+
+    for ob in list(collection.objects):
+        me = ob.data
+        materials = [mat for mat in me.materials if mat]
+        bpy.data.objects.remove(ob)
+        bpy.data.meshes.remove(me)
+        for mat in materials:
+            if mat.name in bpy.data.materials and mat.users == 0:
+                bpy.data.materials.remove(mat)
+
+    bpy.data.collections.remove(collection)